@@ -0,0 +1,429 @@
+#!/usr/bin/env python3
+
+'''Benchmarks of the main paths of timesheet.py, ts.py, j2pp.py and the log
+analysis tools, at production sizes
+
+Every scenario runs a tool as a separate process on a large, synthetic input
+(see ``generate.py``), a number of times, and reports:
+
+- the latency of a run: min, p50, p90, p99, max and mean (seconds);
+- the throughput: rows (or log lines) per second, based on the p50 latency;
+- the peak RSS (resident memory) of the process, in MB.
+
+The results are written as JSON. With ``--baseline`` (or the ``compare``
+command) they are compared to a stored result: a scenario whose p50 latency
+or peak RSS grew by more than the tolerance is flagged as a regression, and
+the exit code is 1.
+
+Usage:
+
+  ./bench.py list
+  ./bench.py run --scale 0.1 -o baseline.json
+  ... change the code ...
+  ./bench.py run --scale 0.1 --baseline baseline.json -o current.json
+  ./bench.py run -k 'loganalysis-*' --repeat 10
+
+The generated inputs are kept in the data directory (env. variable
+``BENCH_DATA`` or ``~/.cache/python-tuesday/bench``) and re-used by the next
+runs; at scale 1 they take about 2GB of disk space.
+'''
+
+__author__ = 'Gábor Nyers'
+__version__ = '0.1.0'
+__license__ = 'CC BY-NC 4.0'
+
+import fnmatch
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass
+
+import generate
+
+REPO = generate.REPO
+DATA_DIR = os.environ.get(
+    'BENCH_DATA', os.path.expanduser('~/.cache/python-tuesday/bench'))
+FORMAT_VERSION = 1                      # of the JSON results
+TOLERANCE = 0.10                        # max. 10% slower / more memory
+
+SIZES = {
+    # kind of input: nr. of rows (lines) at scale 1
+    'bookings': 2_000_000,
+    'workbook': 300_000,
+    'names-csv': 1_000_000,
+    'names-yaml': 100_000,
+    'apache-log': 5_000_000,            # about 1GB
+}
+
+TEMPLATES = {
+    # file name: content, written to the work directory
+    'names.j2': '{% for r in csv %}{{ r.name }};{{ r.full_name }};'
+                '{{ r.group }};{{ r.age }}\n{% endfor %}',
+    'people.j2': '{% for r in people %}{{ r.name }};{{ r.full_name }};'
+                 '{{ r.group }};{{ r.age }}\n{% endfor %}',
+}
+
+
+@dataclass
+class Scenario:
+    '''A timed command line; in `args` "{data}" is replaced by the path of
+    the input and "{work}" by the work directory'''
+    name: str
+    tool: str                           # path of the program in the repo
+    data: str                           # kind of input, see SIZES
+    args: tuple
+    unit: str = 'rows'
+    copy: bool = False                  # run on a fresh copy of the input
+    fresh: str = None                   # remove this file before each run
+    pythonpath: tuple = ()              # dirs of optional modules in the repo
+
+
+TIMESHEET = 'session04/timesheet.py'
+TS = 'session03/ts.py'
+J2PP = 'session11/j2pp.py'
+APACHELOG = 'session05/apachelog.py'
+LOGANALYSIS = 'session05/loganalysis.py'
+
+SCENARIOS = [
+    Scenario('timesheet-dump', TIMESHEET, 'bookings',
+             ('-d', '{data}', 'dump-table', 'bookings', '-f', 'csv')),
+    Scenario('timesheet-export-user', TIMESHEET, 'bookings',
+             ('-d', '{data}', 'export-xlsx', '-b', 'user',
+              '{work}/export.xlsx'), copy=True),
+    Scenario('timesheet-export-project', TIMESHEET, 'bookings',
+             ('-d', '{data}', 'export-xlsx', '-b', 'project',
+              '{work}/export.xlsx'), copy=True),
+    Scenario('ts-list', TS, 'workbook', ('-w', '{data}', 'list')),
+    Scenario('ts-dump', TS, 'workbook', ('-w', '{data}', 'dump', 'Bookings')),
+    Scenario('ts-addrec', TS, 'workbook',
+             ('-w', '{data}', 'addrec', '-n', 'Bookings',
+              '2023-01-02;Fred Flintstone;Project 1;8;benchmark'), copy=True),
+    Scenario('j2pp-csv', J2PP, 'names-csv',
+             ('-d', '{data}', '-o', '{work}/out.txt', '{work}/names.j2')),
+    Scenario('j2pp-csv-typed', J2PP, 'names-csv',
+             ('-d', '{data}', '--typed-csv', '-o', '{work}/out.txt',
+              '{work}/names.j2'), pythonpath=('session02',)),
+    Scenario('j2pp-yaml', J2PP, 'names-yaml',
+             ('-d', '{data}', '-o', '{work}/out.txt', '{work}/people.j2')),
+    Scenario('apachelog-parse', APACHELOG, 'apache-log', ('{data}',),
+             unit='lines'),
+    Scenario('loganalysis-stats', LOGANALYSIS, 'apache-log',
+             ('stats', '--json', '{data}'), unit='lines'),
+    Scenario('loganalysis-stream', LOGANALYSIS, 'apache-log',
+             ('stream', '{data}'), unit='lines'),
+    Scenario('loganalysis-ingest', LOGANALYSIS, 'apache-log',
+             ('ingest', '-d', '{work}/logstore.db', '{data}'), unit='lines',
+             fresh='{work}/logstore.db'),
+]
+
+
+def percentile(values, p):
+    '''Return the `p`-th percentile of `values`, interpolated linearly'''
+    values = sorted(values)
+    pos = (len(values) - 1) * p / 100
+    lo = int(pos)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (pos - lo)
+
+
+# Runs a command and reports its wall-clock time, peak RSS and exit code.
+# Linux carries the peak RSS of a process over fork() and exec(), so the
+# measured command must not be started by the harness itself: its RSS (and
+# that of the input generators) would be included. This small, fresh process
+# starts it instead, only its own few MBs are included.
+LAUNCHER = '''
+import os, sys, time
+began = time.perf_counter()
+pid = os.fork()
+if pid == 0:
+    os.dup2(os.open(os.devnull, os.O_WRONLY), 1)
+    try:
+        os.execv(sys.argv[1], sys.argv[1:])
+    except OSError as e:
+        print(f'{sys.argv[1]}: {e}', file=sys.stderr)
+    os._exit(127)
+_, status, usage = os.wait4(pid, 0)
+elapsed = time.perf_counter() - began
+print(elapsed, usage.ru_maxrss, os.waitstatus_to_exitcode(status))
+'''
+
+
+def run_once(argv, env, cwd):
+    '''Run `argv`, return (seconds, peak RSS in bytes, exit code, stderr)'''
+    with tempfile.TemporaryFile() as err:
+        proc = subprocess.run([sys.executable, '-S', '-c', LAUNCHER] + argv,
+                              stdout=subprocess.PIPE, stderr=err, env=env,
+                              cwd=cwd, text=True)
+        err.seek(0)
+        stderr = err.read().decode(errors='replace')
+    if proc.returncode != 0:
+        return 0.0, 0, proc.returncode, stderr
+    elapsed, maxrss, code = proc.stdout.split()
+    # ru_maxrss is in KB on Linux, in bytes on macOS
+    rss = int(maxrss) * (1 if sys.platform == 'darwin' else 1024)
+    return float(elapsed), rss, int(code), stderr
+
+
+def scaled(scale):
+    '''Return the sizes of the inputs at `scale`'''
+    return {kind: max(1, int(size * scale)) for kind, size in SIZES.items()}
+
+
+def run_scenario(scenario, data, units, work, repeat=5, warmup=0):
+    '''Run the `scenario` `warmup` + `repeat` times on the input `data` of
+    `units` rows (lines), return its results'''
+    env = dict(os.environ)
+    if scenario.pythonpath:
+        env['PYTHONPATH'] = os.pathsep.join(
+            [os.path.join(REPO, d) for d in scenario.pythonpath]
+            + [p for p in [env.get('PYTHONPATH')] if p])
+    latencies, peak_rss = [], 0
+    for i in range(warmup + repeat):
+        path = data
+        if scenario.copy:               # not timed
+            path = os.path.join(work, 'copy-' + os.path.basename(data))
+            shutil.copyfile(data, path)
+        if scenario.fresh:
+            fresh = scenario.fresh.format(work=work)
+            if os.path.exists(fresh):
+                os.unlink(fresh)
+        argv = [sys.executable, os.path.join(REPO, scenario.tool)]
+        argv += [a.format(data=path, work=work) for a in scenario.args]
+        elapsed, rss, code, stderr = run_once(argv, env, work)
+        if code != 0:
+            return {'command': ' '.join(argv[1:]), 'error':
+                    f'exit code {code}: {stderr.strip()[-500:]}'}
+        if i >= warmup:
+            latencies.append(elapsed)
+            peak_rss = max(peak_rss, rss)
+    p50 = percentile(latencies, 50)
+    return {
+        'command': ' '.join(argv[1:]),
+        'runs': len(latencies),
+        'units': units,
+        'unit': scenario.unit,
+        'latency_s': {
+            'min': min(latencies),
+            'p50': p50,
+            'p90': percentile(latencies, 90),
+            'p99': percentile(latencies, 99),
+            'max': max(latencies),
+            'mean': sum(latencies) / len(latencies),
+        },
+        'throughput': units / p50 if p50 else None,
+        'peak_rss_mb': round(peak_rss / 2**20, 1),
+    }
+
+
+def select(patterns):
+    '''Return the scenarios matching any of the glob `patterns`'''
+    if not patterns:
+        return SCENARIOS
+    return [s for s in SCENARIOS
+            if any(fnmatch.fnmatchcase(s.name, p) for p in patterns)]
+
+
+def run(scenarios, scale=1.0, seed=generate.SEED, repeat=5, warmup=0,
+        data_dir=DATA_DIR):
+    '''Run the `scenarios`, return the results (a JSON-able dict)'''
+    sizes = scaled(scale)
+    results = {}
+    with tempfile.TemporaryDirectory(prefix='bench-') as work:
+        for name, content in TEMPLATES.items():
+            with open(os.path.join(work, name), 'w') as fh:
+                fh.write(content)
+        for scenario in scenarios:
+            units = sizes[scenario.data]
+            data = generate.ensure(scenario.data, units, data_dir, seed)
+            print(f'Running {scenario.name} ...', file=sys.stderr)
+            results[scenario.name] = res = run_scenario(
+                scenario, data, units, work, repeat, warmup)
+            if 'error' in res:
+                print(f'  {res["error"]}', file=sys.stderr)
+            else:
+                print(f'  p50 {res["latency_s"]["p50"]:.3f}s, '
+                      f'{res["throughput"]:,.0f} {res["unit"]}/s, '
+                      f'peak RSS {res["peak_rss_mb"]} MB', file=sys.stderr)
+    return {
+        'version': FORMAT_VERSION,
+        'meta': {
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'scale': scale,
+            'seed': seed,
+            'repeat': repeat,
+        },
+        'results': results,
+    }
+
+
+def compare(current, baseline, tolerance=TOLERANCE):
+    '''Compare the p50 latency and the peak RSS of the scenarios in both
+    result sets, return a list of
+    (scenario, metric, baseline value, current value, change, status)'''
+    rows = []
+    for name, cur in current['results'].items():
+        base = baseline['results'].get(name)
+        if not base or 'error' in cur or 'error' in base:
+            continue
+        for metric, get in (('p50_s', lambda r: r['latency_s']['p50']),
+                            ('peak_rss_mb', lambda r: r['peak_rss_mb'])):
+            b, c = get(base), get(cur)
+            change = c / b - 1 if b else 0.0
+            status = ('REGRESSION' if change > tolerance
+                      else 'improved' if change < -tolerance else 'ok')
+            rows.append((name, metric, b, c, change, status))
+    return rows
+
+
+def print_comparison(rows, current, baseline, file=sys.stderr):
+    for key in ('scale', 'seed', 'cpus', 'python'):
+        b, c = baseline['meta'].get(key), current['meta'].get(key)
+        if b != c:
+            print(f'WARNING: different {key}: {b} (baseline) vs. {c}',
+                  file=file)
+    print(f'{"scenario":<28} {"metric":<12} {"baseline":>10} {"current":>10} '
+          f'{"change":>8}  status', file=file)
+    for name, metric, b, c, change, status in rows:
+        print(f'{name:<28} {metric:<12} {b:>10.3f} {c:>10.3f} '
+              f'{change:>+8.1%}  {status}', file=file)
+
+
+def load_results(path):
+    with open(path) as fh:
+        results = json.load(fh)
+    if results.get('version') != FORMAT_VERSION:
+        raise ValueError(f'{path}: unknown format version')
+    return results
+
+
+def cmd_list(args):
+    '''Handle the "list" sub-command'''
+    sizes = scaled(args.scale)
+    for s in select(args.select):
+        print(f'{s.name:<28} {s.tool:<26} {s.data} '
+              f'({sizes[s.data]:,} {s.unit})')
+    return 0
+
+
+def cmd_generate(args):
+    '''Handle the "generate" sub-command'''
+    sizes = scaled(args.scale)
+    for kind in sorted({s.data for s in select(args.select)}):
+        print(generate.ensure(kind, sizes[kind], args.data_dir, args.seed))
+    return 0
+
+
+def cmd_run(args):
+    '''Handle the "run" sub-command'''
+    scenarios = select(args.select)
+    if not scenarios:
+        print('No matching scenarios', file=sys.stderr)
+        return 2
+    baseline = load_results(args.baseline) if args.baseline else None
+    results = run(scenarios, args.scale, args.seed, args.repeat, args.warmup,
+                  args.data_dir)
+    regressions = 0
+    if baseline:
+        rows = compare(results, baseline, args.tolerance)
+        print_comparison(rows, results, baseline)
+        results['comparison'] = {
+            'baseline': args.baseline, 'tolerance': args.tolerance,
+            'regressions': [r[:2] for r in rows if r[5] == 'REGRESSION']}
+        regressions = len(results['comparison']['regressions'])
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump(results, fh, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    errors = [n for n, r in results['results'].items() if 'error' in r]
+    return 1 if regressions or errors else 0
+
+
+def cmd_compare(args):
+    '''Handle the "compare" sub-command'''
+    current, baseline = load_results(args.current), load_results(args.baseline)
+    rows = compare(current, baseline, args.tolerance)
+    print_comparison(rows, current, baseline, file=sys.stdout)
+    return 1 if any(r[5] == 'REGRESSION' for r in rows) else 0
+
+
+def parseargs(cmdline=sys.argv[1:]):
+    '''Parse CLI arguments
+    '''
+    import argparse
+    p = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    sp = p.add_subparsers(help='commands', required=True)
+
+    def common(parser):
+        parser.add_argument('-s', '--scale', type=float, default=1.0,
+                            help='multiply the sizes of the inputs by this '
+                            'factor, e.g.: 0.01 for a quick check '
+                            '(default: 1)')
+        parser.add_argument('--seed', type=int, default=generate.SEED,
+                            help='seed of the input generators (default: '
+                            f'{generate.SEED})')
+        parser.add_argument('-d', '--data-dir', default=DATA_DIR,
+                            help='directory of the generated inputs '
+                            f'(default: env. variable "BENCH_DATA" or '
+                            f'{DATA_DIR})')
+        parser.add_argument('-k', '--select', nargs='+', metavar='PATTERN',
+                            help='only the scenarios matching these glob '
+                            'patterns, e.g.: "ts-*"')
+
+    sp_list = sp.add_parser('list', help='List the scenarios')
+    common(sp_list)
+    sp_list.set_defaults(func=cmd_list)
+
+    sp_gen = sp.add_parser('generate', help='Generate the inputs only')
+    common(sp_gen)
+    sp_gen.set_defaults(func=cmd_generate)
+
+    sp_run = sp.add_parser('run', help='Run the benchmarks')
+    common(sp_run)
+    sp_run.add_argument('-r', '--repeat', type=int, default=5,
+                        help='nr. of timed runs per scenario (default: 5)')
+    sp_run.add_argument('-w', '--warmup', type=int, default=0,
+                        help='nr. of untimed runs first (default: 0)')
+    sp_run.add_argument('-o', '--output',
+                        help='write the JSON results to this file '
+                        '(default: STDOUT)')
+    sp_run.add_argument('-b', '--baseline', metavar='JSON',
+                        help='compare the results to these stored results')
+    sp_run.add_argument('-t', '--tolerance', type=float, default=TOLERANCE,
+                        help='flag a regression above this relative '
+                        f'increase (default: {TOLERANCE})')
+    sp_run.set_defaults(func=cmd_run)
+
+    sp_cmp = sp.add_parser('compare', help='Compare two stored results')
+    sp_cmp.add_argument('-t', '--tolerance', type=float, default=TOLERANCE,
+                        help='flag a regression above this relative '
+                        f'increase (default: {TOLERANCE})')
+    sp_cmp.add_argument('current', help='JSON results of the new code')
+    sp_cmp.add_argument('baseline', help='JSON results to compare to')
+    sp_cmp.set_defaults(func=cmd_compare)
+
+    return p.parse_args(cmdline)
+
+
+def main():
+    args = parseargs()
+    try:
+        return args.func(args)
+    except (OSError, ValueError) as e:
+        print(f'Error: {e}', file=sys.stderr)
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+
+'''Deterministic generators of large synthetic inputs for the benchmarks
+
+The sample inputs of the sessions are small (a few KB, the 10k-line Apache
+log), too small to tell whether a change speeds up or slows down a tool at
+production sizes. These generators create inputs of any size:
+
+- ``bookings``: a SQLite database of ``session04/timesheet.py``;
+- ``workbook``: an XLSX workbook for ``session03/ts.py``;
+- ``names-csv``, ``names-yaml``: data files for ``session11/j2pp.py``, like
+  ``demo_names_data.csv``, with a few extra typed columns;
+- ``apache-log``: an Apache access log, like ``apache_logs-public-example``.
+
+The output only depends on the size and the seed: the same arguments always
+generate the same file, so results of different runs (and machines) can be
+compared. Files are written to a temporary name first and renamed when
+complete, an existing file is re-used.
+
+Usage:
+
+  ./generate.py apache-log 1000000 /tmp/access.log
+'''
+
+__author__ = 'Gábor Nyers'
+__version__ = '0.1.0'
+__license__ = 'CC BY-NC 4.0'
+
+import calendar
+import csv
+import datetime
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TIMESHEET = os.path.join(REPO, 'session04', 'timesheet.py')
+SEED = 42
+BATCH = 10_000                          # nr. of rows generated at once
+
+FIRST_NAMES = '''fred wilma pebbles barney betty bamm-bamm dino george jane
+judy elroy astro rosie homer marge bart lisa maggie ned maude'''.split()
+SURNAMES = '''Flintstone Rubble Jetson Simpson Flanders Bravo Smith Jones
+Nyers Janssen deVries Bakker Visser Smit Meijer deBoer Mulder'''.split()
+GROUPS = 'flintstones rubbles jetsons simpsons flanders'.split()
+WORDS = '''meeting review design build test deploy fix support planning
+analysis documentation training workshop migration release'''.split()
+
+# pools of the Apache log fields, a real log has few distinct values of most
+PATHS = ['/', '/favicon.ico', '/robots.txt', '/blog/', '/feed/', '/about/']
+PATHS += [f'/blog/{y}/{m:02}/post-{i}.html' for y in (2013, 2014, 2015)
+          for m in range(1, 13) for i in range(5)]
+PATHS += [f'/images/{w}-{i}.png' for w in WORDS for i in range(10)]
+AGENTS = [
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_9_1) AppleWebKit/537.36 '
+    '(KHTML, like Gecko) Chrome/32.0.1700.77 Safari/537.36',
+    'Mozilla/5.0 (Windows NT 6.1; WOW64; rv:27.0) Gecko/20100101 '
+    'Firefox/27.0',
+    'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) '
+    'Chrome/32.0.1700.107 Safari/537.36',
+    'Mozilla/5.0 (iPhone; CPU iPhone OS 7_0_4 like Mac OS X) '
+    'AppleWebKit/537.51.1 (KHTML, like Gecko) Version/7.0 Mobile/11B554a '
+    'Safari/9537.53',
+    'Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)',
+    'Mozilla/5.0 (compatible; bingbot/2.0; +http://www.bing.com/bingbot.htm)',
+    'Tiny Tiny RSS/1.11 (http://tt-rss.org/)',
+    'UniversalFeedParser/4.2-pre-314-svn +http://feedparser.org/',
+    '-',
+]
+REFERRERS = ['-', 'http://www.google.com/', 'http://semicomplete.com/',
+             'http://www.semicomplete.com/blog/', 'https://twitter.com/']
+STATUSES = [200] * 90 + [304] * 4 + [404] * 3 + [301, 206, 500]
+MONTH_NAMES = [None] + 'Jan Feb Mar Apr May Jun Jul Aug Sep Oct Nov Dec'.split()
+
+
+def _replace_when_done(path):
+    '''Return a temporary path next to `path`, to be renamed when done'''
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = f'{path}.tmp{os.getpid()}'
+    if os.path.exists(tmp):
+        os.unlink(tmp)
+    return tmp
+
+
+def person(rng):
+    '''Return a random (name, full name, e-mail)'''
+    fname, sname = rng.choice(FIRST_NAMES), rng.choice(SURNAMES)
+    return (fname, f'{fname.capitalize()} {sname}',
+            f'{fname}.{sname.lower()}{rng.randrange(1000)}@example.com')
+
+
+def bookings(path, rows, seed=SEED):
+    '''Create the timesheet database `path` with `rows` bookings, of
+    `rows` / 1000 users (min. 10) and `rows` / 10000 projects (min. 10)'''
+    rng = random.Random(seed)
+    tmp = _replace_when_done(path)
+    # let timesheet.py itself create the schema
+    subprocess.run([sys.executable, TIMESHEET, '-d', tmp, 'create'],
+                   input='y\n', text=True, check=True,
+                   stdout=subprocess.DEVNULL)
+    nr_users, nr_projects = max(10, rows // 1000), max(10, rows // 10_000)
+    conn = sqlite3.connect(tmp)
+    with conn:
+        users = (person(rng) for _ in range(nr_users))
+        conn.executemany('INSERT INTO users (fname, sname, email) '
+                         'VALUES (?, ?, ?)',
+                         ((p[0].capitalize(), p[1].split()[1], p[2])
+                          for p in users))
+        conn.executemany('INSERT INTO projects (name) VALUES (?)',
+                         ((f'{rng.choice(WORDS).capitalize()} project {i}',)
+                          for i in range(1, nr_projects + 1)))
+        first = datetime.date(2019, 1, 1).toordinal()
+
+        def booking():
+            return (rng.randint(1, nr_users), rng.randint(1, nr_projects),
+                    datetime.date.fromordinal(
+                        first + rng.randrange(730)).isoformat(),
+                    rng.choice((0.5, 1, 2, 4, 6, 8)),
+                    ' '.join(rng.choices(WORDS, k=rng.randint(0, 4))))
+        conn.executemany('INSERT INTO bookings (user, project, date, hours, '
+                         'remarks) VALUES (?, ?, ?, ?, ?)',
+                         (booking() for _ in range(rows)))
+    conn.close()
+    os.replace(tmp, path)
+    return path
+
+
+def workbook(path, rows, seed=SEED):
+    '''Create an XLSX workbook with a "Bookings" sheet of `rows` rows'''
+    import openpyxl
+    rng = random.Random(seed)
+    tmp = _replace_when_done(path)
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet('Bookings')
+    ws.append(['Date', 'Employee', 'Project', 'Hours', 'Remarks'])
+    first = datetime.date(2019, 1, 1).toordinal()
+    employees = [person(rng)[1] for _ in range(100)]
+    for _ in range(rows):
+        ws.append([datetime.date.fromordinal(first + rng.randrange(730)),
+                   rng.choice(employees),
+                   f'Project {rng.randint(1, 50)}',
+                   rng.choice((0.5, 1, 2, 4, 6, 8)),
+                   ' '.join(rng.choices(WORDS, k=rng.randint(0, 4)))])
+    wb.save(tmp)
+    os.replace(tmp, path)
+    return path
+
+
+NAME_FIELDS = ['name', 'full_name', 'group', 'gendergroup', 'agegroup', 'age',
+               'birthday', 'score']
+
+
+def names(rng):
+    '''Yield random records like the ones in demo_names_data.csv'''
+    first = datetime.date(1940, 1, 1).toordinal()
+    while True:
+        name, full_name, _ = person(rng)
+        birthday = datetime.date.fromordinal(first + rng.randrange(30_000))
+        age = 2023 - birthday.year
+        yield {'name': name, 'full_name': full_name,
+               'group': rng.choice(GROUPS), 'gendergroup': rng.choice('mf'),
+               'agegroup': 'kids' if age < 18 else 'adults', 'age': age,
+               'birthday': birthday.isoformat(),
+               'score': round(rng.uniform(0, 100), 2)}
+
+
+def names_csv(path, rows, seed=SEED):
+    '''Create a CSV data file of `rows` names'''
+    rng = random.Random(seed)
+    tmp = _replace_when_done(path)
+    records = names(rng)
+    with open(tmp, 'w', newline='') as fh:
+        w = csv.DictWriter(fh, fieldnames=NAME_FIELDS)
+        w.writeheader()
+        for _ in range(rows):
+            w.writerow(next(records))
+    os.replace(tmp, path)
+    return path
+
+
+def names_yaml(path, rows, seed=SEED):
+    '''Create a YAML data file with a "people" list of `rows` names'''
+    import yaml
+    dumper = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+    rng = random.Random(seed)
+    tmp = _replace_when_done(path)
+    records = names(rng)
+    with open(tmp, 'w') as fh:
+        fh.write('people:\n')
+        for _ in range(0, rows, BATCH):
+            batch = [next(records) for _ in range(min(BATCH, rows))]
+            yaml.dump(batch, fh, Dumper=dumper, sort_keys=False)
+            rows -= len(batch)
+    os.replace(tmp, path)
+    return path
+
+
+def apache_log(path, lines, seed=SEED):
+    '''Create an Apache access log of `lines` lines (about 230 bytes each),
+    starting at 17/May/2015:10:05:03 +0000, like the example log'''
+    rng = random.Random(seed)
+    tmp = _replace_when_done(path)
+    ips = [f'{rng.randint(1, 223)}.{rng.randrange(256)}.{rng.randrange(256)}.'
+           f'{rng.randint(1, 254)}' for _ in range(max(100, lines // 50))]
+    ts = calendar.timegm((2015, 5, 17, 10, 5, 3))
+    stamp, stamp_of = '', None
+    with open(tmp, 'w') as fh:
+        while lines > 0:
+            batch = []
+            for _ in range(min(BATCH, lines)):
+                ts += rng.random() < 0.3        # ~ 3 requests / second
+                if ts != stamp_of:
+                    t = time.gmtime(ts)
+                    stamp = (f'{t.tm_mday:02}/{MONTH_NAMES[t.tm_mon]}/'
+                             f'{t.tm_year}:{t.tm_hour:02}:{t.tm_min:02}:'
+                             f'{t.tm_sec:02} +0000')
+                    stamp_of = ts
+                status = rng.choice(STATUSES)
+                size = '-' if status == 304 else rng.randrange(100, 250_000)
+                batch.append(
+                    f'{rng.choice(ips)} - - [{stamp}] "GET {rng.choice(PATHS)}'
+                    f' HTTP/1.1" {status} {size} "{rng.choice(REFERRERS)}" '
+                    f'"{rng.choice(AGENTS)}"\n')
+            fh.writelines(batch)
+            lines -= len(batch)
+    os.replace(tmp, path)
+    return path
+
+
+GENERATORS = {
+    # 'kind': (generator function, file extension)
+    'bookings': (bookings, '.db'),
+    'workbook': (workbook, '.xlsx'),
+    'names-csv': (names_csv, '.csv'),
+    'names-yaml': (names_yaml, '.yaml'),
+    'apache-log': (apache_log, '.log'),
+}
+
+
+def input_path(kind, size, data_dir, seed=SEED):
+    '''Return the path of the `kind` of input of `size` in `data_dir`'''
+    return os.path.join(data_dir, f'{kind}-{size}-s{seed}'
+                        f'{GENERATORS[kind][1]}')
+
+
+def ensure(kind, size, data_dir, seed=SEED):
+    '''Return the path of the generated `kind` of input of `size` in
+    `data_dir`, generate it first (in a separate process) if it doesn't exist
+    yet'''
+    path = input_path(kind, size, data_dir, seed)
+    if not os.path.exists(path):
+        # not in this process: the memory used by the generator would stay
+        # in the RSS of the benchmark harness
+        print(f'Generating {path} ...', file=sys.stderr)
+        subprocess.run([sys.executable, os.path.abspath(__file__),
+                        '-s', str(seed), kind, str(size), path], check=True)
+    return path
+
+
+def parseargs(cmdline=sys.argv[1:]):
+    '''Parse CLI arguments
+    '''
+    import argparse
+    p = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument('-s', '--seed', type=int, default=SEED,
+                   help=f'seed of the random generator (default: {SEED})')
+    p.add_argument('kind', choices=GENERATORS,
+                   help='the kind of input to generate')
+    p.add_argument('size', type=int,
+                   help='nr. of rows (records, lines) to generate')
+    p.add_argument('output', help='the file to create')
+    return p.parse_args(cmdline)
+
+
+def main():
+    args = parseargs()
+    began = time.perf_counter()
+    GENERATORS[args.kind][0](args.output, args.size, args.seed)
+    print(f'Generated {args.output} ({os.path.getsize(args.output):,} bytes) '
+          f'in {time.perf_counter() - began:.1f}s', file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,493 @@
+#!/usr/bin/env python3
+
+'''Convert records between CSV, JSON, NDJSON, YAML, INI and XML
+
+The records flow through a generator pipeline: a Reader yields the records
+(dicts) one by one, a Writer writes them out one by one. Neither side keeps
+all records in memory, so converting e.g.: a 10 GB CSV file to XML or NDJSON
+runs in constant memory.
+
+  - CSV: one record per row, the 1st row has the field names. All values
+    are str, unless ``--typed`` (see ``csvengine.py``) is used
+  - JSON: an array of records (streamed), or a single object (one record)
+  - NDJSON: one JSON record per line
+  - YAML: one record per document (``---``); a document with a list yields
+    one record per item. The C (libyaml) loader/dumper is used if available
+  - INI: one record per section, the section name is stored in the field
+    ``--section-key`` (default: ``_section``)
+  - XML: one record per ``--record-tag`` element; attributes and child
+    elements become fields. Read with ``lxml.etree.iterparse()``, written
+    with ``lxml.etree.xmlfile()``, so the document tree is never built
+
+New formats can be added by subclassing Reader and/or Writer and
+registering them with the ``@register`` decorator, e.g.: ::
+
+    @register
+    class TsvReader(CsvReader):
+        name, extensions = 'tsv', ('.tsv',)
+
+        def __init__(self, fh, **options):
+            super().__init__(fh, **{**options, 'delimiter': '\\t'})
+
+Examples: ::
+
+    $ ./convert.py -d '|' names.csv names.xml
+    $ ./convert.py names.ini - -t ndjson
+    $ zcat huge.csv.gz | ./convert.py -f csv -t xml - huge.xml
+'''
+
+__author__ = 'Gábor Nyers'
+__version__ = '0.1.0'
+__license__ = 'CC BY-NC 4.0'
+
+import configparser
+import csv
+import json
+import os
+import sys
+from datetime import date, datetime
+
+CHUNK_SIZE = 1024**2                    # read streamed JSON in 1MB chunks
+NUMBER_CHARS = frozenset('0123456789.eE+-')
+
+READERS = {}                            # format name: Reader class
+WRITERS = {}                            # format name: Writer class
+
+
+def register(cls):
+    '''Class decorator: make Reader/Writer `cls` available by its `name`'''
+    registry = READERS if issubclass(cls, Reader) else WRITERS
+    registry[cls.name] = cls
+    return cls
+
+
+class Reader:
+    '''Base class of the readers: iterate over the records (dicts) of the
+    file object `fh`'''
+    name = ''
+    extensions = ()
+    binary = False                      # `fh` is opened in binary mode
+
+    def __init__(self, fh, **options):
+        self.fh = fh
+        self.options = options
+
+    def __iter__(self):
+        raise NotImplementedError
+
+
+class Writer:
+    '''Base class of the writers: write records (dicts) one by one to the
+    file object `fh`; use as a context manager or call close()'''
+    name = ''
+    extensions = ()
+    binary = False
+
+    def __init__(self, fh, **options):
+        self.fh = fh
+        self.options = options
+        self.count = 0
+
+    def write(self, record):
+        raise NotImplementedError
+
+    def close(self):
+        '''Finish the output, e.g.: write the closing tags'''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def flatten(value):
+    '''Return `value` as str for flat formats (CSV, INI, XML text)'''
+    if value is None:
+        return ''
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, default=json_default)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return str(value)
+
+
+def json_default(value):
+    '''Serialize the values json does not know, e.g.: dates'''
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+#-- CSV
+@register
+class CsvReader(Reader):
+    name, extensions = 'csv', ('.csv',)
+
+    def __iter__(self):
+        delimiter = self.options.get('delimiter', ',')
+        if not self.options.get('typed'):
+            yield from csv.DictReader(self.fh, dialect='excel',
+                                      delimiter=delimiter)
+            return
+        import csvengine                # typed values, see csvengine.py
+        path = getattr(self.fh, 'name', None)
+        if isinstance(path, str) and os.path.isfile(path):
+            yield from csvengine.CsvFile(path, jobs=self.options.get('jobs'),
+                                         delimiter=delimiter).dicts()
+            return
+        rows = csvengine.iter_typed_rows(self.fh, delimiter=delimiter,
+                                         jobs=self.options.get('jobs'))
+        header = next(rows)
+        for row in rows:
+            yield dict(zip(header, row))
+
+
+@register
+class CsvWriter(Writer):
+    '''The fields of the 1st record are the columns of the CSV file'''
+    name, extensions = 'csv', ('.csv',)
+
+    def __init__(self, fh, **options):
+        super().__init__(fh, **options)
+        self._writer = None
+
+    def write(self, record):
+        if self._writer is None:
+            self._writer = csv.DictWriter(
+                self.fh, fieldnames=list(record), dialect='excel',
+                delimiter=self.options.get('delimiter', ','))
+            self._writer.writeheader()
+        self._writer.writerow({k: flatten(v) for k, v in record.items()})
+        self.count += 1
+
+
+#-- JSON and NDJSON
+def iter_json_array(fh, chunk_size=CHUNK_SIZE):
+    '''Yield the items of the JSON array in text file `fh`, reading it in
+    chunks; a JSON document which is not an array is yielded as a whole'''
+    decoder = json.JSONDecoder()
+    buf, eof = '', False
+    while not buf and (chunk := fh.read(chunk_size)):
+        buf = chunk.lstrip()            # skip the leading white-space
+    if not buf.startswith('['):
+        yield json.loads(buf + fh.read())
+        return
+    pos, expect_item, trailing_comma = 1, True, False
+    while True:
+        while pos < len(buf) and buf[pos].isspace():
+            pos += 1
+        if pos < len(buf) and buf[pos] == ']':
+            if expect_item and trailing_comma:
+                raise ValueError('Trailing "," in JSON array')
+            return
+        if pos < len(buf) and not expect_item:
+            if buf[pos] != ',':
+                raise ValueError(f'Expected "," or "]" in JSON array, '
+                                 f'got: {buf[pos:pos + 20]!r}')
+            pos, expect_item = pos + 1, True
+            trailing_comma = True
+            continue
+        if pos < len(buf):
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            else:                       # a number may continue in next chunk
+                if eof or (end < len(buf) and buf[end] not in NUMBER_CHARS):
+                    yield item
+                    pos, expect_item = end, False
+                    continue
+        if eof:
+            raise ValueError('Unexpected end of the JSON array')
+        chunk = fh.read(chunk_size)
+        buf, pos, eof = buf[pos:] + chunk, 0, not chunk
+
+
+@register
+class JsonReader(Reader):
+    name, extensions = 'json', ('.json',)
+
+    def __iter__(self):
+        return iter_json_array(self.fh)
+
+
+@register
+class JsonWriter(Writer):
+    '''Write the records as a JSON array, one record per line'''
+    name, extensions = 'json', ('.json',)
+
+    def write(self, record):
+        self.fh.write(',\n' if self.count else '[\n')
+        self.fh.write(json.dumps(record, default=json_default))
+        self.count += 1
+
+    def close(self):
+        self.fh.write('\n]\n' if self.count else '[]\n')
+
+
+@register
+class NdjsonReader(Reader):
+    name, extensions = 'ndjson', ('.ndjson', '.jsonl')
+
+    def __iter__(self):
+        for line in self.fh:
+            if line.strip():
+                yield json.loads(line)
+
+
+@register
+class NdjsonWriter(Writer):
+    name, extensions = 'ndjson', ('.ndjson', '.jsonl')
+
+    def write(self, record):
+        self.fh.write(json.dumps(record, default=json_default) + '\n')
+        self.count += 1
+
+
+#-- YAML
+@register
+class YamlReader(Reader):
+    name, extensions = 'yaml', ('.yaml', '.yml')
+
+    def __iter__(self):
+        import yaml
+        loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+        for doc in yaml.load_all(self.fh, Loader=loader):
+            if isinstance(doc, list):
+                yield from doc
+            elif doc is not None:
+                yield doc
+
+
+@register
+class YamlWriter(Writer):
+    '''Write every record as a separate YAML document'''
+    name, extensions = 'yaml', ('.yaml', '.yml')
+
+    def __init__(self, fh, **options):
+        super().__init__(fh, **options)
+        import yaml
+        self._dump = yaml.dump
+        self._dumper = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+
+    def write(self, record):
+        self._dump(record, self.fh, Dumper=self._dumper, explicit_start=True,
+                   default_flow_style=False, sort_keys=False)
+        self.count += 1
+
+
+#-- INI
+@register
+class IniReader(Reader):
+    '''NOTE: configparser reads the whole file, but INI files are small'''
+    name, extensions = 'ini', ('.ini', '.cfg', '.conf')
+
+    def __iter__(self):
+        ini = configparser.ConfigParser(interpolation=None)
+        ini.optionxform = str           # preserve the case of the keys
+        ini.read_file(self.fh)
+        key = self.options.get('section_key', '_section')
+        for section in ini.sections():
+            yield {key: section, **ini[section]}
+
+
+@register
+class IniWriter(Writer):
+    '''Write every record as a section, named by the `section_key` field of
+    the record or "record<N>"'''
+    name, extensions = 'ini', ('.ini', '.cfg', '.conf')
+
+    def write(self, record):
+        record = dict(record)
+        key = self.options.get('section_key', '_section')
+        section = flatten(record.pop(key, None)) or f'record{self.count + 1}'
+        ini = configparser.ConfigParser(interpolation=None)
+        ini.optionxform = str
+        ini[section] = {k: flatten(v) for k, v in record.items()}
+        ini.write(self.fh)              # only this one section
+        self.count += 1
+
+
+#-- XML
+def element_to_record(elem):
+    '''Return the attributes and child elements of `elem` as a dict; child
+    elements with children become dicts, repeated tags become lists'''
+    record = dict(elem.attrib)
+    for child in elem:
+        if not isinstance(child.tag, str):
+            continue                    # comment or processing instruction
+        value = (element_to_record(child) if len(child) or child.attrib
+                 else child.text or '')
+        if child.tag not in record:
+            record[child.tag] = value
+        elif isinstance(record[child.tag], list):
+            record[child.tag].append(value)
+        else:
+            record[child.tag] = [record[child.tag], value]
+    return record
+
+
+def record_to_element(tag, record):
+    '''The inverse of element_to_record(): build element `tag` from the
+    dict `record`'''
+    from lxml import etree
+    elem = etree.Element(tag)
+    for key, value in record.items():
+        for item in value if isinstance(value, list) else [value]:
+            if isinstance(item, dict):
+                elem.append(record_to_element(key, item))
+            else:
+                etree.SubElement(elem, key).text = flatten(item)
+    return elem
+
+
+@register
+class XmlReader(Reader):
+    name, extensions = 'xml', ('.xml',)
+    binary = True
+
+    def __iter__(self):
+        from lxml import etree
+        tag = self.options.get('record_tag', 'record')
+        for _, elem in etree.iterparse(self.fh, events=('end',), tag=tag,
+                                       huge_tree=True):
+            yield element_to_record(elem)
+            elem.clear()                # free the processed elements
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+
+
+@register
+class XmlWriter(Writer):
+    '''Write the records as `record_tag` elements into the `root_tag`
+    element, incrementally'''
+    name, extensions = 'xml', ('.xml',)
+    binary = True
+
+    def __init__(self, fh, **options):
+        super().__init__(fh, **options)
+        from lxml import etree
+        self.tag = options.get('record_tag', 'record')
+        self._xf = etree.xmlfile(fh, encoding='utf-8')
+        self._doc = self._xf.__enter__()
+        self._doc.write_declaration()
+        self._root = self._doc.element(options.get('root_tag', 'records'))
+        self._root.__enter__()
+        self._doc.write('\n')
+
+    def write(self, record):
+        self._doc.write(record_to_element(self.tag, record))
+        self._doc.write('\n')
+        self.count += 1
+
+    def close(self):
+        if self._xf is not None:
+            self._root.__exit__(None, None, None)
+            self._xf.__exit__(None, None, None)
+            self._xf = None
+
+
+#-- the converter
+def detect_format(path, registry):
+    '''Return the name of the format of `path` by its file extension'''
+    ext = os.path.splitext(path)[1].lower()
+    for name, cls in registry.items():
+        if ext in cls.extensions:
+            return name
+    raise ValueError(f'Unknown file format: {path}, use --from/--to')
+
+
+def open_file(path, mode, binary):
+    '''Open `path` ("-": STDIN/STDOUT) in text or binary `mode`'''
+    if path == '-':
+        std = sys.stdin if mode == 'r' else sys.stdout
+        if binary:
+            return open(std.fileno(), mode + 'b', closefd=False)
+        return open(std.fileno(), mode, encoding='utf-8', newline='',
+                    closefd=False)
+    if binary:
+        return open(path, mode + 'b')
+    return open(path, mode, encoding='utf-8', newline='')
+
+
+def convert(src, dst, src_format=None, dst_format=None, **options):
+    '''Convert file `src` to `dst` ("-": STDIN/STDOUT), return the number of
+    records; the formats are detected by the file extensions by default
+
+    The output is written to a temporary file next to `dst`, which replaces
+    `dst` only if the conversion succeeded.
+    '''
+    reader_cls = READERS[src_format or detect_format(src, READERS)]
+    writer_cls = WRITERS[dst_format or detect_format(dst, WRITERS)]
+    out = dst if dst == '-' else f'{dst}.tmp{os.getpid()}'
+    try:
+        with open_file(src, 'r', reader_cls.binary) as fin, \
+             open_file(out, 'w', writer_cls.binary) as fout, \
+             writer_cls(fout, **options) as writer:
+            for record in reader_cls(fin, **options):
+                writer.write(record)
+    except BaseException:               # incl. KeyboardInterrupt
+        if out != dst and os.path.exists(out):
+            os.remove(out)              # never leave a partial output file
+        raise
+    if out != dst:
+        os.replace(out, dst)
+    return writer.count
+
+
+def parseargs(cmdline=sys.argv[1:]):
+    '''Parse CLI arguments
+    '''
+    import argparse
+    p = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument('-f', '--from', dest='src_format', choices=sorted(READERS),
+                   help='format of the input (default: by file extension)')
+    p.add_argument('-t', '--to', dest='dst_format', choices=sorted(WRITERS),
+                   help='format of the output (default: by file extension)')
+    p.add_argument('-d', '--delimiter', default=',',
+                   help='CSV field delimiter (default: ",")')
+    p.add_argument('--typed', action='store_true',
+                   help='CSV input: convert ints, floats and dates, parse '
+                   'large files in parallel (see csvengine.py)')
+    p.add_argument('-j', '--jobs', type=int, default=None,
+                   help='nr. of processes for --typed (default: nr. of CPUs)')
+    p.add_argument('--record-tag', default='record',
+                   help='XML element of a record (default: record)')
+    p.add_argument('--root-tag', default='records',
+                   help='XML root element of the output (default: records)')
+    p.add_argument('--section-key', default='_section',
+                   help='field with the INI section name (default: _section)')
+    p.add_argument('src', help='input file, "-" for STDIN')
+    p.add_argument('dst', help='output file, "-" for STDOUT')
+    return p.parse_args(cmdline)
+
+
+def input_errors():
+    '''Return the exception classes of I/O errors and malformed input; the
+    ones of the YAML and XML modules only if these have been imported'''
+    errors = [OSError, ValueError, csv.Error, configparser.Error]
+    if 'yaml' in sys.modules:
+        errors.append(sys.modules['yaml'].YAMLError)
+    if 'lxml.etree' in sys.modules:
+        errors.append(sys.modules['lxml.etree'].XMLSyntaxError)
+    return tuple(errors)
+
+
+def main():
+    args = parseargs()
+    options = vars(args)
+    try:
+        count = convert(options.pop('src'), options.pop('dst'), **options)
+    except input_errors() as e:         # evaluated when an error occurs
+        print(f'Error: {e}', file=sys.stderr)
+        return 1
+    print(f'Converted {count} records', file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
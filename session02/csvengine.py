@@ -0,0 +1,405 @@
+#!/usr/bin/env python3
+
+'''Parallel, typed CSV parsing
+
+``csv.DictReader`` builds a dict of strings for every row, in a single
+process. For large CSV files this module:
+
+- splits the file into chunks at record boundaries: a chunk always ends with
+  a newline outside quotes, so quoted fields with newlines stay intact;
+- parses the chunks in a pool of processes;
+- infers the type of every column (int, float, date, datetime or str) from a
+  sample of the first rows and converts the values; empty fields of non-str
+  columns become None. If a later value doesn't fit the inferred type, the
+  column gets a wider type instead (int -> float -> str, date -> datetime ->
+  str), for all of its values: every column has exactly one type.
+
+The result is available as typed row tuples, dicts or columns:
+
+  >>> f = CsvFile('names.csv', delimiter='|')
+  >>> f.header
+  ['name', 'full_name', 'group', 'gendergroup', 'agegroup']
+  >>> f.types
+  ['str', 'str', 'str', 'str', 'str']
+  >>> next(f.rows())
+  ('fred', 'Fred Flintstone', 'flintstones', 'm', 'adults')
+
+Columns of ints or floats without empty values are returned as ``array.array``
+objects, which are compact and pickled efficiently between processes.
+
+NOTE: record boundaries are found by counting quote characters, which is
+correct for the default (Excel) dialect, where quotes inside quoted fields
+are doubled (``""``); it is not for CSV files using an escape character.
+'''
+
+__author__ = 'Gábor Nyers'
+__version__ = '0.1.0'
+__license__ = 'CC BY-NC 4.0'
+
+import array
+import csv
+import gc
+import io
+import itertools
+import mmap
+import os
+import re
+import shutil
+import sys
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
+
+CHUNK_SIZE = 64 * 1024**2               # max. nr. of bytes per chunk
+MIN_CHUNK_SIZE = 1024**2                # don't bother splitting below this
+SAMPLE_SIZE = 1000                      # nr. of rows to infer the types from
+
+# type name: (RegEx a value has to match, converter); tried in this order,
+# "str" matches anything. Leading zeros, e.g.: ZIP codes, are kept as str.
+TYPES = {
+    'int': (re.compile(r'[-+]?(0|[1-9]\d*)$'), int),
+    'float': (re.compile(r'[-+]?(0|[1-9]\d*)?(\.\d+)?([eE][-+]?\d+)?$'),
+              float),
+    'date': (re.compile(r'\d{4}-\d{2}-\d{2}$'), date.fromisoformat),
+    'datetime': (re.compile(r'\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}'),
+                 datetime.fromisoformat),
+    'str': (re.compile(''), str),
+}
+# the type to try if a value doesn't fit the inferred type
+WIDER = {'int': 'float', 'float': 'str', 'date': 'datetime',
+         'datetime': 'str'}
+ARRAY_CODES = {'int': 'q', 'float': 'd'}
+
+
+def _matches(type_name, value):
+    regex, convert = TYPES[type_name]
+    if not regex.match(value):
+        return False
+    try:                                # e.g.: 2023-02-30 is not a date
+        convert(value)
+    except (ValueError, OverflowError):
+        return False
+    return type_name != 'float' or any(c.isdigit() for c in value)
+
+
+def widest(a, b):
+    '''Return the narrowest type name both type names `a` and `b` widen to'''
+    chain = [a]
+    while chain[-1] != 'str':
+        chain.append(WIDER[chain[-1]])
+    while b not in chain:
+        b = WIDER[b]
+    return b
+
+
+def infer_types(rows, ncols):
+    '''Return the type names of the `ncols` columns of the str `rows`'''
+    candidates = [list(TYPES) for _ in range(ncols)]
+    seen = [False] * ncols              # has the column non-empty values?
+    for row in rows:
+        for i, value in enumerate(row[:ncols]):
+            if value == '':
+                continue                # an empty value fits any type
+            seen[i] = True
+            candidates[i] = [t for t in candidates[i] if _matches(t, value)]
+    return [c[0] if s else 'str' for c, s in zip(candidates, seen)]
+
+
+def record_end(mm, pos, quote=b'"', in_quotes=False):
+    '''Return the offset after the first newline at or after `pos` that is
+    not inside quotes; `in_quotes`: whether `pos` itself is inside quotes'''
+    while True:
+        nl = mm.find(b'\n', pos)
+        if nl < 0:
+            return len(mm)
+        in_quotes ^= mm[pos:nl].count(quote) % 2 == 1
+        if not in_quotes:
+            return nl + 1
+        pos = nl + 1
+
+
+def chunk_bounds(path, jobs=1, chunk_size=CHUNK_SIZE, quote=b'"'):
+    '''Return the header end and the (start, end) byte offsets of the chunks
+    of the CSV file `path`
+
+    The file is split into at least `jobs` chunks (if large enough) of about
+    `chunk_size` bytes. To know whether an offset is inside quotes, the
+    quotes between the chunk boundaries are counted (this is the only
+    sequential step, but ``bytes.count()`` is fast).
+    '''
+    if os.path.getsize(path) == 0:
+        return 0, []
+    with open(path, 'rb') as fh, \
+         mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        size = len(mm)
+        header_end = record_end(mm, 0, quote)
+        body = size - header_end
+        nr = max(-(-body // chunk_size), min(jobs, body // MIN_CHUNK_SIZE), 1)
+        bounds, pos = [header_end], header_end
+        for i in range(1, nr):
+            target = header_end + body * i // nr
+            if target <= pos:
+                continue
+            in_quotes = False           # `pos` is a record boundary
+            for start in range(pos, target, chunk_size):
+                stop = min(start + chunk_size, target)
+                in_quotes ^= mm[start:stop].count(quote) % 2 == 1
+            pos = record_end(mm, target, quote, in_quotes)
+            if pos >= size:
+                break
+            bounds.append(pos)
+        bounds.append(size)
+    return header_end, list(zip(bounds, bounds[1:]))
+
+
+def convert_columns(rows, types, strict=()):
+    '''Return the columns of the str `rows`, with the values converted to
+    `types` (list of type names), and the types used; empty values of non-str
+    columns are None
+
+    A column with a value that doesn't fit its type is converted to the next
+    wider type (see WIDER), unless `strict` (list of bools) is true for it.
+    '''
+    ncols = len(types)
+    if any(len(row) != ncols for row in rows):
+        rows = [(row + [''] * ncols)[:ncols] for row in rows]
+    columns = list(zip(*rows)) if rows else [()] * ncols
+    types = list(types)
+    for i, type_name in enumerate(types):
+        while type_name != 'str':
+            convert = TYPES[type_name][1]
+            try:
+                columns[i] = [convert(v) if v else None for v in columns[i]]
+                break
+            except (ValueError, OverflowError) as e:
+                if i < len(strict) and strict[i]:
+                    raise ValueError(f'Column {i + 1} is not of type '
+                                     f'{type_name}: {e}') from None
+                type_name = WIDER[type_name]
+        types[i] = type_name
+    return columns, types
+
+
+def to_columns(columns, header, types):
+    '''Return the `columns` as a dict: array.array for int and float columns
+    without None values, list for the others'''
+    res = {}
+    for name, type_name, values in zip(header, types, columns):
+        code = ARRAY_CODES.get(type_name)
+        if code and None not in values:
+            try:
+                res[name] = array.array(code, values)
+                continue
+            except (OverflowError,      # int beyond 64 bits
+                    TypeError):         # widened, e.g.: floats of an int
+                pass
+        res[name] = list(values)
+    return res
+
+
+def parse_chunk(job, types_only=False):
+    '''Parse one chunk (runs in a worker process), return the types used
+    (see convert_columns) and the row tuples or the columns (or None)'''
+    path, start, end, types, strict, fmtparams, header = job
+    with open(path, 'rb') as fh:
+        fh.seek(start)
+        text = fh.read(end - start).decode()
+    # millions of new (acyclic) lists and tuples would trigger the garbage
+    # collector over and over again, which would double the parse time
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        rows = [row for row in csv.reader(io.StringIO(text, newline=''),
+                                          **fmtparams) if row]
+        columns, types = convert_columns(rows, types, strict)
+        del rows
+        if types_only:
+            return types, None
+        if header is None:
+            return types, list(zip(*columns))
+        return types, to_columns(columns, header, types)
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+
+def chunk_types(job):
+    '''Return the types of one chunk (and None), see parse_chunk()'''
+    return parse_chunk(job, types_only=True)
+
+
+class CsvFile:
+    '''A CSV file with a header row, parsed in parallel into typed values
+
+    `types` can set the type name (see TYPES) of some or all columns by name,
+    the others are inferred from the first `sample_size` rows. A value that
+    doesn't fit a set type raises ValueError, one that doesn't fit an
+    inferred type widens the type of the whole column, see resolve_types().
+    `fmtparams` are passed to ``csv.reader()``, e.g.: `delimiter`.
+    '''
+
+    def __init__(self, path, types=None, jobs=None, chunk_size=CHUNK_SIZE,
+                 sample_size=SAMPLE_SIZE, **fmtparams):
+        self.path = path
+        self.jobs = jobs or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.fmtparams = fmtparams
+        with open(path, newline='', encoding='utf-8') as fh:
+            reader = csv.reader(fh, **fmtparams)
+            self.header = next(reader, [])
+            sample = list(itertools.islice(reader, sample_size))
+        self.types = infer_types(sample, len(self.header))
+        self.strict = [False] * len(self.header)
+        for name, type_name in (types or {}).items():
+            if type_name not in TYPES:
+                raise ValueError(f'Unknown type: {type_name}')
+            self.types[self.header.index(name)] = type_name
+            self.strict[self.header.index(name)] = True
+        self.resolved = all(t == 'str' for t in self.types)
+
+    def _map(self, types, columnar, bounds, func=parse_chunk):
+        '''Yield the results of `func` (parse_chunk) for the chunks with
+        `bounds`, in file order'''
+        header = self.header if columnar else None
+        work = ((self.path, start, end, types, self.strict, self.fmtparams,
+                 header) for start, end in bounds)
+        if self.jobs == 1 or len(bounds) == 1:
+            yield from map(func, work)
+            return
+        with ProcessPoolExecutor(max_workers=self.jobs) as pool:
+            pending = deque()           # max. 2 chunks/worker in flight
+            for job in work:
+                pending.append(pool.submit(func, job))
+                if len(pending) >= 2 * self.jobs:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def _bounds(self):
+        quote = self.fmtparams.get('quotechar', '"').encode()
+        return chunk_bounds(self.path, self.jobs, self.chunk_size, quote)[1]
+
+    def resolve_types(self):
+        '''Widen `types` to fit all values of the file, return them
+
+        The rows are yielded while the file is parsed, so the types have to
+        be known before: this parses the file once more, in parallel, but
+        keeps only the types of the chunks.
+        '''
+        if not self.resolved:
+            types = self.types
+            for used, _ in self._map(self.types, False, self._bounds(),
+                                     chunk_types):
+                types = list(map(widest, types, used))
+            self.types, self.resolved = types, True
+        return self.types
+
+    def rows(self):
+        '''Yield the typed row tuples, see resolve_types()'''
+        types = self.resolve_types()
+        for _, rows in self._map(types, False, self._bounds()):
+            yield from rows
+
+    def dicts(self):
+        '''Yield the rows as dicts, like csv.DictReader, but typed'''
+        header = self.header
+        for row in self.rows():
+            yield dict(zip(header, row))
+
+    def columns(self):
+        '''Return a dict of the columns, see to_columns()
+
+        The file is parsed once; only the chunks of which a column got a
+        narrower type than in other chunks are parsed again, with the
+        widest types.
+        '''
+        bounds = self._bounds()
+        types = self.types
+        columns = to_columns([()] * len(self.header), self.header, types)
+        parsed = []                     # (start row, types) of the chunks
+        nrows = 0
+        for used, chunk in self._map(types, True, bounds):
+            parsed.append((nrows, used))
+            nrows += len(next(iter(chunk.values()), ()))
+            types = list(map(widest, types, used))
+            for name, values in chunk.items():
+                column = columns[name]
+                if (isinstance(column, array.array)
+                        and getattr(values, 'typecode', None)
+                        != column.typecode):
+                    columns[name] = list(column)
+                columns[name].extend(values)
+        redo = [i for i, (_, used) in enumerate(parsed) if used != types]
+        if redo:                        # promote these to the widest types
+            widened = {name for i in redo for name, a, b in
+                       zip(self.header, parsed[i][1], types) if a != b}
+            for name in widened:
+                columns[name] = list(columns[name])
+            results = self._map(types, True, [bounds[i] for i in redo])
+            for i, (_, chunk) in zip(redo, results):
+                first = parsed[i][0]
+                for name in widened:
+                    values = chunk[name]
+                    columns[name][first:first + len(values)] = values
+            columns.update(to_columns(
+                [columns[name] for name in widened], list(widened),
+                [types[self.header.index(name)] for name in widened]))
+        self.types, self.resolved = types, True
+        return columns
+
+
+def iter_typed_rows(fh, types=None, sample_size=SAMPLE_SIZE, jobs=1,
+                    **fmtparams):
+    '''Yield the header, then the typed row tuples of the (non-seekable)
+    text file `fh`, e.g.: STDIN
+
+    Every column has to have one type (see CsvFile.resolve_types()), so the
+    file is read twice: `fh` is copied to a temporary file first.
+    '''
+    with tempfile.NamedTemporaryFile('w', newline='', encoding='utf-8',
+                                     suffix='.csv') as tmp:
+        shutil.copyfileobj(fh, tmp)
+        tmp.flush()
+        f = CsvFile(tmp.name, types=types, jobs=jobs,
+                    sample_size=sample_size, **fmtparams)
+        yield f.header
+        yield from f.rows()
+
+
+def main():
+    '''Parse a CSV file and print the inferred types and the throughput'''
+    import argparse
+    import time
+    p = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument('-d', '--delimiter', default=',',
+                   help='field delimiter (default: ",")')
+    p.add_argument('-j', '--jobs', type=int, default=None,
+                   help='nr. of worker processes (default: nr. of CPUs)')
+    p.add_argument('-c', '--chunk-size', type=int, default=CHUNK_SIZE,
+                   help=f'max. bytes per chunk (default: {CHUNK_SIZE})')
+    p.add_argument('--columns', action='store_true',
+                   help='build columns instead of row tuples')
+    p.add_argument('csvfile', help='CSV file with a header row')
+    args = p.parse_args()
+
+    began = time.perf_counter()
+    f = CsvFile(args.csvfile, jobs=args.jobs, chunk_size=args.chunk_size,
+                delimiter=args.delimiter)
+    if args.columns:
+        columns = f.columns()
+        count = len(next(iter(columns.values()), ()))
+    else:
+        count = sum(1 for _ in f.rows())
+    elapsed = time.perf_counter() - began
+    for name, type_name in zip(f.header, f.types):
+        print(f'{name}: {type_name}')
+    print(f'Parsed rows: {count}')
+    print(f'Elapsed: {elapsed:.3f}s ({count / (elapsed or 1e-9):,.0f} rows/s)')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
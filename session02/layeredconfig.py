@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+
+'''Layered configuration from INI, YAML and JSON files, with a cache
+
+Like ``read-multiple-ini.py``, but for an ordered list of sources of mixed
+formats: later sources take precedence over earlier ones, e.g.: ::
+
+    defaults.yaml < site.ini < ~/.config/tool.json
+
+- nested dicts are merged key by key, other values (incl. lists) of a later
+  source replace the earlier ones;
+- INI files are read as ``{section: {option: value}}``; the options of the
+  ``DEFAULT`` section are inherited by all other sections (like with
+  ``configparser``), after all the sources have been merged;
+- sources which don't exist are skipped (like ``ConfigParser.read()``).
+
+Parsing large configs at every start of a tool is wasteful: the merged result
+is cached (pickled) and keyed on the path, mtime and size of every source. As
+long as none of them changed, the cached result is returned without parsing
+anything. Long-running processes can call ``current()`` before using the
+config, e.g.: on every request, it re-reads the sources only if one of them
+changed (checked at most every `check_interval` seconds). If that fails, e.g.:
+on a syntax error in an edited source, the error is logged and the last good
+config is returned until a re-read succeeds:
+
+    >>> cfg = LayeredConfig(['servers.ini', 'user.ini'])
+    >>> cfg.load()['www.example.com']['User']
+    'jdoe'
+    >>> cfg.current()['bitbucket.org']['ServerAliveInterval']
+    '200'
+'''
+
+__author__ = 'Gábor Nyers'
+__version__ = '0.1.0'
+__license__ = 'CC BY-NC 4.0'
+
+import configparser
+import hashlib
+import json
+import logging
+import os
+import pickle
+import sys
+import threading
+import time
+
+CACHE_DIR = os.environ.get(
+    'LAYEREDCONFIG_CACHE', os.path.expanduser('~/.cache/layeredconfig'))
+FORMAT_VERSION = 1                      # of the cache files
+
+log = logging.getLogger('layeredconfig')
+
+
+def load_ini(path):
+    '''Return the INI file `path` as {section: {option: value}}, the
+    ``DEFAULT`` section included; the case of the options is preserved'''
+    # with no real default section, "DEFAULT" is read as any other section,
+    # i.e.: without being copied into the other sections (see apply_defaults)
+    ini = configparser.ConfigParser(interpolation=None,
+                                    default_section='\0')
+    ini.optionxform = str               # make sure to preserve case!
+    with open(path) as fh:
+        ini.read_file(fh)
+    return {section: dict(ini[section]) for section in ini.sections()}
+
+
+def load_yaml(path):
+    import yaml
+    loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+    with open(path) as fh:
+        return yaml.load(fh, Loader=loader) or {}
+
+
+def load_json(path):
+    with open(path) as fh:
+        return json.load(fh)
+
+
+LOADERS = {
+    # 'extension': loader function
+    '.ini': load_ini,
+    '.cfg': load_ini,
+    '.conf': load_ini,
+    '.yaml': load_yaml,
+    '.yml': load_yaml,
+    '.json': load_json,
+}
+
+
+def load_errors():
+    '''Return the exception classes the loaders raise for unreadable or
+    malformed sources; the YAML one only if the yaml module has been
+    imported (i.e.: a YAML source was read)'''
+    errors = [OSError, ValueError, configparser.Error]  # JSON: ValueError
+    if 'yaml' in sys.modules:
+        errors.append(sys.modules['yaml'].YAMLError)
+    return tuple(errors)
+
+
+def merge(base, override):
+    '''Merge dict `override` into dict `base` (in place), recursively'''
+    for key, value in override.items():
+        if isinstance(value, dict) and isinstance(base.get(key), dict):
+            merge(base[key], value)
+        else:
+            base[key] = value
+    return base
+
+
+def apply_defaults(config):
+    '''Let the sections inherit the options of the "DEFAULT" section'''
+    defaults = config.get('DEFAULT')
+    if isinstance(defaults, dict):
+        for section, options in config.items():
+            if section != 'DEFAULT' and isinstance(options, dict):
+                config[section] = {**defaults, **options}
+    return config
+
+
+def signature(sources):
+    '''Return the (path, mtime, size) of every source; (path, None, None)
+    if it doesn't exist'''
+    sig = []
+    for path in sources:
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            sig.append((path, None, None))
+        else:
+            sig.append((path, st.st_mtime_ns, st.st_size))
+    return tuple(sig)
+
+
+class LayeredConfig:
+    '''The merged configuration of the files in `sources`, lowest precedence
+    first
+
+    With `cache_dir` set to None the merged result is not cached on disk.
+    '''
+
+    def __init__(self, sources, cache_dir=CACHE_DIR, check_interval=1.0):
+        self.sources = [os.path.abspath(os.path.expanduser(p))
+                        for p in sources]
+        self.cache_dir = cache_dir
+        self.check_interval = check_interval
+        self.config = None
+        self.signature = None
+        self.loaded_from = None         # "cache" or "sources"
+        self._checked = 0.0             # time.monotonic() of the last check
+        self._failed = None             # signature of a failed re-load
+        self._lock = threading.Lock()
+
+    @property
+    def cache_file(self):
+        key = hashlib.sha1('\0'.join(self.sources).encode()).hexdigest()
+        return os.path.join(self.cache_dir, f'{key}.pickle')
+
+    def _parse(self):
+        config = {}
+        for path in self.sources:
+            if not os.path.exists(path):
+                continue
+            ext = os.path.splitext(path)[1].lower()
+            loader = LOADERS.get(ext)
+            if loader is None:
+                raise ValueError(f'Unknown configuration format: {path}')
+            data = loader(path)
+            if not isinstance(data, dict):
+                raise ValueError(f'{path}: the top level has to be a mapping')
+            merge(config, data)
+        return apply_defaults(config)
+
+    def _read_cache(self, sig):
+        try:
+            with open(self.cache_file, 'rb') as fh:
+                cached = pickle.load(fh)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        if (cached.get('version') == FORMAT_VERSION
+                and cached.get('signature') == sig):
+            return cached['config']
+        return None
+
+    def _write_cache(self, sig, config):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp = f'{self.cache_file}.tmp{os.getpid()}'
+        with open(tmp, 'wb') as fh:
+            pickle.dump({'version': FORMAT_VERSION, 'signature': sig,
+                         'config': config}, fh, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self.cache_file)    # never leave a half-written cache
+
+    def load(self):
+        '''Return the merged configuration: from the cache if none of the
+        sources changed, otherwise parse the sources (and update the cache)'''
+        with self._lock:
+            sig = signature(self.sources)
+            config = self._read_cache(sig) if self.cache_dir else None
+            self.loaded_from = 'cache'
+            if config is None:
+                config = self._parse()
+                self.loaded_from = 'sources'
+                if self.cache_dir:
+                    try:
+                        self._write_cache(sig, config)
+                    except OSError as e:
+                        log.warning('Not caching the configuration: %s', e)
+            self.config, self.signature = config, sig
+            self._checked = time.monotonic()
+            return config
+
+    def changed(self):
+        '''Return True if a source changed since the last load()'''
+        return signature(self.sources) != self.signature
+
+    def current(self):
+        '''Return the configuration, re-loaded if a source changed; stat()
+        the sources at most every `check_interval` seconds
+
+        If the re-load fails, the error is logged and the last good
+        configuration returned; the sources are re-read when they change
+        again. Only the first load raises errors.
+        '''
+        if self.config is None:
+            return self.load()
+        if time.monotonic() - self._checked >= self.check_interval:
+            self._checked = time.monotonic()
+            sig = signature(self.sources)
+            if sig not in (self.signature, self._failed):
+                try:
+                    return self.load()
+                except Exception as e:  # e.g.: YAML, JSON or INI syntax
+                    self._failed = sig
+                    log.error('Re-loading the configuration failed, using '
+                              'the last good one: %s', e)
+        return self.config
+
+
+def parseargs(cmdline=sys.argv[1:]):
+    '''Parse CLI arguments
+    '''
+    import argparse
+    p = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument('--no-cache', action='store_true',
+                   help='do not use (or update) the cache')
+    p.add_argument('-v', '--verbose', action='store_true',
+                   help='show whether the cache was used')
+    p.add_argument('sources', nargs='+',
+                   help='configuration files (INI, YAML or JSON), lowest '
+                   'precedence first')
+    return p.parse_args(cmdline)
+
+
+def main():
+    args = parseargs()
+    cfg = LayeredConfig(args.sources,
+                        cache_dir=None if args.no_cache else CACHE_DIR)
+    try:
+        config = cfg.load()
+    except load_errors() as e:          # evaluated when an error occurs
+        print(f'Error: {e}', file=sys.stderr)
+        return 1
+    if args.verbose:
+        print(f'Loaded from: {cfg.loaded_from}', file=sys.stderr)
+    json.dump(config, sys.stdout, indent=2, default=str)
+    print()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
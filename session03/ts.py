@@ -24,7 +24,12 @@
 import sys
 import os.path
 import argparse
+import contextlib
 import openpyxl
+try:
+    import instrument                  # session10/instrument.py on PYTHONPATH
+except ImportError:                    # no --profile, --trace-memory, ...
+    instrument = None
 
 ### Constants
 
@@ -58,11 +63,16 @@ def parseargs(cmdline=sys.argv[1:], known_args_only=False):
     sp_add_rec.add_argument('record', type=str,
                              help='Add this record to sheet')
     sp_add_rec.set_defaults(func=add_rec)
+    if instrument:
+        instrument.add_arguments(p)    # --profile, --trace-memory, ...
 
     if known_args_only:
-        return p.parse_known_args(cmdline)[0] # interested in known args only
+        args = p.parse_known_args(cmdline)[0] # interested in known args only
     else:
-        return p.parse_args(cmdline)          # parse all args!
+        args = p.parse_args(cmdline)          # parse all args!
+    if instrument:
+        instrument.check_arguments(p, args)   # e.g.: collapsed needs FILE
+    return args
 
 ### Other functions
 
@@ -104,35 +114,51 @@ def add_rec(sheet, data):
         sheet.cell(row=next_row, column=col, value=value)
     return sheet
 
+### Instrumentation (optional)
+
+def phase(name):
+    '''Time a phase of the program, see: session10/instrument.py'''
+    return instrument.phase(name) if instrument else contextlib.nullcontext()
+
+def instrumented(args):
+    '''Profile and/or trace the memory use, if requested by the CLI args'''
+    if instrument:
+        return instrument.instrumented(args)
+    return contextlib.nullcontext()
+
 ### main starts here
-if __name__ == '__main__':
-    args = parseargs()
-    wb = wb_open(args.workbook)
-
-    if args.func == list_sheets:
-        for s in list_sheets(wb): print(s)
-
-    if args.func == add_sheet:
-        wb = add_sheet(workbook=wb, name=args.name)
-        wb.save(args.workbook)
-
-    if args.func == dump_data:
-        try:
-            ws = wb[args.name]
-            data = dump_data(ws)
-            print(data)
-        except KeyError as e:
-            print(e.args[0], file=sys.stderr)
-            sys.exit(20)
-
-    if args.func == add_rec:
-        try:
-            rec = args.record.split(args.delim)
-            ws = wb[args.name] if args.name else wb.active
-            add_rec(ws, rec)
-            wb.save(args.workbook)
-            print('Added record to sheet: {}'.format(ws.title))
-        except KeyError as e:
-            print(e.args[0], file=sys.stderr)
-            sys.exit(30)
 
+if __name__ == '__main__':
+    with phase('parse args'):
+        args = parseargs()
+    with instrumented(args):
+        with phase('load'):
+            wb = wb_open(args.workbook)
+
+        with phase('command'):
+            if args.func == list_sheets:
+                for s in list_sheets(wb): print(s)
+
+            if args.func == add_sheet:
+                wb = add_sheet(workbook=wb, name=args.name)
+                wb.save(args.workbook)
+
+            if args.func == dump_data:
+                try:
+                    ws = wb[args.name]
+                    data = dump_data(ws)
+                    print(data)
+                except KeyError as e:
+                    print(e.args[0], file=sys.stderr)
+                    sys.exit(20)
+
+            if args.func == add_rec:
+                try:
+                    rec = args.record.split(args.delim)
+                    ws = wb[args.name] if args.name else wb.active
+                    add_rec(ws, rec)
+                    wb.save(args.workbook)
+                    print('Added record to sheet: {}'.format(ws.title))
+                except KeyError as e:
+                    print(e.args[0], file=sys.stderr)
+                    sys.exit(30)
@@ -3,7 +3,22 @@
 
 import sys
 import argparse
+import contextlib
 import datetime
+try:
+    import instrument                  # session10/instrument.py on PYTHONPATH
+except ImportError:                    # no --profile, --trace-memory, ...
+    instrument = None
+
+SUMMARY = 'Summary'                    # sheet of the totals of export-xlsx
+
+def year_month(value):
+    '''Return the first day of the month *value*, e.g.: "2019-09"'''
+    try:
+        return datetime.datetime.strptime(value, '%Y-%m').date()
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            'not a month in YYYY-MM format: {!r}'.format(value))
 
 def parseargs(cmdline=sys.argv[1:], known_args_only=False):
     p = argparse.ArgumentParser()
@@ -59,7 +74,35 @@ def parseargs(cmdline=sys.argv[1:], known_args_only=False):
                             help='A custom remark for this booking')
     sp_booking.set_defaults(func=add_new_booking)
 
+    #-- arguments to export the bookings to a spreadsheet
+    sp_export = sp.add_parser('export-xlsx',
+                              help='Export bookings to an XLSX workbook, '
+                              'one sheet per user or project')
+    sp_export.add_argument('-b', '--by', choices='user project'.split(),
+                           default='user',
+                           help='create a sheet per user or per project')
+    sp_export.add_argument('-m', '--month', type=year_month, default=None,
+                           help='only the bookings of this month, e.g.: '
+                           '2019-09')
+    sp_export.add_argument('-F', '--from', dest='date_from', type=conv,
+                           default=None,
+                           help='only the bookings on or after this date')
+    sp_export.add_argument('-T', '--to', dest='date_to', type=conv,
+                           default=None,
+                           help='only the bookings on or before this date')
+    sp_export.add_argument('-i', '--create-index', action='store_true',
+                           help='create an index on the bookings (if it '
+                           'does not exist yet) to speed up this and later '
+                           'exports; this changes the database')
+    sp_export.add_argument('output', help='The XLSX file to write')
+    sp_export.set_defaults(func=export_xlsx)
+
+    if instrument:
+        instrument.add_arguments(p)    # --profile, --trace-memory, ...
+
     args = p.parse_args(cmdline)          # parse all args!
+    if instrument:
+        instrument.check_arguments(p, args)   # e.g.: collapsed needs FILE
 
     return args
 
@@ -187,11 +230,130 @@ def add_new_booking(conn, args):
     res = sql_exec(conn, sql, (args.user, args.project, args.date, args.hours, args.remarks))
     print('New booking added, id={}'.format(res[1]))
 
+def sheet_title(*parts):
+    '''Return a valid, max. 31 characters long sheet title, other than the
+    title of the summary sheet'''
+    title = ' '.join(str(p) for p in parts if p)
+    for c in '[]:*?/\\':
+        title = title.replace(c, '_')
+    if title[:31].lower() == SUMMARY.lower():   # sheet titles ignore case
+        title = '_' + title
+    return title[:31]
+
+def export_xlsx(conn, args):
+    '''Stream the bookings into a write-only workbook, one sheet per user or
+    project, plus a "Summary" sheet with the total hours of each sheet.
+
+    The query is ordered by user (or project), so a sheet is complete when
+    the next one starts: only the current row is kept in memory.
+    '''
+    import sqlite3
+    import openpyxl
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Font
+
+    if args.by == 'user':
+        group = 'u.id, u.fname, u.sname'
+        other = "p.name"
+        headers = 'Date Project Hours Remarks'.split()
+    else:
+        group = 'p.id, p.name, NULL'
+        other = "u.fname || ' ' || u.sname"
+        headers = 'Date User Hours Remarks'.split()
+    where, params = [], []
+    if args.month:
+        start = args.month
+        end = (start + datetime.timedelta(days=31)).replace(day=1)
+        where.append('b.date >= ? AND b.date < ?')
+        params += [start.isoformat(), end.isoformat()]
+    if args.date_from:
+        where.append('b.date >= ?')
+        params.append(args.date_from.isoformat())
+    if args.date_to:
+        where.append('b.date < ?')              # dates may have a time part
+        params.append((args.date_to + datetime.timedelta(days=1)).isoformat())
+    sql = '''
+    SELECT {group}, b.date, {other}, b.hours, b.remarks
+    FROM bookings as b
+         JOIN users as u ON b.user = u.id
+         JOIN projects as p ON b.project = p.id
+    {where}
+    ORDER BY {order}, b.date, b.id
+    '''.format(group=group, other=other,
+               where='WHERE ' + ' AND '.join(where) if where else '',
+               order=group.split(',')[0])
+    if args.create_index:
+        # lets SQLite walk the bookings in order, instead of sorting them all
+        try:
+            conn.execute('CREATE INDEX IF NOT EXISTS bookings_{0} '
+                         'ON bookings ({0}, date)'.format(args.by))
+        except sqlite3.OperationalError as e:   # e.g.: a read-only database
+            print('Warning: unable to create the index: {}'.format(e),
+                  file=sys.stderr)
+
+    wb = openpyxl.Workbook(write_only=True)
+    bold = Font(bold=True)
+    totals = []                         # (sheet title, bookings, hours)
+    def header_row(ws, values):
+        row = []
+        for value in values:
+            cell = WriteOnlyCell(ws, value=value)
+            cell.font = bold
+            row.append(cell)
+        return row
+    def finish(ws, nr_rows, hours):
+        ws.append(header_row(ws, ['Total', None,
+                                  '=SUM(C2:C{})'.format(nr_rows + 1)]))
+        totals.append((ws.title, nr_rows, hours))
+
+    ws, current = None, None
+    for key, name1, name2, date, other_name, hours, remarks in \
+            conn.execute(sql, params):
+        if key != current:
+            if ws is not None:
+                finish(ws, nr_rows, sum_hours)
+            current, nr_rows, sum_hours = key, 0, 0
+            ws = wb.create_sheet(sheet_title(key, name1, name2))
+            for col, width in zip('ABCD', (12, 40, 8, 60)):
+                ws.column_dimensions[col].width = width
+            ws.freeze_panes = 'A2'
+            ws.append(header_row(ws, headers))
+        date = datetime.date.fromisoformat(str(date)[:10])
+        ws.append([date, other_name, hours, remarks])
+        nr_rows += 1
+        sum_hours += hours or 0
+    if ws is not None:
+        finish(ws, nr_rows, sum_hours)
+
+    ws = wb.create_sheet(SUMMARY)
+    ws.column_dimensions['A'].width = 40
+    ws.append(header_row(ws, [args.by.capitalize(), 'Bookings', 'Hours']))
+    for row in totals:
+        ws.append(row)
+    wb.save(args.output)
+    print('Exported {} bookings to {} sheets of {}'.format(
+        sum(t[1] for t in totals), len(totals), args.output))
+
+
+def phase(name):
+    '''Time a phase of the program, see: session10/instrument.py'''
+    return instrument.phase(name) if instrument else contextlib.nullcontext()
+
+def instrumented(args):
+    '''Profile and/or trace the memory use, if requested by the CLI args'''
+    if instrument:
+        return instrument.instrumented(args)
+    return contextlib.nullcontext()
+
 
 if __name__ == '__main__':
-    arguments = parseargs()            # the CLI arguments provided by user
-    connection = dbconnect(arguments)  # connect to specified SQLite DB
-    if arguments.func != create_schema:
-        schema = verify_tables(connection, arguments)    # verify the tables
-    arguments.func(connection, arguments)   # invoke the requested function
+    with phase('parse args'):
+        arguments = parseargs()        # the CLI arguments provided by user
+    with instrumented(arguments):
+        with phase('load'):
+            connection = dbconnect(arguments)  # connect to specified SQLite DB
+            if arguments.func != create_schema:
+                schema = verify_tables(connection, arguments)  # verify tables
+        with phase('command'):
+            arguments.func(connection, arguments)  # invoke requested function
 
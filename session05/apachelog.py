@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+
+'''Fast parser of Apache access logs
+
+The log-analysis notebook reads the entire log with ``readlines()``, applies
+``re.match(apache_re, rec)`` to every line and converts each timestamp with
+``datetime.strptime()``. This module does the same, but scales to much larger
+logs:
+
+- the log file is memory-mapped and parsed in newline-aligned chunks, the
+  file is never read into RAM as a whole;
+- one pre-compiled (bytes) RegEx is applied to a whole chunk with
+  ``finditer()`` instead of calling ``re.match()`` per line;
+- timestamps are converted with a lookup cache (per second and per hour)
+  instead of ``strptime()``;
+- the result is columnar (``array.array`` per numeric field, ``list`` per text
+  field), optionally converted to NumPy arrays;
+- lines not matching the RegEx end up in ``unprocessed_records``, like in the
+  notebook.
+
+Usage as a module:
+
+  >>> import apachelog
+  >>> cols = apachelog.parse_file('apache_logs-public-example')
+  >>> len(cols), len(cols.unprocessed_records)
+  (9999, 1)
+
+Usage from the CLI:
+
+  ./apachelog.py apache_logs-public-example
+'''
+
+__author__ = 'Gábor Nyers'
+__version__ = '0.1.0'
+__license__ = 'CC BY-NC 4.0'
+
+import array
+import calendar
+import gzip
+import mmap
+import os
+import re
+import sys
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import List
+
+# The RegEx of the notebook (``apache_re_modified``) for whole chunks of bytes:
+# 1: IP address, 2-3: unused, 4: timestamp, 5: request, 6: HTTP status,
+# 7: nr. of bytes, 8: referrer, 9: User-Agent
+APACHE_RE = re.compile(
+    rb'^([\d\.]+) (.*?) (.*?) \[(.*?)\] "(.* HTTP.*)" (\d+) (\d+|-) '
+    rb'"(.*)" "(.*)"\r?$', re.MULTILINE)
+
+CHUNK_SIZE = 16 * 1024**2               # parse the logs in 16MB chunks
+
+MONTHS = {m.encode(): i for i, m in enumerate(
+    'Jan Feb Mar Apr May Jun Jul Aug Sep Oct Nov Dec'.split(), 1)}
+
+
+class TimestampConverter:
+    '''Convert Apache timestamps (e.g. ``17/May/2015:10:05:03 +0000``) to
+    seconds since the epoch (UTC)
+
+    Consecutive log records usually share the same second, and certainly the
+    same hour, so instead of ``strptime()``:
+
+    - a complete timestamp is looked up in a per-second cache, and if missing
+    - the "day/month/year:hour timezone" part is looked up in a per-hour
+      cache, the minutes and seconds are simply added.
+    '''
+
+    def __init__(self, max_seconds=100_000):
+        self.max_seconds = max_seconds  # limit of the per-second cache
+        self.seconds = {}               # full timestamp: epoch
+        self.hours = {}                 # "dd/Mon/yyyy:HH +zzzz": epoch
+
+    def hour(self, ts):
+        'Return the epoch of the start of the hour of timestamp ts (bytes)'
+        key = ts[:14] + ts[20:]
+        epoch = self.hours.get(key)
+        if epoch is None:
+            day, mon, year, hour = ts[:2], ts[3:6], ts[7:11], ts[12:14]
+            tz = ts[21:26] or b'+0000'
+            offset = (int(tz[1:3]) * 3600 + int(tz[3:5]) * 60) \
+                     * (-1 if tz[:1] == b'-' else 1)
+            epoch = calendar.timegm((int(year), MONTHS[mon], int(day),
+                                     int(hour), 0, 0)) - offset
+            self.hours[key] = epoch
+        return epoch
+
+    def __call__(self, ts):
+        epoch = self.seconds.get(ts)
+        if epoch is None:
+            epoch = self.hour(ts) + int(ts[15:17]) * 60 + int(ts[18:20])
+            if len(self.seconds) >= self.max_seconds:
+                self.seconds.clear()    # keep memory usage bounded
+            self.seconds[ts] = epoch
+        return epoch
+
+
+@dataclass
+class LogColumns:
+    '''Parsed log records, stored column by column'''
+    ip: List[str] = field(default_factory=list)
+    timestamp: array.array = field(default_factory=lambda: array.array('q'))
+    request: List[str] = field(default_factory=list)
+    status: array.array = field(default_factory=lambda: array.array('H'))
+    size: array.array = field(default_factory=lambda: array.array('q'))
+    referrer: List[str] = field(default_factory=list)
+    agent: List[str] = field(default_factory=list)
+    unprocessed_records: list = field(default_factory=list) # (offset, line)
+
+    COLUMNS = ('ip', 'timestamp', 'request', 'status', 'size', 'referrer',
+               'agent')
+
+    def __len__(self):
+        return len(self.timestamp)
+
+    def extend(self, other):
+        '''Append the records of LogColumns `other`'''
+        for col in self.COLUMNS:
+            getattr(self, col).extend(getattr(other, col))
+        self.unprocessed_records.extend(other.unprocessed_records)
+        return self
+
+    def records(self):
+        '''Yield the records as tuples, similar to the notebook's
+        ``content_cleaned``, i.e.: (ip, datetime, request, status, size,
+        referrer, agent)
+        '''
+        fromts = lambda ts: datetime.fromtimestamp(ts, timezone.utc)
+        return zip(self.ip, map(fromts, self.timestamp), self.request,
+                   self.status, self.size, self.referrer, self.agent)
+
+    def to_numpy(self):
+        '''Return the columns as a dict of NumPy arrays (requires numpy)'''
+        import numpy as np
+        return {col: np.asarray(getattr(self, col)) for col in self.COLUMNS}
+
+
+class Parser:
+    '''Parse Apache log records from a bytes-like object into LogColumns
+
+    One Parser instance keeps its caches between calls, so re-use it for
+    consecutive chunks of the same log.
+    '''
+
+    def __init__(self, regex=APACHE_RE, encoding='utf-8'):
+        self.regex = regex
+        self.encoding = encoding
+        self.to_epoch = TimestampConverter()
+        self._strings = {}              # bytes: str, de-duplicates strings
+
+    def text(self, value):
+        'Decode `value`, return the same str object for repeated values'
+        s = self._strings.get(value)
+        if s is None:
+            if len(self._strings) > 1_000_000:
+                self._strings.clear()   # keep memory usage bounded
+            s = self._strings[value] = value.decode(self.encoding, 'replace')
+        return s
+
+    def parse(self, buf, start=0, end=None, columns=None, offset=0):
+        '''Parse the records in buf[start:end], append them to `columns`
+
+        `start` should be the beginning of a line and `end` the end of a line
+        (or of `buf`). `offset` is added to the positions of the unprocessed
+        records, e.g.: the position of `buf` in a file.
+        '''
+        end = len(buf) if end is None else end
+        cols = LogColumns() if columns is None else columns
+        ip, ts, req, status, size, ref, agent = (
+            cols.ip.append, cols.timestamp.append, cols.request.append,
+            cols.status.append, cols.size.append, cols.referrer.append,
+            cols.agent.append)
+        text, to_epoch = self.text, self.to_epoch
+        pos = start
+        for m in self.regex.finditer(buf, start, end):
+            if m.start() > pos:         # skipped lines: did not match
+                self._unprocessed(buf, pos, m.start(), cols, offset)
+            f_ip, _, _, f_ts, f_req, f_status, f_size, f_ref, f_agent = \
+                m.groups()
+            ip(text(f_ip))
+            ts(to_epoch(f_ts))
+            req(f_req.decode(self.encoding, 'replace'))
+            status(int(f_status))
+            size(int(f_size) if f_size != b'-' else 0)
+            ref(text(f_ref))
+            agent(text(f_agent))
+            pos = m.end() + 1           # skip the newline
+        if pos < end:
+            self._unprocessed(buf, pos, end, cols, offset)
+        return cols
+
+    def _unprocessed(self, buf, start, end, cols, offset):
+        'Add the non-empty lines of buf[start:end] to unprocessed_records'
+        for line in bytes(buf[start:end]).split(b'\n'):
+            if line.strip():
+                cols.unprocessed_records.append(
+                    (offset + start, line.decode(self.encoding, 'replace')))
+            start += len(line) + 1
+
+
+def request_url(request):
+    '''Return the URL of `request`, e.g.: "GET /index.html HTTP/1.1"'''
+    parts = request.split(' ', 2)
+    return parts[1] if len(parts) > 1 else request
+
+
+def chunk_bounds(buf, start=0, end=None, chunk_size=CHUNK_SIZE):
+    '''Yield (start, end) positions of newline-aligned chunks of buf[start:end]
+    '''
+    end = len(buf) if end is None else end
+    while start < end:
+        stop = min(start + chunk_size, end)
+        if stop < end:
+            nl = buf.find(b'\n', stop, end)
+            stop = end if nl == -1 else nl + 1
+        yield start, stop
+        start = stop
+
+
+def iter_parse_file(path, start=0, end=None, chunk_size=CHUNK_SIZE,
+                    parser=None):
+    '''Parse log file `path` from byte `start` to `end`, yield a LogColumns
+    object per chunk; this keeps memory usage constant.
+
+    `start` and `end` must be at line boundaries. Gzip-ed logs (``*.gz``) are
+    decompressed on the fly, these can only be parsed as a whole.
+    '''
+    parser = parser or Parser()
+    if str(path).endswith('.gz'):
+        yield from iter_parse_stream(gzip.open(path, 'rb'), chunk_size, parser)
+        return
+    with open(path, 'rb') as fh:
+        if os.fstat(fh.fileno()).st_size == 0:
+            return                      # an empty file can't be mmap-ed
+        with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for c_start, c_end in chunk_bounds(mm, start, end, chunk_size):
+                yield parser.parse(mm, c_start, c_end)
+
+
+def iter_parse_stream(fh, chunk_size=CHUNK_SIZE, parser=None):
+    '''Parse the log records read from binary file object `fh`, yield a
+    LogColumns object per chunk of at most `chunk_size` bytes
+
+    A chunk holds the data available at the time, e.g.: the lines written
+    to a pipe since the previous read; the next read doesn't wait until
+    `chunk_size` bytes arrived.
+    '''
+    parser = parser or Parser()
+    read = getattr(fh, 'read1', fh.read)    # read1: don't wait for more data
+    offset, rest = 0, b''
+    with fh:
+        while True:
+            data = read(chunk_size)
+            buf = rest + data
+            if not data:                # EOF: parse the last, partial line
+                if buf:
+                    yield parser.parse(buf, offset=offset)
+                return
+            nl = buf.rfind(b'\n') + 1  # parse only complete lines
+            rest = buf[nl:]
+            if nl:
+                yield parser.parse(buf, 0, nl, offset=offset)
+                offset += nl
+
+
+def parse_file(path, start=0, end=None, chunk_size=CHUNK_SIZE):
+    '''Parse log file `path` and return all records as one LogColumns'''
+    cols = LogColumns()
+    for chunk in iter_parse_file(path, start, end, chunk_size):
+        cols.extend(chunk)
+    return cols
+
+
+def parseargs(cmdline=sys.argv[1:]):
+    '''Parse CLI arguments
+    '''
+    import argparse
+    p = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument('-c', '--chunk-size', type=int, default=CHUNK_SIZE,
+                   help=f'parse the log in chunks of this many bytes '
+                   f'(default: {CHUNK_SIZE})')
+    p.add_argument('-u', '--show-unprocessed', action='store_true',
+                   help='print the records that could not be parsed')
+    p.add_argument('logfile', help='Apache access log file')
+    return p.parse_args(cmdline)
+
+
+def main():
+    '''Parse a log file and print a summary'''
+    import time
+    args = parseargs()
+    began = time.perf_counter()
+    nr_of_recs, unprocessed = 0, []
+    for chunk in iter_parse_file(args.logfile, chunk_size=args.chunk_size):
+        nr_of_recs += len(chunk)
+        unprocessed.extend(chunk.unprocessed_records)
+    elapsed = time.perf_counter() - began
+    print(f'Parsed records: {nr_of_recs}')
+    print(f'Number of unprocessed records: {len(unprocessed)}')
+    print(f'Elapsed: {elapsed:.3f}s '
+          f'({nr_of_recs / (elapsed or 1e-9):,.0f} records/s)')
+    if args.show_unprocessed:
+        for offset, line in unprocessed:
+            print(f'{offset}: {line}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,624 @@
+#!/usr/bin/env python3
+
+'''Analyze (large) Apache access logs
+
+The questions of the log-analysis notebook, e.g.: "What are the 10 most
+frequent IP addresses?", "What is the timespan of the logs?", but for logs
+that do not fit in RAM:
+
+- the log files (plain or ``*.gz``, e.g. a set of rotated logs) are split
+  into shards on newline-aligned byte offsets;
+- the shards are parsed in parallel by a pool of processes;
+- each process returns only the *aggregates* of its shard (see ``LogStats``),
+  never the records themselves. These are merged into the final result.
+
+Usage:
+
+  ./loganalysis.py stats apache_logs-public-example
+  ./loganalysis.py stats -j 8 /var/log/apache2/access.log*
+
+For unbounded logs the "stream" command uses fixed-memory, approximate
+aggregates (see ``sketches.py``), which can be saved and merged later, e.g.:
+per hour or per host:
+
+  tail -F access.log | ./loganalysis.py stream --interval 60 --save web1.json -
+  ./loganalysis.py stream --load web1.json web2.json
+
+For repeated ad-hoc queries, ingest the logs once (and incrementally
+afterwards) into an indexed SQLite store (see ``logstore.py``):
+
+  ./loganalysis.py ingest -d logs.db access.log
+  ./loganalysis.py query -d logs.db --ip 66.249.73.135 --status 404 \\
+      --hour 2015-05-17T10
+
+Browser, OS, bot and route statistics (see ``logclassify.py``), the
+classification results are cached between runs:
+
+  ./loganalysis.py classify apache_logs-public-example
+
+Follow live logs (handles rotation), emit 1m/5m/1h aggregates every 10s (see
+``logfollow.py``):
+
+  ./loganalysis.py follow /var/log/apache2/access.log
+  ./loganalysis.py follow --emit-to localhost:5170 access.log other.log
+'''
+
+__author__ = 'Gábor Nyers'
+__version__ = '0.1.0'
+__license__ = 'CC BY-NC 4.0'
+
+import collections
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+
+import apachelog
+import logclassify
+import logfollow
+import logstore
+import sketches
+
+CLASSIFY_CACHE = os.environ.get(
+    'LOGCLASSIFY_CACHE', os.path.expanduser('~/.cache/logclassify.json'))
+SHARD_SIZE = 64 * 1024**2               # max. nr. of bytes per shard
+MIN_SHARD_SIZE = 1024**2                # don't bother splitting below this
+
+
+@dataclass
+class LogStats:
+    '''Mergeable aggregates of a set of log records'''
+    records: int = 0
+    unprocessed: int = 0
+    bytes: int = 0
+    first: int = None                   # earliest timestamp (epoch)
+    last: int = None                    # latest timestamp (epoch)
+    ips: collections.Counter = field(default_factory=collections.Counter)
+    status: collections.Counter = field(default_factory=collections.Counter)
+    hours: collections.Counter = field(default_factory=collections.Counter)
+
+    def update(self, cols):
+        '''Add the records of apachelog.LogColumns `cols`'''
+        self.unprocessed += len(cols.unprocessed_records)
+        if not len(cols):
+            return self
+        self.records += len(cols)
+        self.bytes += sum(cols.size)
+        self.ips.update(cols.ip)
+        self.status.update(cols.status)
+        self.hours.update(ts - ts % 3600 for ts in cols.timestamp)
+        self._timespan(min(cols.timestamp), max(cols.timestamp))
+        return self
+
+    def _timespan(self, first, last):
+        'Extend the timespan with `first` and `last` (either may be None)'
+        if first is not None and (self.first is None or first < self.first):
+            self.first = first
+        if last is not None and (self.last is None or last > self.last):
+            self.last = last
+
+    def merge(self, other):
+        '''Add the aggregates of LogStats `other`'''
+        self.records += other.records
+        self.unprocessed += other.unprocessed
+        self.bytes += other.bytes
+        self.ips.update(other.ips)
+        self.status.update(other.status)
+        self.hours.update(other.hours)
+        self._timespan(other.first, other.last)
+        return self
+
+    def requests_by_day(self):
+        '''Return {'YYYY-mm-dd': nr. of requests}, derived from the hours'''
+        days = collections.Counter()
+        for hour, count in self.hours.items():
+            day = datetime.fromtimestamp(hour, timezone.utc)
+            days[day.strftime('%Y-%m-%d')] += count
+        return dict(sorted(days.items()))
+
+    def as_dict(self, top=10):
+        '''Return a summary of the aggregates, e.g. to dump as JSON'''
+        fmt = lambda ts: (None if ts is None else
+                          datetime.fromtimestamp(ts, timezone.utc).isoformat())
+        return {
+            'records': self.records,
+            'unprocessed': self.unprocessed,
+            'bytes': self.bytes,
+            'first': fmt(self.first),
+            'last': fmt(self.last),
+            'distinct_ips': len(self.ips),
+            'top_ips': self.ips.most_common(top),
+            'status': dict(sorted(self.status.items())),
+            'requests_by_day': self.requests_by_day(),
+        }
+
+
+class StreamStats:
+    '''Fixed-memory, mergeable (approximate) aggregates of log records
+
+    - distinct IP addresses: HyperLogLog
+    - most frequent IP addresses, URLs and User-Agents: TopK
+    - quantiles of the response sizes: TDigest
+    '''
+
+    def __init__(self, precision=14, k=50, epsilon=0.0005, delta=0.01,
+                 compression=100):
+        self.records = 0
+        self.unprocessed = 0
+        self.bytes = 0
+        self.first = None
+        self.last = None
+        self.status = collections.Counter()     # nr. of distinct is small
+        self.distinct_ips = sketches.HyperLogLog(precision)
+        self.ips = sketches.TopK(k, epsilon, delta)
+        self.urls = sketches.TopK(k, epsilon, delta)
+        self.agents = sketches.TopK(k, epsilon, delta)
+        self.sizes = sketches.TDigest(compression)
+
+    _timespan = LogStats._timespan
+
+    def update(self, cols):
+        '''Add the records of apachelog.LogColumns `cols`
+
+        The values are counted per chunk first, so the sketches are updated
+        once per distinct value of the chunk, instead of once per record.
+        '''
+        self.unprocessed += len(cols.unprocessed_records)
+        if not len(cols):
+            return self
+        self.records += len(cols)
+        self.bytes += sum(cols.size)
+        self.status.update(cols.status)
+        self._timespan(min(cols.timestamp), max(cols.timestamp))
+        ips = collections.Counter(cols.ip)
+        for ip, count in ips.items():
+            self.distinct_ips.add(ip)
+            self.ips.add(ip, count)
+        urls = collections.Counter(map(apachelog.request_url, cols.request))
+        for url, count in urls.items():
+            self.urls.add(url, count)
+        for agent, count in collections.Counter(cols.agent).items():
+            self.agents.add(agent, count)
+        for size, count in collections.Counter(cols.size).items():
+            self.sizes.add(size, count)
+        return self
+
+    def merge(self, other):
+        '''Add the aggregates of StreamStats `other`'''
+        self.records += other.records
+        self.unprocessed += other.unprocessed
+        self.bytes += other.bytes
+        self.status.update(other.status)
+        self._timespan(other.first, other.last)
+        self.distinct_ips.merge(other.distinct_ips)
+        self.ips.merge(other.ips)
+        self.urls.merge(other.urls)
+        self.agents.merge(other.agents)
+        self.sizes.merge(other.sizes)
+        return self
+
+    SKETCHES = {'distinct_ips': sketches.HyperLogLog, 'ips': sketches.TopK,
+                'urls': sketches.TopK, 'agents': sketches.TopK,
+                'sizes': sketches.TDigest}
+
+    def to_dict(self):
+        d = {'records': self.records, 'unprocessed': self.unprocessed,
+             'bytes': self.bytes, 'first': self.first, 'last': self.last,
+             'status': self.status}
+        d.update({name: getattr(self, name).to_dict()
+                  for name in self.SKETCHES})
+        return d
+
+    @classmethod
+    def from_dict(cls, d):
+        stats = cls.__new__(cls)
+        for name in 'records unprocessed bytes first last'.split():
+            setattr(stats, name, d[name])
+        stats.status = collections.Counter(
+            {int(k): v for k, v in d['status'].items()})
+        for name, sketch in cls.SKETCHES.items():
+            setattr(stats, name, sketch.from_dict(d[name]))
+        return stats
+
+    def save(self, path):
+        tmp = f'{path}.tmp'             # never leave a partially saved state
+        with open(tmp, 'w') as fh:
+            json.dump(self.to_dict(), fh)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as fh:
+            return cls.from_dict(json.load(fh))
+
+
+def line_aligned(fh, offset):
+    '''Return the offset of the first line starting at or after `offset`'''
+    if offset == 0:
+        return 0
+    fh.seek(offset - 1)
+    fh.readline()                       # skip to the end of the current line
+    return fh.tell()
+
+
+def shards(paths, jobs=1, shard_size=SHARD_SIZE):
+    '''Yield (path, start, end) shards of the log files in `paths`
+
+    Plain files are split into at least `jobs` shards (if large enough) of at
+    most `shard_size` bytes, gzip-ed files are always a single shard.
+    '''
+    for path in paths:
+        size = os.path.getsize(path)
+        if str(path).endswith('.gz') or size < 2 * MIN_SHARD_SIZE:
+            yield path, 0, None
+            continue
+        nr = max(-(-size // shard_size), min(jobs, size // MIN_SHARD_SIZE))
+        with open(path, 'rb') as fh:
+            bounds = sorted({line_aligned(fh, size * i // nr)
+                             for i in range(nr)} | {size})
+        for start, end in zip(bounds, bounds[1:]):
+            yield path, start, end
+
+
+def analyze_shard(shard):
+    '''Parse one shard, return its LogStats (runs in a worker process)'''
+    path, start, end = shard
+    stats = LogStats()
+    for cols in apachelog.iter_parse_file(path, start, end):
+        stats.update(cols)
+    return stats
+
+
+def analyze(paths, jobs=None, shard_size=SHARD_SIZE):
+    '''Analyze the log files in `paths` with `jobs` processes, return the
+    merged LogStats
+    '''
+    jobs = jobs or os.cpu_count() or 1
+    work = list(shards(paths, jobs, shard_size))
+    total = LogStats()
+    if jobs == 1 or len(work) == 1:
+        for shard in work:
+            total.merge(analyze_shard(shard))
+        return total
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        for stats in pool.map(analyze_shard, work):
+            total.merge(stats)
+    return total
+
+
+def print_report(stats, top=10, file=sys.stdout):
+    '''Print the aggregates in the form of the notebook's answers'''
+    pr = lambda *a: print(*a, file=file)
+    pr(f'Parsed records: {stats.records}')
+    pr(f'Number of unprocessed records: {stats.unprocessed}')
+    pr(f'Bytes transmitted: {stats.bytes}')
+    pr(f'The {top} most frequent IP addresses:')
+    for ip, count in stats.ips.most_common(top):
+        pr(f'  {ip}: {count}')
+    pr(f'The number of distinct IP addresses: {len(stats.ips)}')
+    if stats.first is not None:
+        first, last = (datetime.fromtimestamp(ts, timezone.utc)
+                       for ts in (stats.first, stats.last))
+        pr(f'Timespan: {first} - {last} ({last - first})')
+    pr('HTTP status codes:')
+    for status, count in sorted(stats.status.items()):
+        pr(f'  {status}: {count}')
+    pr('Requests by day:')
+    for day, count in stats.requests_by_day().items():
+        pr(f'  {day}: {count}')
+
+
+def print_stream_report(stats, top=10, file=sys.stdout):
+    '''Print the approximate aggregates of StreamStats `stats`'''
+    pr = lambda *a: print(*a, file=file)
+    pr(f'Parsed records: {stats.records}')
+    pr(f'Number of unprocessed records: {stats.unprocessed}')
+    pr(f'Bytes transmitted: {stats.bytes}')
+    pr(f'The number of distinct IP addresses (approx.): '
+       f'{len(stats.distinct_ips)}')
+    if stats.first is not None:
+        first, last = (datetime.fromtimestamp(ts, timezone.utc)
+                       for ts in (stats.first, stats.last))
+        pr(f'Timespan: {first} - {last} ({last - first})')
+    for title, topk in (('IP addresses', stats.ips), ('URLs', stats.urls),
+                        ('User-Agents', stats.agents)):
+        pr(f'The {top} most frequent {title} (approx.):')
+        for value, count in topk.most_common(top):
+            pr(f'  {count}: {value}')
+    pr('HTTP status codes:')
+    for status, count in sorted(stats.status.items()):
+        pr(f'  {status}: {count}')
+    pr('Response size quantiles (approx.):')
+    for q in (0.5, 0.9, 0.99, 0.999):
+        pr(f'  {q * 100:g}%: {stats.sizes.quantile(q) or 0:.0f} bytes')
+
+
+def cmd_stream(args):
+    '''Handle the "stream" sub-command'''
+    stats = StreamStats(args.hll_precision, args.top_k, args.epsilon,
+                        args.delta, args.compression)
+    for path in args.load:
+        stats.merge(StreamStats.load(path))
+    parser = apachelog.Parser()                 # share caches between files
+    emitted, interrupted = time.monotonic(), False
+    try:
+        for path in args.logfiles:
+            if path == '-':
+                chunks = apachelog.iter_parse_stream(sys.stdin.buffer,
+                                                     args.chunk_size, parser)
+            else:
+                chunks = apachelog.iter_parse_file(
+                    path, chunk_size=args.chunk_size, parser=parser)
+            for cols in chunks:
+                stats.update(cols)
+                if args.interval and \
+                        time.monotonic() - emitted >= args.interval:
+                    if args.save:
+                        stats.save(args.save)
+                    print_stream_report(stats, args.top)
+                    print(flush=True)
+                    emitted = time.monotonic()
+    except KeyboardInterrupt:           # e.g.: stop reading `tail -F`
+        interrupted = True
+    if args.save:
+        stats.save(args.save)
+    print_stream_report(stats, args.top)
+    return 130 if interrupted else 0
+
+
+def cmd_ingest(args):
+    '''Handle the "ingest" sub-command'''
+    store = logstore.LogStore(args.database)
+    for path in args.logfiles:
+        began = time.perf_counter()
+        parsed, unprocessed = store.ingest(path)
+        elapsed = time.perf_counter() - began
+        print(f'{path}: ingested {parsed} records, {unprocessed} '
+              f'unprocessed ({elapsed:.3f}s)')
+    store.close()
+    return 0
+
+
+def cmd_query(args):
+    '''Handle the "query" sub-command'''
+    import csv
+    since, until = args.since, args.until
+    if args.hour is not None:
+        since, until = args.hour, args.hour + 3600
+    store = logstore.LogStore(args.database)
+    records = store.query(ip=args.ip, status=args.status, since=since,
+                          until=until, limit=args.limit)
+    w = csv.writer(sys.stdout, delimiter=';')
+    for ts, *rest in records:
+        w.writerow([datetime.fromtimestamp(ts, timezone.utc).isoformat(),
+                    *rest])
+    store.close()
+    return 0
+
+
+def cmd_classify(args):
+    '''Handle the "classify" sub-command'''
+    classifier = logclassify.Classifier(args.cache or None, args.cache_size)
+    counters = collections.defaultdict(collections.Counter)
+    parser = apachelog.Parser()
+    for path in args.logfiles:
+        for cols in apachelog.iter_parse_file(path, parser=parser):
+            for agent, count in collections.Counter(cols.agent).items():
+                ua = classifier.agent(agent)
+                counters['Client kinds'][ua.kind] += count
+                counters['Clients'][f'{ua.name or "?"} ({ua.kind})'] += count
+                counters['Operating systems'][ua.os or '?'] += count
+                if ua.device:
+                    counters['Browser devices'][ua.device] += count
+            for request, count in collections.Counter(cols.request).items():
+                req = classifier.request(request)
+                counters['Request kinds'][req.kind] += count
+                counters['Routes'][req.route] += count
+    if args.cache:
+        classifier.save()
+    for title, counter in counters.items():
+        print(f'{title}:')
+        for value, count in counter.most_common(args.top):
+            print(f'  {count}: {value}')
+    for name, stats in classifier.stats().items():
+        print(f'Cache of {name}: {stats["size"]} entries, '
+              f'hit rate: {stats["hit_rate"]:.1%}', file=sys.stderr)
+    return 0
+
+
+def cmd_follow(args):
+    '''Handle the "follow" sub-command'''
+    import asyncio
+    windows = dict(args.windows)
+    try:
+        follower = asyncio.run(logfollow.follow(
+            args.logfiles, emit_to=args.emit_to, duration=args.duration,
+            windows=windows, history=args.history, top=args.top,
+            interval=args.interval, from_start=args.from_start))
+    except KeyboardInterrupt:
+        return 0
+    except OSError as e:                # e.g.: a log file is not readable
+        print(f'Error: {e}', file=sys.stderr)
+        return 1
+    print(f'Followed records: {follower.records}, unprocessed: '
+          f'{follower.unprocessed}', file=sys.stderr)
+    return 0
+
+
+def cmd_stats(args):
+    '''Handle the "stats" sub-command'''
+    began = time.perf_counter()
+    stats = analyze(args.logfiles, args.jobs, args.shard_size)
+    elapsed = time.perf_counter() - began
+    if args.json:
+        json.dump(stats.as_dict(args.top), sys.stdout, indent=2)
+        print()
+    else:
+        print_report(stats, args.top)
+    print(f'Elapsed: {elapsed:.3f}s', file=sys.stderr)
+    return 0
+
+
+def parseargs(cmdline=sys.argv[1:]):
+    '''Parse CLI arguments
+    '''
+    import argparse
+    p = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    sp = p.add_subparsers(help='commands', required=True)
+
+    #-- stats: exact aggregates, computed in parallel
+    sp_stats = sp.add_parser('stats', help='Aggregate statistics of logs')
+    sp_stats.add_argument('-j', '--jobs', type=int, default=None,
+                          help='nr. of worker processes '
+                          '(default: nr. of CPUs)')
+    sp_stats.add_argument('-s', '--shard-size', type=int, default=SHARD_SIZE,
+                          help=f'max. bytes per shard (default: {SHARD_SIZE})')
+    sp_stats.add_argument('-t', '--top', type=int, default=10,
+                          help='show the top N IP addresses (default: 10)')
+    sp_stats.add_argument('--json', action='store_true',
+                          help='output the aggregates as JSON')
+    sp_stats.add_argument('logfiles', nargs='+',
+                          help='log files, plain or gzip-ed (*.gz)')
+    sp_stats.set_defaults(func=cmd_stats)
+
+    #-- stream: approximate aggregates in fixed memory
+    sp_stream = sp.add_parser('stream', help='Approximate statistics of '
+                              'unbounded logs in fixed memory')
+    sp_stream.add_argument('-t', '--top', type=int, default=10,
+                           help='show the top N values (default: 10)')
+    sp_stream.add_argument('-k', '--top-k', type=int, default=50,
+                           help='nr. of heavy hitters to track (default: 50)')
+    sp_stream.add_argument('-p', '--hll-precision', type=int, default=14,
+                           help='HyperLogLog precision, 4..18 (default: 14, '
+                           'i.e.: 16KB, 0.8%% error)')
+    sp_stream.add_argument('-e', '--epsilon', type=float, default=0.0005,
+                           help='Count-Min error, relative to the total '
+                           'count (default: 0.0005)')
+    sp_stream.add_argument('-d', '--delta', type=float, default=0.01,
+                           help='Count-Min probability of exceeding the '
+                           'error (default: 0.01)')
+    sp_stream.add_argument('-c', '--compression', type=int, default=100,
+                           help='t-digest compression (default: 100)')
+    sp_stream.add_argument('--chunk-size', type=int, default=1024**2,
+                           help='parse the input in chunks of this many '
+                           'bytes (default: 1MB)')
+    sp_stream.add_argument('-l', '--load', nargs='+', default=[],
+                           metavar='STATE', help='merge previously saved '
+                           'state file(s) (requires equal settings)')
+    sp_stream.add_argument('-s', '--save', metavar='STATE',
+                           help='save the resulting state to this file')
+    sp_stream.add_argument('-i', '--interval', type=float, default=0,
+                           metavar='SECONDS',
+                           help='also print the report and save the state '
+                           'every N seconds (default: only at the end)')
+    sp_stream.add_argument('logfiles', nargs='*', default=[],
+                           help='log files, plain or gzip-ed (*.gz), '
+                           '"-" for STDIN')
+    sp_stream.set_defaults(func=cmd_stream)
+
+    #-- classify: User-Agent and URL statistics
+    sp_classify = sp.add_parser('classify', help='Browser, OS, bot and '
+                                'route statistics')
+    sp_classify.add_argument('-t', '--top', type=int, default=10,
+                             help='show the top N values (default: 10)')
+    sp_classify.add_argument('-c', '--cache', default=CLASSIFY_CACHE,
+                             help='classification cache file, "" to disable '
+                             '(default: env. variable "LOGCLASSIFY_CACHE" or '
+                             f'{CLASSIFY_CACHE})')
+    sp_classify.add_argument('--cache-size', type=int, default=100_000,
+                             help='max. nr. of cached classifications '
+                             '(default: 100000)')
+    sp_classify.add_argument('logfiles', nargs='+',
+                             help='log files, plain or gzip-ed (*.gz)')
+    sp_classify.set_defaults(func=cmd_classify)
+
+    #-- follow: live logs, time-windowed aggregates
+    def window(value):
+        'Convert e.g. "5m" to ("5m", 300)'
+        units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+        try:
+            return value, int(value[:-1]) * units[value[-1]]
+        except (KeyError, ValueError):
+            raise argparse.ArgumentTypeError(
+                f'Need a window width like 30s, 5m or 1h, got: "{value}"')
+
+    sp_follow = sp.add_parser('follow', help='Follow live logs, emit '
+                              'time-windowed aggregates')
+    sp_follow.add_argument('-w', '--windows', type=window, nargs='+',
+                           default=list(logfollow.WINDOWS.items()),
+                           help='widths of the tumbling windows '
+                           '(default: 1m 5m 1h)')
+    sp_follow.add_argument('-i', '--interval', type=float, default=10,
+                           help='emit the aggregates every N seconds '
+                           '(default: 10)')
+    sp_follow.add_argument('-H', '--history', type=int, default=60,
+                           help='nr. of completed windows to keep '
+                           '(default: 60)')
+    sp_follow.add_argument('-t', '--top', type=int, default=10,
+                           help='show the top N IP addresses (default: 10)')
+    sp_follow.add_argument('-e', '--emit-to', metavar='ADDRESS',
+                           help='emit to "host:port" (TCP) or a Unix socket '
+                           'path instead of STDOUT')
+    sp_follow.add_argument('-b', '--from-start', action='store_true',
+                           help='read the existing content of the logs too')
+    sp_follow.add_argument('-d', '--duration', type=float,
+                           help='stop after N seconds (default: never)')
+    sp_follow.add_argument('logfiles', nargs='+', help='log files to follow')
+    sp_follow.set_defaults(func=cmd_follow)
+
+    #-- ingest / query: persistent, indexed log store
+    def epoch(value):
+        'Convert an ISO timestamp, e.g.: 2015-05-17T10:05, to epoch (UTC)'
+        try:
+            ts = datetime.fromisoformat(value)
+        except ValueError as e:
+            raise argparse.ArgumentTypeError(str(e))
+        if ts.tzinfo is None:
+            ts = ts.replace(tzinfo=timezone.utc)
+        return int(ts.timestamp())
+
+    def hour(value):
+        'Convert e.g. 2015-05-17T10 to the epoch of the start of that hour'
+        return epoch(value + ':00' if len(value) == 13 else value)
+
+    sp_ingest = sp.add_parser('ingest', help='Ingest (new records of) logs '
+                              'into an indexed SQLite store')
+    sp_ingest.add_argument('-d', '--database', required=True,
+                           help='the SQLite database of the log store')
+    sp_ingest.add_argument('logfiles', nargs='+',
+                           help='log files, plain or gzip-ed (*.gz)')
+    sp_ingest.set_defaults(func=cmd_ingest)
+
+    sp_query = sp.add_parser('query', help='Query the log store')
+    sp_query.add_argument('-d', '--database', required=True,
+                          help='the SQLite database of the log store')
+    sp_query.add_argument('-i', '--ip', help='only this IP address')
+    sp_query.add_argument('-s', '--status', type=int,
+                          help='only this HTTP status')
+    sp_query.add_argument('--since', type=epoch,
+                          help='from this time on, e.g.: 2015-05-17T10:05')
+    sp_query.add_argument('--until', type=epoch,
+                          help='until (excluding) this time')
+    sp_query.add_argument('-H', '--hour', type=hour,
+                          help='only this hour, e.g.: 2015-05-17T10')
+    sp_query.add_argument('-l', '--limit', type=int,
+                          help='return at most this many records')
+    sp_query.set_defaults(func=cmd_query)
+
+    return p.parse_args(cmdline)
+
+
+def main():
+    '''Immediate code if module is run directly, instead of being imported
+    '''
+    args = parseargs()
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
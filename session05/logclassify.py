@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+
+'''Classification of User-Agent strings and request URLs
+
+Reports over the User-Agent (field 9) and request (field 5) of the log
+records need e.g.: browser, operating system and bot detection, or URLs
+normalized into "routes". These are RegEx-heavy and relatively expensive, but
+the number of *distinct* values is only a tiny fraction of the number of log
+records. So the results are memoized in a bounded LRU cache, which can be
+saved and loaded between runs: classifying 100M log records costs roughly
+as much as classifying the distinct User-Agents among them.
+
+  >>> c = Classifier()
+  >>> c.agent('Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)')
+  UserAgent(kind='bot', name='Googlebot', version='2.1', os='', device='')
+  >>> c.request('GET /blog/tags/puppet?flav=rss20 HTTP/1.1')
+  Request(method='GET', path='/blog/tags/puppet', route='/blog/tags/:name', kind='feed')
+'''
+
+__author__ = 'Gábor Nyers'
+__version__ = '0.1.0'
+__license__ = 'CC BY-NC 4.0'
+
+import collections
+import json
+import os
+import re
+import sys
+from typing import NamedTuple
+from urllib.parse import unquote
+
+# Increase when the classification rules change: invalidates saved caches
+RULES_VERSION = 1
+
+
+class UserAgent(NamedTuple):
+    kind: str                           # bot, browser, tool or other
+    name: str                           # e.g.: Chrome, Googlebot, curl
+    version: str
+    os: str
+    device: str                         # desktop, mobile, tablet or ''
+
+
+class Request(NamedTuple):
+    method: str
+    path: str                           # URL without query, percent-decoded
+    route: str                          # path with variable parts replaced
+    kind: str                           # page, image, css, js, feed, ...
+
+
+# (kind, name, RegEx with the version as 1st group), first match wins
+AGENT_RULES = [(kind, name, re.compile(regex, re.IGNORECASE)) for
+               kind, name, regex in (
+    ('bot', 'Googlebot', r'Googlebot(?:-\w+)?/([\d.]+)'),
+    ('bot', 'Bingbot', r'bingbot/([\d.]+)'),
+    ('bot', 'Baiduspider', r'Baiduspider(?:-\w+)?/?([\d.]*)'),
+    ('bot', 'YandexBot', r'YandexBot/([\d.]+)'),
+    ('bot', 'Yahoo! Slurp', r'Yahoo! Slurp()'),
+    ('bot', 'Sogou', r'Sogou web spider/([\d.]+)'),
+    ('bot', 'Feed fetcher', r'(?:Feedfetcher-Google|Feedly|FeedParser|'
+                            r'Tiny Tiny RSS|feed)\S*?/?([\d.]*)'),
+    ('bot', 'Other bot', r'(?:bot|crawl|spider|slurp|archiver)\S*?/?([\d.]*)'),
+    ('tool', 'curl', r'^curl/([\d.]+)'),
+    ('tool', 'Wget', r'^Wget/([\d.]+)'),
+    ('tool', 'Python', r'python(?:-urllib|-requests)?/([\d.]+)'),
+    ('tool', 'Java', r'^Java/([\d._]+)'),
+    ('browser', 'Edge', r'Edge?/([\d.]+)'),
+    ('browser', 'Opera', r'(?:OPR|Opera)/([\d.]+)'),
+    ('browser', 'Chrome', r'(?:Chrome|CriOS|Chromium)/([\d.]+)'),
+    ('browser', 'Firefox', r'(?:Firefox|FxiOS)/([\d.]+)'),
+    ('browser', 'Safari', r'Version/([\d.]+).*Safari/'),
+    ('browser', 'Internet Explorer', r'(?:MSIE |Trident/.*rv:)([\d.]+)'),
+)]
+
+OS_RULES = [(name, re.compile(regex, re.IGNORECASE)) for name, regex in (
+    ('iOS', r'iPhone|iPad|iPod'),
+    ('Android', r'Android'),
+    ('Windows', r'Windows'),
+    ('macOS', r'Mac OS X|Macintosh'),
+    ('ChromeOS', r'CrOS'),
+    ('Linux', r'Linux|X11'),
+)]
+
+DEVICE_RULES = [(name, re.compile(regex, re.IGNORECASE)) for name, regex in (
+    ('tablet', r'iPad|Tablet'),
+    ('mobile', r'Mobi|iPhone|Android|Opera Mini|MIDP|UP\.Browser'),
+)]
+
+# file extension: kind of request
+URL_KINDS = {ext: kind for kind, exts in (
+    ('image', '.png .jpg .jpeg .gif .ico .svg .webp'),
+    ('css', '.css'),
+    ('js', '.js'),
+    ('font', '.ttf .woff .woff2 .eot .otf'),
+    ('feed', '.rss .atom .xml'),
+    ('download', '.gz .tgz .zip .tar .bz2 .rpm .deb .pdf'),
+) for ext in exts.split()}
+
+# path segments to replace with a placeholder: (RegEx, placeholder)
+ROUTE_RULES = [(re.compile(regex), placeholder) for regex, placeholder in (
+    (r'^\d+$', ':num'),
+    (r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$',
+     ':uuid'),
+    (r'^[0-9a-f]{16,}$', ':hash'),
+)]
+# sub-paths with free-form names, e.g.: /blog/tags/<tagname>
+NAMED_PARENTS = {'tags', 'tag', 'category', 'user', 'users'}
+
+
+def classify_agent(agent):
+    '''Return the UserAgent classification of User-Agent string `agent`'''
+    kind, name, version = 'other', '', ''
+    for r_kind, r_name, regex in AGENT_RULES:
+        m = regex.search(agent)
+        if m:
+            kind, name, version = r_kind, r_name, m.group(1)
+            break
+    os_name = next((n for n, regex in OS_RULES if regex.search(agent)), '')
+    device = ''
+    if kind == 'browser':
+        device = next((n for n, regex in DEVICE_RULES if regex.search(agent)),
+                      'desktop')
+    return UserAgent(kind, name, version, os_name, device)
+
+
+def classify_request(request):
+    '''Return the Request classification of `request`, e.g.:
+    "GET /index.html HTTP/1.1"'''
+    parts = request.split(' ')
+    method, url = (parts[0], parts[1]) if len(parts) > 1 else ('', request)
+    path = unquote(url.split('?', 1)[0].split('#', 1)[0]) or '/'
+    query = url.partition('?')[2]
+
+    segments = path.split('/')
+    for i, segment in enumerate(segments):
+        for regex, placeholder in ROUTE_RULES:
+            if regex.match(segment):
+                segments[i] = placeholder
+                break
+        else:
+            if i and segment and segments[i - 1] in NAMED_PARENTS:
+                segments[i] = ':name'
+    route = '/'.join(segments)
+
+    ext = os.path.splitext(path)[1].lower()
+    kind = URL_KINDS.get(ext, 'page')
+    if 'rss' in query or 'atom' in query or path.endswith('/feed'):
+        kind = 'feed'
+    return Request(method, path, route, kind)
+
+
+class LRUCache:
+    '''A bounded, least recently used cache with hit-rate statistics'''
+
+    def __init__(self, maxsize=100_000):
+        self.maxsize = maxsize
+        self.data = collections.OrderedDict()
+        self.hits = self.misses = 0
+
+    def get(self, key, compute):
+        '''Return the cached value of `key`, call compute(key) if missing'''
+        data = self.data
+        try:
+            value = data[key]
+        except KeyError:
+            self.misses += 1
+            value = data[key] = compute(key)
+            if len(data) > self.maxsize:
+                data.popitem(last=False)        # drop least recently used
+            return value
+        self.hits += 1
+        data.move_to_end(key)
+        return value
+
+    def __len__(self):
+        return len(self.data)
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self):
+        return {'size': len(self), 'maxsize': self.maxsize, 'hits': self.hits,
+                'misses': self.misses, 'hit_rate': round(self.hit_rate, 4)}
+
+
+class Classifier:
+    '''Memoized User-Agent and request classification
+
+    If `cache_file` is provided, the caches are loaded from it (if it exists
+    and was created with the same RULES_VERSION) and written back by
+    ``save()``.
+    '''
+
+    def __init__(self, cache_file=None, maxsize=100_000):
+        self.cache_file = cache_file
+        self.agents = LRUCache(maxsize)
+        self.requests = LRUCache(maxsize)
+        self._classify_agent = _interned(classify_agent)
+        self._classify_request = _interned(classify_request)
+        if cache_file and os.path.exists(cache_file):
+            self.load(cache_file)
+
+    def agent(self, agent):
+        return self.agents.get(agent, self._classify_agent)
+
+    def request(self, request):
+        return self.requests.get(request, self._classify_request)
+
+    def load(self, path):
+        '''Load the caches saved by save(), ignore it if outdated'''
+        try:
+            with open(path) as fh:
+                saved = json.load(fh)
+        except (OSError, ValueError) as e:
+            print(f'Ignoring classification cache {path}: {e}',
+                  file=sys.stderr)
+            return
+        if saved.get('rules_version') != RULES_VERSION:
+            return
+        for cache, record in ((self.agents, UserAgent),
+                              (self.requests, Request)):
+            name = record.__name__
+            for key, fields in saved.get(name, [])[-cache.maxsize:]:
+                cache.data[key] = record(*map(sys.intern, fields))
+
+    def save(self, path=None):
+        '''Write the caches to `path` (default: the `cache_file`)'''
+        path = path or self.cache_file
+        saved = {'rules_version': RULES_VERSION,
+                 'UserAgent': list(self.agents.data.items()),
+                 'Request': list(self.requests.data.items())}
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp = f'{path}.tmp{os.getpid()}'
+        with open(tmp, 'w') as fh:
+            json.dump(saved, fh)
+        os.replace(tmp, path)           # never leave a half-written cache
+
+    def stats(self):
+        return {'agents': self.agents.stats(),
+                'requests': self.requests.stats()}
+
+
+def _interned(classify):
+    'Wrap `classify` to intern the str fields of its result'
+    def wrapper(value):
+        res = classify(value)
+        return type(res)(*map(sys.intern, res))
+    return wrapper
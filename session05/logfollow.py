@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+
+'''Follow live Apache access logs and keep time-windowed aggregates
+
+Like ``tail -F``, but for one or more log files at once, in a single asyncio
+event loop:
+
+- new lines are read and parsed in batches (see ``apachelog.Parser``), a
+  partially written last line is kept until it is complete;
+- rotation (the path points to a new inode) and truncation (the file became
+  smaller) are detected, the new file is then read from its beginning;
+- the records are aggregated into tumbling windows, by default of 1 minute,
+  5 minutes and 1 hour (by the timestamps of the records): requests/sec,
+  HTTP status mix, bytes and top IP addresses. The last completed windows of
+  each width are kept in a ring buffer (``collections.deque``);
+- the aggregates are emitted periodically as JSON lines to STDOUT or a TCP
+  socket.
+'''
+
+__author__ = 'Gábor Nyers'
+__version__ = '0.1.0'
+__license__ = 'CC BY-NC 4.0'
+
+import asyncio
+import collections
+import json
+import os
+import sys
+from datetime import datetime, timezone
+
+import apachelog
+
+WINDOWS = {'1m': 60, '5m': 300, '1h': 3600}
+BATCH_SIZE = 1024**2                    # read at most this many bytes at once
+
+
+class WindowStats:
+    '''The aggregates of one time window: [start, start + width)'''
+
+    def __init__(self, start, width):
+        self.start = start
+        self.width = width
+        self.requests = 0
+        self.bytes = 0
+        self.status = collections.Counter()
+        self.ips = collections.Counter()
+
+    @property
+    def end(self):
+        return self.start + self.width
+
+    def update(self, cols, lo, hi):
+        '''Add records cols[lo:hi] of apachelog.LogColumns `cols`'''
+        self.requests += hi - lo
+        self.bytes += sum(cols.size[lo:hi])
+        self.status.update(cols.status[lo:hi])
+        self.ips.update(cols.ip[lo:hi])
+
+    def as_dict(self, name='', top=10, partial=False):
+        iso = lambda ts: datetime.fromtimestamp(ts, timezone.utc).isoformat()
+        return {'window': name, 'start': iso(self.start),
+                'end': iso(self.end), 'partial': partial,
+                'requests': self.requests,
+                'rps': round(self.requests / self.width, 3),
+                'bytes': self.bytes,
+                'status': {str(k): v for k, v in sorted(self.status.items())},
+                'top_ips': self.ips.most_common(top)}
+
+
+class TumblingWindow:
+    '''Consecutive, non-overlapping windows of `width` seconds; the last
+    `history` completed windows are kept in a ring buffer'''
+
+    def __init__(self, name, width, history=60):
+        self.name = name
+        self.width = width
+        self.current = None
+        self.completed = collections.deque(maxlen=history)
+        self.pending = []               # completed, but not yet emitted
+
+    def _close(self):
+        self.completed.append(self.current)
+        self.pending.append(self.current)
+        self.current = None
+
+    def update(self, cols):
+        '''Add the records of apachelog.LogColumns `cols`
+
+        Records are expected in (roughly) chronological order; a record
+        older than the current window is counted in the current window.
+        '''
+        ts, lo, hi = cols.timestamp, 0, len(cols)
+        while lo < hi:
+            if self.current is None:
+                start = ts[lo] - ts[lo] % self.width
+                self.current = WindowStats(start, self.width)
+            end = self.current.end
+            if max(ts[lo:hi]) < end:    # the common case: all in the window
+                split = hi
+            else:
+                split = next(i for i in range(lo, hi) if ts[i] >= end)
+            self.current.update(cols, lo, split)
+            if split < hi:
+                self._close()
+            lo = split
+
+    def emit(self, top=10):
+        '''Return the newly completed windows and the current one as dicts'''
+        out = [w.as_dict(self.name, top) for w in self.pending]
+        self.pending = []
+        if self.current is not None:
+            out.append(self.current.as_dict(self.name, top, partial=True))
+        return out
+
+
+async def tail(path, on_batch, from_start=False, poll=0.25,
+               batch_size=BATCH_SIZE):
+    '''Follow file `path`, call on_batch(LogColumns) for each batch of new
+    complete lines; handles rotation and truncation'''
+    parser = apachelog.Parser()
+    fh, inode, rest = None, None, b''
+    while True:
+        if fh is None:
+            try:
+                fh = open(path, 'rb')
+            except FileNotFoundError:
+                await asyncio.sleep(poll)
+                continue
+            inode = os.fstat(fh.fileno()).st_ino
+            if not from_start:
+                fh.seek(0, os.SEEK_END)
+            from_start = True           # i.e.: after rotation read it all
+            rest = b''
+
+        data = fh.read(batch_size)
+        if data:
+            buf = rest + data
+            nl = buf.rfind(b'\n') + 1
+            rest = buf[nl:]
+            if nl:
+                on_batch(parser.parse(buf, 0, nl))
+            await asyncio.sleep(0)      # let the other tasks run
+            continue
+
+        try:                            # no new data: rotated or truncated?
+            st = os.stat(path)
+        except FileNotFoundError:
+            st = None                   # moved away, new file not yet there
+        if st is not None and st.st_ino != inode:
+            fh.close()                  # rotated: old file has been drained
+            fh = None
+        elif st is not None and st.st_size < fh.tell():
+            fh.seek(0)                  # truncated
+            rest = b''
+        else:
+            await asyncio.sleep(poll)
+
+
+class Follower:
+    '''Follow log files and emit the windowed aggregates'''
+
+    def __init__(self, paths, windows=WINDOWS, history=60, top=10,
+                 interval=10, from_start=False, output=sys.stdout):
+        self.paths = paths
+        self.windows = [TumblingWindow(name, width, history)
+                        for name, width in windows.items()]
+        self.top = top
+        self.interval = interval
+        self.from_start = from_start
+        self.output = output            # file object or asyncio.StreamWriter
+        self.records = 0
+        self.unprocessed = 0
+
+    def on_batch(self, cols):
+        self.records += len(cols)
+        self.unprocessed += len(cols.unprocessed_records)
+        if len(cols):
+            for window in self.windows:
+                window.update(cols)
+
+    async def emit(self):
+        lines = [json.dumps(d) + '\n' for window in self.windows
+                 for d in window.emit(self.top)]
+        if isinstance(self.output, asyncio.StreamWriter):
+            self.output.write(''.join(lines).encode())
+            await self.output.drain()
+        else:
+            self.output.write(''.join(lines))
+            self.output.flush()
+
+    async def run(self, duration=None):
+        '''Follow the logs for `duration` seconds (default: forever); if
+        following a log fails, e.g.: it is not readable, its error is raised
+        (the errors of the other logs are reported on STDERR)'''
+        tasks = [asyncio.create_task(tail(path, self.on_batch,
+                                          self.from_start))
+                 for path in self.paths]
+        loop = asyncio.get_running_loop()
+        stop_at = None if duration is None else loop.time() + duration
+        failed = None
+        try:
+            while stop_at is None or loop.time() < stop_at:
+                wait = self.interval
+                if stop_at is not None:
+                    wait = min(wait, stop_at - loop.time())
+                done, _ = await asyncio.wait(
+                    tasks, timeout=max(wait, 0),
+                    return_when=asyncio.FIRST_COMPLETED)
+                for failed in done:     # tail() only returns by an error
+                    failed.result()
+                await self.emit()
+        finally:
+            for task in tasks:
+                task.cancel()
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+            for task, path, result in zip(tasks, self.paths, results):
+                if task is not failed and isinstance(result, Exception):
+                    print(f'Error: following {path} failed: {result!r}',
+                          file=sys.stderr)
+
+
+async def open_output(address):
+    '''Return a StreamWriter connected to `address`: "host:port" for TCP
+    or a path for a Unix domain socket'''
+    host, sep, port = address.rpartition(':')
+    if sep and port.isdigit():
+        _, writer = await asyncio.open_connection(host or 'localhost',
+                                                  int(port))
+    else:
+        _, writer = await asyncio.open_unix_connection(address)
+    return writer
+
+
+async def follow(paths, emit_to=None, duration=None, **kwargs):
+    '''Follow the log files in `paths`, see Follower for the `kwargs`'''
+    output = await open_output(emit_to) if emit_to else sys.stdout
+    follower = Follower(paths, output=output, **kwargs)
+    try:
+        await follower.run(duration)
+    finally:
+        if emit_to:
+            output.close()
+    return follower
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+
+'''Persistent, indexed store of parsed Apache log records
+
+Each analysis in the notebook starts by reading and parsing the raw log. With
+a log store the records are parsed only once, into an SQLite database with
+indexes on the timestamp, IP address and HTTP status. Ad-hoc queries, e.g.:
+"all 404s of this IP address in this hour", are then answered from the
+indexes instead of by re-parsing the entire log.
+
+Ingestion is incremental: the store remembers the byte offset up to which
+each log file (identified by its device and inode, not by its path) has been
+ingested, so the next run only parses the lines appended since. A log file
+rotated by renaming keeps its inode, so ingesting it under its new name
+continues where the previous run stopped. A file with a new inode, e.g.: a
+rotated log that was gzip-ed since, is identified by its first bytes (of the
+decompressed content): if these match the first bytes of an ingested file,
+only its content after the ingested part is parsed. Otherwise a new,
+truncated (smaller) or overwritten (different first bytes) log file is
+ingested from the start.
+
+The long and very repetitive referrer and User-Agent strings are stored only
+once, in separate tables.
+'''
+
+__author__ = 'Gábor Nyers'
+__version__ = '0.1.0'
+__license__ = 'CC BY-NC 4.0'
+
+import gzip
+import mmap
+import os
+import sqlite3
+from datetime import datetime, timezone
+
+import apachelog
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS sources (
+        dev integer,
+        inode integer,
+        path varchar,               -- the last known path
+        head blob,                  -- the first bytes (decompressed)
+        offset integer,             -- bytes (decompressed) ingested so far
+        ingested datetime,
+        PRIMARY KEY (dev, inode)
+);
+
+CREATE TABLE IF NOT EXISTS agents (
+        id integer PRIMARY KEY,
+        agent varchar UNIQUE
+);
+
+CREATE TABLE IF NOT EXISTS referrers (
+        id integer PRIMARY KEY,
+        referrer varchar UNIQUE
+);
+
+CREATE TABLE IF NOT EXISTS records (
+        ts integer,                 -- seconds since the epoch (UTC)
+        ip varchar,
+        request varchar,
+        status integer,
+        size integer,
+        referrer integer,
+        agent integer,
+        FOREIGN KEY (referrer) REFERENCES referrers (id),
+        FOREIGN KEY (agent) REFERENCES agents (id)
+);
+
+CREATE INDEX IF NOT EXISTS records_ts ON records (ts);
+CREATE INDEX IF NOT EXISTS records_ip_ts ON records (ip, ts);
+CREATE INDEX IF NOT EXISTS records_status_ts ON records (status, ts);
+
+CREATE VIEW IF NOT EXISTS v_records AS
+    SELECT r.ts, r.ip, r.request, r.status, r.size, f.referrer, a.agent
+    FROM records AS r
+        LEFT JOIN referrers AS f ON r.referrer = f.id
+        LEFT JOIN agents AS a ON r.agent = a.id;
+'''
+
+
+class LogStore:
+    '''An SQLite database of parsed log records'''
+
+    def __init__(self, database):
+        self.conn = sqlite3.connect(database)
+        self.conn.execute('PRAGMA journal_mode = WAL')
+        self.conn.execute('PRAGMA synchronous = NORMAL')
+        self.conn.executescript(SCHEMA)
+        self._ids = {'agents': {}, 'referrers': {}}   # lookup caches
+
+    def close(self):
+        self.conn.close()
+
+    def _id(self, table, column, value):
+        'Return the id of `value` in lookup `table`, add it if missing'
+        cache = self._ids[table]
+        id_ = cache.get(value)
+        if id_ is None:
+            cur = self.conn.execute(
+                f'SELECT id FROM {table} WHERE {column} = ?', (value,))
+            row = cur.fetchone()
+            if row is None:
+                cur = self.conn.execute(
+                    f'INSERT INTO {table} ({column}) VALUES (?)', (value,))
+                id_ = cur.lastrowid
+            else:
+                id_ = row[0]
+            if len(cache) > 100_000:
+                cache.clear()           # keep memory usage bounded
+            cache[value] = id_
+        return id_
+
+    def insert(self, cols):
+        '''Insert the records of apachelog.LogColumns `cols`'''
+        agent = lambda v: self._id('agents', 'agent', v)
+        referrer = lambda v: self._id('referrers', 'referrer', v)
+        rows = list(zip(cols.timestamp, cols.ip, cols.request, cols.status,
+                        cols.size, map(referrer, cols.referrer),
+                        map(agent, cols.agent)))
+        self.conn.executemany(
+            'INSERT INTO records (ts, ip, request, status, size, referrer, '
+            'agent) VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+
+    def source(self, st):
+        '''Return (path, head, offset) of the ingested part of the file with
+        os.stat() result `st`'''
+        row = self.conn.execute(
+            'SELECT path, head, offset FROM sources WHERE dev = ? AND '
+            'inode = ?', (st.st_dev, st.st_ino)).fetchone()
+        return row or (None, None, 0)
+
+    def ingested(self, head, st):
+        '''Return the offset up to which a file starting with the bytes of
+        its `head` has been ingested under another inode than the one of
+        os.stat() result `st`, or 0'''
+        row = self.conn.execute(
+            'SELECT max(offset) FROM sources WHERE length(head) > 0 AND '
+            'head = substr(?, 1, length(head)) AND NOT (dev = ? AND '
+            'inode = ?)', (head, st.st_dev, st.st_ino)).fetchone()
+        return row[0] or 0
+
+    def ingest(self, path, chunk_size=apachelog.CHUNK_SIZE):
+        '''Ingest the lines of log file `path` appended since the last run
+
+        Only complete lines are ingested, a partially written last line is
+        left for the next run. Gzip-ed (i.e.: rotated) logs are not expected
+        to change: once ingested, these are skipped. Returns the nr. of
+        (parsed, unprocessed) records.
+        '''
+        st = os.stat(path)
+        gzipped = str(path).endswith('.gz')
+        head = read_head(path)
+        _, known, offset = self.source(st)
+        if known is None or head[:len(known)] != known or (
+                not gzipped and st.st_size < offset):
+            # a new (or truncated, or overwritten) file, with content that
+            # may be ingested already, e.g.: of a rotated, gzip-ed log
+            offset = self.ingested(head, st)
+            if not gzipped:
+                offset = min(offset, st.st_size)
+        elif gzipped:                   # ingested already
+            offset = None
+        parsed = unprocessed = 0
+        with self.conn:                 # one transaction for the whole file
+            if offset is None:
+                end = None
+            elif gzipped:               # decompress (and skip) to offset
+                fh = gzip.open(path, 'rb')
+                fh.seek(offset)
+                end = offset
+                for cols in apachelog.iter_parse_stream(fh, chunk_size):
+                    end = fh.tell()     # EOF after the last chunk
+                    self.insert(cols)
+                    parsed += len(cols)
+                    unprocessed += len(cols.unprocessed_records)
+            else:
+                end = complete_lines_end(path, offset)
+                for cols in apachelog.iter_parse_file(path, offset, end,
+                                                      chunk_size):
+                    self.insert(cols)
+                    parsed += len(cols)
+                    unprocessed += len(cols.unprocessed_records)
+            if end is None or (end == offset and known is not None):
+                # nothing new, e.g.: renamed, keep the new path
+                self.conn.execute(
+                    'UPDATE sources SET path = ? WHERE dev = ? AND inode = ?',
+                    (os.path.abspath(path), st.st_dev, st.st_ino))
+            else:
+                self._set_source(path, st, head, end)
+        return parsed, unprocessed
+
+    def _set_source(self, path, st, head, offset):
+        self.conn.execute(
+            'INSERT OR REPLACE INTO sources (dev, inode, path, head, offset, '
+            'ingested) VALUES (?, ?, ?, ?, ?, ?)',
+            (st.st_dev, st.st_ino, os.path.abspath(path), head, offset,
+             datetime.now(timezone.utc).isoformat()))
+
+    def query(self, ip=None, status=None, since=None, until=None,
+              limit=None):
+        '''Yield the matching records as tuples:
+        (ts, ip, request, status, size, referrer, agent)
+
+        `since` and `until` are epoch seconds, `until` is exclusive.
+        '''
+        where, params = [], []
+        for cond, value in (('ip = ?', ip), ('status = ?', status),
+                            ('ts >= ?', since), ('ts < ?', until)):
+            if value is not None:
+                where.append(cond)
+                params.append(value)
+        sql = 'SELECT * FROM v_records'
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += ' ORDER BY ts'
+        if limit:
+            sql += f' LIMIT {int(limit)}'
+        return self.conn.execute(sql, params)
+
+
+def read_head(path, size=4096):
+    '''Return the first `size` bytes of file `path`, decompressed if it is
+    gzip-ed (``*.gz``)'''
+    opener = gzip.open if str(path).endswith('.gz') else open
+    with opener(path, 'rb') as fh:
+        return fh.read(size)
+
+
+def complete_lines_end(path, start=0):
+    '''Return the offset after the last newline of file `path` (or `start`
+    if there is no newline after `start`)'''
+    with open(path, 'rb') as fh:
+        if os.fstat(fh.fileno()).st_size == 0:
+            return start
+        with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return max(start, mm.rfind(b'\n', start) + 1)
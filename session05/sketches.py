@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+
+'''Approximate, fixed-memory aggregates ("sketches") for streams of data
+
+The notebook answers "How many distinct IP addresses?" and "What are the 10
+most frequent IP addresses?" with exact ``collections.Counter`` objects. Those
+grow with every new value, which is not an option for a never-ending stream of
+log records. The sketches in this module use a fixed amount of memory, at the
+cost of a small, configurable error:
+
+- ``HyperLogLog``: the number of distinct values
+- ``CountMinSketch``: (over-)estimate of the frequency of any value
+- ``TopK``: the most frequent values ("heavy hitters"), CountMinSketch + heap
+- ``TDigest``: quantiles, e.g. the median or 99th percentile response size
+
+All sketches can be merged with a sketch of the same kind and settings (e.g.:
+the sketches of different hours or hosts), and converted to/from a dict with
+``to_dict()`` / ``from_dict()`` to store them as JSON.
+
+Values are hashed with BLAKE2b, so, unlike with the built-in ``hash()``,
+sketches created by different processes or hosts are compatible.
+'''
+
+__author__ = 'Gábor Nyers'
+__version__ = '0.1.0'
+__license__ = 'CC BY-NC 4.0'
+
+import array
+import base64
+import hashlib
+import heapq
+import math
+import sys
+
+FORMAT_VERSION = 1
+
+
+def hash128(value):
+    '''Return two independent 64-bit hashes of str or bytes `value`'''
+    if isinstance(value, str):
+        value = value.encode('utf-8', 'surrogatepass')
+    digest = hashlib.blake2b(value, digest_size=16).digest()
+    return (int.from_bytes(digest[:8], 'little'),
+            int.from_bytes(digest[8:], 'little'))
+
+
+def _pack(arr):
+    'Return array `arr` as a base64 str (little endian)'
+    if sys.byteorder == 'big':
+        arr = array.array(arr.typecode, arr)
+        arr.byteswap()
+    return base64.b64encode(arr.tobytes()).decode('ascii')
+
+
+def _unpack(typecode, data):
+    'Return the array packed by _pack()'
+    arr = array.array(typecode, base64.b64decode(data))
+    if sys.byteorder == 'big':
+        arr.byteswap()
+    return arr
+
+
+def _check(d, kind):
+    'Verify the header of dict `d` created by one of the to_dict() methods'
+    if d.get('type') != kind or d.get('version') != FORMAT_VERSION:
+        raise ValueError(f'Not a {kind} (version {FORMAT_VERSION}) sketch: '
+                         f'{d.get("type")} (version {d.get("version")})')
+
+
+class HyperLogLog:
+    '''Estimate the number of distinct values
+
+    `precision` (4..18) sets the nr. of registers (2**precision bytes of
+    memory); the standard error is about 1.04 / sqrt(2**precision), e.g.:
+    0.81% for the default of 14 (16KB).
+    '''
+
+    def __init__(self, precision=14):
+        if not 4 <= precision <= 18:
+            raise ValueError('precision must be between 4 and 18')
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add(self, value):
+        h, _ = hash128(value)
+        self.add_hash(h)
+
+    def add_hash(self, h):
+        '''Add a value by its 64-bit hash, e.g.: from hash128()'''
+        p = self.precision
+        idx = h >> (64 - p)
+        rest = h & ((1 << (64 - p)) - 1)
+        rank = (64 - p) - rest.bit_length() + 1  # position of leftmost 1 bit
+        if rank > self.registers[idx]:
+            self.registers[idx] = rank
+
+    def __len__(self):
+        return round(self.estimate())
+
+    def estimate(self):
+        m = len(self.registers)
+        alpha = {16: 0.673, 32: 0.697, 64: 0.709}.get(
+            m, 0.7213 / (1 + 1.079 / m))
+        raw = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if raw <= 2.5 * m and zeros:        # small range: linear counting
+            return m * math.log(m / zeros)
+        return raw
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError('Can only merge HyperLogLogs of equal precision')
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def to_dict(self):
+        return {'type': 'hyperloglog', 'version': FORMAT_VERSION,
+                'precision': self.precision,
+                'registers': base64.b64encode(self.registers).decode('ascii')}
+
+    @classmethod
+    def from_dict(cls, d):
+        _check(d, 'hyperloglog')
+        hll = cls(d['precision'])
+        hll.registers = bytearray(base64.b64decode(d['registers']))
+        return hll
+
+
+class CountMinSketch:
+    '''Estimate the frequency of values, never underestimates
+
+    The estimate is at most `epsilon` * (total count) too high, with a
+    probability of 1 - `delta`. Memory: 8 * e/epsilon * ln(1/delta) bytes.
+    '''
+
+    def __init__(self, epsilon=0.0005, delta=0.01, width=None, depth=None):
+        self.width = width or math.ceil(math.e / epsilon)
+        self.depth = depth or math.ceil(math.log(1 / delta))
+        self.table = array.array('Q', bytes(8 * self.width * self.depth))
+        self.total = 0
+
+    def _cells(self, value):
+        'Return the index of the cell of `value` in each row'
+        h1, h2 = hash128(value)
+        w = self.width
+        return [row * w + (h1 + row * h2) % w for row in range(self.depth)]
+
+    def add(self, value, count=1):
+        '''Add `count` to `value`, return the new estimate of `value`'''
+        table = self.table
+        self.total += count
+        est = None
+        for cell in self._cells(value):
+            table[cell] += count
+            if est is None or table[cell] < est:
+                est = table[cell]
+        return est
+
+    def estimate(self, value):
+        return min(self.table[cell] for cell in self._cells(value))
+
+    __getitem__ = estimate
+
+    def merge(self, other):
+        if (other.width, other.depth) != (self.width, self.depth):
+            raise ValueError('Can only merge CountMinSketches of equal size')
+        self.table = array.array('Q', map(sum, zip(self.table, other.table)))
+        self.total += other.total
+        return self
+
+    def to_dict(self):
+        return {'type': 'countmin', 'version': FORMAT_VERSION,
+                'width': self.width, 'depth': self.depth, 'total': self.total,
+                'table': _pack(self.table)}
+
+    @classmethod
+    def from_dict(cls, d):
+        _check(d, 'countmin')
+        cms = cls(width=d['width'], depth=d['depth'])
+        cms.table = _unpack('Q', d['table'])
+        cms.total = d['total']
+        return cms
+
+
+class TopK:
+    '''Track the `k` most frequent values ("heavy hitters")
+
+    The frequencies are estimated with a CountMinSketch, the current top `k`
+    candidates are kept in a min-heap; memory usage is independent of the
+    number of distinct values.
+    '''
+
+    def __init__(self, k=50, epsilon=0.0005, delta=0.01, cms=None):
+        self.k = k
+        self.cms = cms or CountMinSketch(epsilon, delta)
+        self.top = {}                   # value: estimated count
+        self.heap = []                  # (count, value), min. at heap[0]
+
+    def add(self, value, count=1):
+        est = self.cms.add(value, count)
+        top = self.top
+        if value in top:                # its heap entry is now outdated,
+            top[value] = est            # it is fixed in _min()
+            return
+        if len(top) < self.k:
+            top[value] = est
+            heapq.heappush(self.heap, (est, value))
+            return
+        min_est, min_value = self._min()
+        if est > min_est:               # replace the least frequent
+            heapq.heapreplace(self.heap, (est, value))
+            del top[min_value]
+            top[value] = est
+
+    def _min(self):
+        'Return the (count, value) of the least frequent top value'
+        heap, top = self.heap, self.top
+        while heap[0][0] != top[heap[0][1]]:  # outdated: update the count
+            heapq.heapreplace(heap, (top[heap[0][1]], heap[0][1]))
+        return heap[0]
+
+    def most_common(self, n=None):
+        '''Return the `n` most frequent (value, count) tuples, like
+        ``collections.Counter.most_common()``'''
+        ranked = sorted(self.top.items(), key=lambda vc: vc[1], reverse=True)
+        return ranked[:n]
+
+    def merge(self, other):
+        self.cms.merge(other.cms)
+        candidates = set(self.top) | set(other.top)
+        ranked = heapq.nlargest(self.k, ((self.cms.estimate(v), v)
+                                         for v in candidates))
+        self.top = {v: c for c, v in ranked}
+        self.heap = [(c, v) for c, v in ranked]
+        heapq.heapify(self.heap)
+        return self
+
+    def to_dict(self):
+        return {'type': 'topk', 'version': FORMAT_VERSION, 'k': self.k,
+                'cms': self.cms.to_dict(), 'top': list(self.top.items())}
+
+    @classmethod
+    def from_dict(cls, d):
+        _check(d, 'topk')
+        topk = cls(d['k'], cms=CountMinSketch.from_dict(d['cms']))
+        topk.top = dict(map(tuple, d['top']))
+        topk.heap = [(c, v) for v, c in topk.top.items()]
+        heapq.heapify(topk.heap)
+        return topk
+
+
+class TDigest:
+    '''Estimate quantiles of a stream of numbers (merging t-digest)
+
+    `compression` limits the number of centroids (about `compression` / 2),
+    higher values are more accurate. The estimates are most accurate near the
+    extremes, e.g.: the 99th or 99.9th percentile.
+    '''
+
+    def __init__(self, compression=100, buffer_size=None):
+        self.compression = compression
+        self.buffer_size = buffer_size or 10 * compression
+        self.centroids = []             # sorted list of (mean, weight)
+        self._buffer = []
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value, weight=1):
+        self._buffer.append((value, weight))
+        self.count += weight
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        if len(self._buffer) >= self.buffer_size:
+            self._compress()
+
+    def _k(self, q):
+        'The k1 scale function'
+        return self.compression / (2 * math.pi) * math.asin(2 * q - 1)
+
+    def _q_limit(self, q):
+        'The largest quantile a centroid starting at quantile `q` may reach'
+        k = self._k(q) + 1
+        if k >= self.compression / 4:
+            return 1.0
+        return (math.sin(k * 2 * math.pi / self.compression) + 1) / 2
+
+    def _compress(self):
+        'Merge the buffered values into the centroids'
+        if not self._buffer:
+            return
+        points = sorted(self.centroids + self._buffer)
+        self._buffer = []
+        total = sum(w for _, w in points)
+        merged, cum = [], 0
+        mean, weight = points[0]
+        q_limit = self._q_limit(0)
+        for m, w in points[1:]:
+            if (cum + weight + w) / total <= q_limit:
+                weight += w
+                mean += (m - mean) * w / weight
+            else:
+                merged.append((mean, weight))
+                cum += weight
+                q_limit = self._q_limit(cum / total)
+                mean, weight = m, w
+        merged.append((mean, weight))
+        self.centroids = merged
+
+    def quantile(self, q):
+        '''Return the estimated value at quantile `q` (0..1)'''
+        self._compress()
+        if not self.centroids:
+            return None
+        if len(self.centroids) == 1:
+            return self.centroids[0][0]
+        target = q * self.count
+        prev_pos, prev_mean = 0, self.min
+        cum = 0
+        for mean, weight in self.centroids:
+            pos = cum + weight / 2      # the centroid's "center"
+            if target < pos:
+                frac = (target - prev_pos) / (pos - prev_pos)
+                return prev_mean + frac * (mean - prev_mean)
+            prev_pos, prev_mean = pos, mean
+            cum += weight
+        frac = (target - prev_pos) / ((self.count - prev_pos) or 1)
+        return prev_mean + min(frac, 1) * (self.max - prev_mean)
+
+    def merge(self, other):
+        other._compress()
+        self._buffer.extend(other.centroids)
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._compress()
+        return self
+
+    def to_dict(self):
+        self._compress()
+        return {'type': 'tdigest', 'version': FORMAT_VERSION,
+                'compression': self.compression, 'count': self.count,
+                'min': self.min if self.count else None,
+                'max': self.max if self.count else None,
+                'centroids': self.centroids}
+
+    @classmethod
+    def from_dict(cls, d):
+        _check(d, 'tdigest')
+        td = cls(d['compression'])
+        td.centroids = [tuple(c) for c in d['centroids']]
+        td.count = d['count']
+        if td.count:
+            td.min, td.max = d['min'], d['max']
+        return td
@@ -7,6 +7,7 @@ from logging import (debug, info, warning, error, critical,
                      basicConfig, INFO)
 from flask import (Flask, request, Response, render_template, url_for,
                    make_response)
+from . import metrics
 
 basicConfig(stream=sys.stderr, level=INFO,
                     format='%(asctime)s %(levelname)s:%(message)s')
@@ -15,24 +16,41 @@ basicConfig(stream=sys.stderr, level=INFO,
 BIND_ADDR = '0.0.0.0'
 if os.environ.get('DEBUG','').lower() in ('y', 'yes', '1', 'true'): DEBUG=True
 else                                                              : DEBUG=False
+PROFILING = os.environ.get('PROFILING','').lower() in ('y', 'yes', '1', 'true')
 try:
     BIND_PORT = int(os.environ.get('BIND_PORT', 5001))
 except ValueError:
     BIND_PORT = 5001
+# Optional layered config files (INI, YAML or JSON), lowest precedence first,
+# e.g.: APP_CONFIG=/etc/app/defaults.yaml:/etc/app/site.ini
+# Changed files are picked up at run-time, see session02/layeredconfig.py
+APP_CONFIG = [p for p in os.environ.get('APP_CONFIG', '').split(':') if p]
+if APP_CONFIG:
+    from layeredconfig import LayeredConfig
+    config = LayeredConfig(APP_CONFIG)
+else:
+    config = None
+
+def settings(section):
+    'Return the current settings in `section` of the APP_CONFIG files'
+    return config.current().get(section, {}) if config else {}
 
 # Create Flask instance
 app = Flask(__name__, template_folder='t')
+metrics.init_app(app, profiling=PROFILING)  # /metrics and /metrics/profile
+render_template = metrics.timed_render(render_template)
 
 @app.route('/meta-data')
 def meta_data():
-    debug('arguments: %s' % list(request.args))
-    debug('host: %s' % request.host)
-    debug('user_agent: %s' % request.user_agent)
-    debug('remote_addr: %s')
+    debug('arguments: %s', list(request.args))
+    debug('host: %s', request.host)
+    debug('user_agent: %s', request.user_agent)
+    debug('remote_addr: %s', request.remote_addr)
     templ_vars = {
         'fqdn'          : 'host%d.example.com' % random.randint(100, 9999),
         'loghost_url'   : '169.254.169.254:514',
         'phone_home_url': 'http://169.254.169.254:5001/phone_home',
+        **settings('meta-data'),        # overrides from the APP_CONFIG files
     }
     resp = make_response(render_template('meta-data.j2', **templ_vars))
     resp.headers['Content-Type'] = 'text/yaml'
@@ -40,10 +58,10 @@ def meta_data():
 
 @app.route('/user-data')
 def user_data():
-    debug('arguments: %s' % list(request.args))
-    debug('host: %s' % request.host)
-    debug('user_agent: %s' % request.user_agent)
-    debug('remote_addr: %s')
+    debug('arguments: %s', list(request.args))
+    debug('host: %s', request.host)
+    debug('user_agent: %s', request.user_agent)
+    debug('remote_addr: %s', request.remote_addr)
     resp = make_response(render_template('user-data.j2'))
     resp.headers['Content-Type'] = 'text/yaml'
     return resp
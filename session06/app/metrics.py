@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+
+'''Light-weight instrumentation of the cloud-init data application
+
+Collects:
+
+- per-route request counters (by method and HTTP status)
+- per-route latency histograms
+- template render times
+- the number of bytes served
+
+and exposes them in the Prometheus text format on ``/metrics``.
+
+Every thread updates its *own* set of counters, so the request path never has
+to wait for a lock. The counters of all threads are only summed up when the
+``/metrics`` endpoint is scraped.
+
+Optionally (env. variable ``PROFILING=y``) a sampling profiler is available on
+``/metrics/profile``, which can be started and stopped at run-time:
+
+  curl -X POST -d action=start http://localhost:5001/metrics/profile
+  curl http://localhost:5001/metrics/profile > app.collapsed
+  curl -X POST -d action=stop  http://localhost:5001/metrics/profile
+
+The output is in the "collapsed stack" format, which can be turned into a
+flame graph with e.g.: ``flamegraph.pl app.collapsed > app.svg``.
+'''
+
+import bisect
+import collections
+import functools
+import sys
+import threading
+import time
+import weakref
+
+# upper bounds (in seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+METRIC_HELP = {
+    'app_requests_total': ('counter', 'Number of handled requests'),
+    'app_request_duration_seconds': ('histogram',
+                                     'Request latency in seconds'),
+    'app_response_bytes_total': ('counter', 'Number of bytes served'),
+    'app_template_render_seconds': ('histogram',
+                                    'Template render time in seconds'),
+}
+
+
+class _Store:
+    '''The counters and histograms of a single thread'''
+    __slots__ = ('counters', 'histograms', '__weakref__')
+
+    def __init__(self):
+        self.counters = {}          # (name, labels): value
+        self.histograms = {}        # (name, labels): [*buckets, sum, count]
+
+
+_local = threading.local()          # the _Store of the current thread
+_stores = []                        # the _Store of all live threads
+_retired = _Store()                 # accumulated counters of ended threads
+_lock = threading.Lock()            # only for (un)registering and scraping
+
+
+def _merge(dst, src):
+    'Add the counters and histograms of _Store `src` to `dst`'
+    for key, value in list(src.counters.items()):
+        dst.counters[key] = dst.counters.get(key, 0) + value
+    for key, values in list(src.histograms.items()):
+        acc = dst.histograms.setdefault(key, [0] * len(values))
+        for i, value in enumerate(values):
+            acc[i] += value
+
+
+def _retire(store):
+    'Called when a thread has ended: keep its counters, drop the thread'
+    with _lock:
+        _merge(_retired, store)
+        _stores.remove(store)
+
+
+def _store():
+    'Return the _Store of the current thread, create it if needed'
+    try:
+        return _local.store
+    except AttributeError:
+        store = _local.store = _Store()
+        with _lock:
+            _stores.append(store)
+        # the dev. server starts a thread per request: fold the counters of
+        # finished threads into `_retired`, so the list of stores stays short
+        weakref.finalize(threading.current_thread(), _retire, store)
+        return store
+
+
+def _labels(labels):
+    'Return the labels as a hashable, ordered tuple'
+    return tuple(sorted(labels.items()))
+
+
+def inc(name, value=1, **labels):
+    '''Increment counter `name` with `value`'''
+    counters = _store().counters
+    key = (name, _labels(labels))
+    counters[key] = counters.get(key, 0) + value
+
+
+def observe(name, value, **labels):
+    '''Add `value` to the histogram `name`'''
+    histograms = _store().histograms
+    key = (name, _labels(labels))
+    hist = histograms.get(key)
+    if hist is None:
+        hist = histograms[key] = [0] * (len(LATENCY_BUCKETS) + 3)
+    hist[bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+    hist[-2] += value               # sum of all observed values
+    hist[-1] += 1                   # nr. of observations
+
+
+def snapshot():
+    '''Return the summed up counters of all threads as a _Store'''
+    total = _Store()
+    with _lock:
+        _merge(total, _retired)
+        for store in _stores:
+            _merge(total, store)
+    return total
+
+
+def _fmt_labels(labels):
+    'Format label tuples as Prometheus labels, e.g.: {route="/x",le="1"}'
+    if not labels:
+        return ''
+    esc = lambda v: (str(v).replace('\\', r'\\').replace('"', r'\"')
+                     .replace('\n', r'\n'))
+    return '{' + ','.join(f'{k}="{esc(v)}"' for k, v in labels) + '}'
+
+
+def render_metrics():
+    '''Return all metrics in the Prometheus text exposition format'''
+    total = snapshot()
+    by_name = collections.defaultdict(list)
+    for (name, labels), value in total.counters.items():
+        by_name[name].append((labels, value))
+    for (name, labels), value in total.histograms.items():
+        by_name[name].append((labels, value))
+
+    lines = []
+    for name in sorted(by_name):
+        mtype, mhelp = METRIC_HELP.get(name, ('untyped', name))
+        lines.append(f'# HELP {name} {mhelp}')
+        lines.append(f'# TYPE {name} {mtype}')
+        for labels, value in sorted(by_name[name]):
+            if mtype != 'histogram':
+                lines.append(f'{name}{_fmt_labels(labels)} {value}')
+                continue
+            cumulative = 0
+            bounds = LATENCY_BUCKETS + ('+Inf',)
+            for bound, count in zip(bounds, value):
+                cumulative += count
+                le = labels + (('le', bound),)
+                lines.append(f'{name}_bucket{_fmt_labels(le)} {cumulative}')
+            lines.append(f'{name}_sum{_fmt_labels(labels)} {value[-2]}')
+            lines.append(f'{name}_count{_fmt_labels(labels)} {value[-1]}')
+    return '\n'.join(lines) + '\n'
+
+
+def timed_render(render):
+    '''Decorate a `render_template`-like function to record render times'''
+    @functools.wraps(render)
+    def wrapper(template_name, **context):
+        start = time.perf_counter()
+        try:
+            return render(template_name, **context)
+        finally:
+            observe('app_template_render_seconds',
+                    time.perf_counter() - start, template=template_name)
+    return wrapper
+
+
+class SamplingProfiler:
+    '''Sample the call stacks of all threads every `interval` seconds
+
+    The samples are aggregated in "collapsed stack" format, i.e.:
+    ``outer;inner;innermost count``
+    '''
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.samples = collections.Counter()
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name='sampling-profiler')
+        self._thread.start()
+
+    def stop(self):
+        if self.running:
+            self._stop.set()
+            self._thread.join()
+        self._thread = None
+
+    def reset(self):
+        self.samples = collections.Counter()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} '
+                                 f'({code.co_filename}:{code.co_firstlineno})')
+                    frame = frame.f_back
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def collapsed(self):
+        '''Return the samples in collapsed stack format'''
+        return ''.join(f'{stack} {count}\n'
+                       for stack, count in self.samples.most_common())
+
+
+def init_app(app, profiling=False):
+    '''Register the instrumentation hooks and endpoints with Flask `app`'''
+    from flask import g, request, Response
+
+    @app.before_request
+    def start_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def record_request(resp):
+        start = g.pop('metrics_start', None)
+        route = request.url_rule.rule if request.url_rule else '<unmatched>'
+        if start is not None:
+            observe('app_request_duration_seconds',
+                    time.perf_counter() - start, route=route)
+        inc('app_requests_total', route=route, method=request.method,
+            status=resp.status_code)
+        inc('app_response_bytes_total', resp.calculate_content_length() or 0,
+            route=route)
+        return resp
+
+    @app.route('/metrics')
+    def metrics():
+        return Response(render_metrics(),
+                        content_type='text/plain; version=0.0.4')
+
+    if not profiling:
+        return app
+
+    profiler = app.extensions['sampling_profiler'] = SamplingProfiler()
+
+    @app.route('/metrics/profile', methods=['GET', 'POST'])
+    def profile():
+        if request.method == 'POST':
+            actions = {'start': profiler.start, 'stop': profiler.stop,
+                       'reset': profiler.reset}
+            action = actions.get(request.form.get('action', ''))
+            if action is None:
+                return 'action must be one of: start, stop, reset\n', 400
+            action()
+            return f'profiler running: {profiler.running}\n'
+        return Response(profiler.collapsed(), content_type='text/plain')
+
+    return app
@@ -1,8 +1,9 @@
 from dataclasses import dataclass, field
-from typing import List
+from typing import Dict, List, Tuple
 from collections import Counter
+import bisect
 
-@dataclass
+@dataclass(slots=True)
 class Person:
     fname: str = ''
     sname: str = ''
@@ -15,27 +16,126 @@ class Person:
 
 @dataclass
 class Addressbook:
+    '''A collection of Person objects
+
+    The fields listed in `indexed` (none by default) have a hash index:
+    `find()` and `group_counts()` on these fields do not need to loop through
+    all persons. An index costs memory: one position per person and field.
+    NOTE: change an indexed field of a Person only via `update()`, otherwise
+    the index gets out of date.
+    '''
     name: str = 'My Addressbook'
+    indexed: Tuple[str, ...] = ()
     _items: List[Person] = field(default_factory=list, init=False)
+    # field: { value: [ position of the person in _items, ... ] }
+    _indexes: Dict[str, dict] = field(default_factory=dict, init=False)
+
+    def __post_init__(self):
+        self._reindex()
+
+    def _reindex(self):
+        self._indexes = {f: {} for f in self.indexed}
+        for pos, person in enumerate(self._items):
+            self._index(pos, person)
+
+    def _index(self, pos, person):
+        for f, index in self._indexes.items():
+            index.setdefault(getattr(person, f), []).append(pos)
+
+    def _unindex(self, pos, field, value):
+        '''Remove `pos` from the bucket of `value` in the index of `field`'''
+        bucket = self._indexes[field][value]
+        bucket.remove(pos)
+        if not bucket:                  # don't keep the empty buckets
+            del self._indexes[field][value]
 
     def __iter__(self):
         return iter(self._items)
 
     def add(self, person):
+        '''Append `person`; adding the same person twice keeps both'''
         self._items.append(person)
+        self._index(len(self._items) - 1, person)
+
+    def remove(self, person):
+        '''Remove the first occurrence of `person` (or of a Person equal to
+        it); unless it is the last one, the indexes are rebuilt, so this
+        takes O(n) time'''
+        for pos, item in enumerate(self._items):
+            if item is person:
+                break
+        else:
+            pos = self._items.index(person)   # ValueError if not found
+        item = self._items.pop(pos)
+        if pos == len(self._items):     # no position shifted
+            for f in self._indexes:
+                self._unindex(pos, f, getattr(item, f))
+        elif self._indexes:             # the positions after pos shifted
+            self._reindex()
+
+    def update(self, person, **changes):
+        '''Change the fields of `person` and keep the indexes up-to-date: its
+        position moves to the bucket of the new value of an indexed field'''
+        old = {f: getattr(person, f) for f in changes if f in self._indexes}
+        pos = None
+        if old:                         # look it up in an index bucket
+            f = next(iter(old))
+            pos = next((p for p in self._indexes[f].get(old[f], ())
+                        if self._items[p] is person), None)
+        for f, value in changes.items():
+            setattr(person, f, value)
+        if pos is None:                 # not indexed, or not in this book
+            return
+        for f, value in old.items():
+            if getattr(person, f) != value:
+                self._unindex(pos, f, value)    # keep the positions sorted
+                bisect.insort(self._indexes[f].setdefault(
+                    getattr(person, f), []), pos)
+
+    def find(self, **criteria):
+        '''Return the list of persons matching all `criteria`, e.g.:
+        find(sname='Flintstone', gender='f')
+        '''
+        indexed = [f for f in criteria if f in self._indexes]
+        if indexed:                     # start with the smallest bucket
+            bucket = min((self._indexes[f].get(criteria[f], ())
+                          for f in indexed), key=len)
+            candidates = [self._items[pos] for pos in bucket]
+        else:
+            candidates = self._items
+        return [p for p in candidates
+                if all(getattr(p, f) == v for f, v in criteria.items())]
+
+    def group_counts(self, field):
+        '''Return a Counter of the values of `field`'''
+        if field in self._indexes:
+            return Counter({value: len(bucket)
+                            for value, bucket in self._indexes[field].items()})
+        return Counter(map(lambda v: v[field], self))
+
+    def dedupe(self, threshold=0.85, jobs=1, **kwargs):
+        '''Return the clusters of (probable) duplicate persons, see
+        dedupe.find_duplicates()'''
+        from dedupe import find_duplicates
+        return find_duplicates(self, threshold=threshold, jobs=jobs, **kwargs)
 
     def __len__(self):
         return len(self._items)
 
-fred = Person(fname='Fred', sname='Flintstone', gender='m',
-          email='fred@bedrock.place')
-wilma = Person(fname='Wilma', sname='Flintstone', gender='f',
-           email='wilma@bedrock.place')
-ab = Addressbook(name='The Flintstones')
-ab.add(fred)
-ab.add(wilma)
+if __name__ == '__main__':
+    fred = Person(fname='Fred', sname='Flintstone', gender='m',
+              email='fred@bedrock.place')
+    wilma = Person(fname='Wilma', sname='Flintstone', gender='f',
+               email='wilma@bedrock.place')
+    ab = Addressbook(name='The Flintstones', indexed=('email', 'gender'))
+    ab.add(fred)
+    ab.add(wilma)
+
+    gender_data_iterator = map(lambda v: v['gender'], ab)
 
-gender_data_iterator = map(lambda v: v['gender'], ab)
+    res = Counter(gender_data_iterator)
+    print(res)
 
-res = Counter(gender_data_iterator)
-print(res)
+    # the same, but using the index on "gender"
+    print(ab.group_counts('gender'))
+    print(ab.find(email='wilma@bedrock.place'))
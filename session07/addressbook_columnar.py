@@ -0,0 +1,199 @@
+'''A column-oriented, memory-mapped Addressbook for very large contact sets
+
+Instead of millions of Person objects, each field is stored as a column in a
+single file: a table of offsets followed by the UTF-8 encoded strings. The
+file is memory-mapped, so opening even a 10M-entry address book is
+near-instant, and only the pages that are actually read are loaded.
+
+- Person objects are only created when the address book is iterated or
+  indexed, e.g.: `ab[42]`
+- `column()`, `find()` and `group_counts()` only read the column(s) they
+  need, the other columns are never touched
+- `add()` keeps new persons in memory, until `save()` writes a new file
+
+The iterator protocol (`__iter__`, `__len__`) and `add()` are the same as of
+`Addressbook`, so existing code keeps working:
+
+    >>> ab = ColumnarAddressbook.create('flintstones.ab', [fred, wilma])
+    >>> Counter(map(lambda v: v['gender'], ab))
+    Counter({'m': 1, 'f': 1})
+'''
+
+import array
+import json
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+from collections import Counter
+
+from addressbook import Person
+
+MAGIC = b'PTCOLAB1'                     # file type and format version
+FIELDS = tuple(Person.__dataclass_fields__)
+
+
+class ColumnarAddressbook:
+    '''Read-mostly Addressbook stored in the columnar file `path`'''
+
+    def __init__(self, path, name='My Addressbook'):
+        self.path = path
+        self.name = name
+        self._new = []                  # added, but not yet saved
+        self._mm = None
+        self._count = 0
+        self._columns = {}              # field: (offsets, data start)
+        if os.path.exists(path):
+            self._open()
+
+    def _open(self):
+        with open(self.path, 'rb') as fh:
+            self._mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        mm = self._mm
+        if mm[:8] != MAGIC:
+            raise ValueError(f'{self.path} is not a columnar address book')
+        header_len, = struct.unpack_from('<Q', mm, 8)
+        header = json.loads(mm[16:16 + header_len])
+        self.name = header['name']
+        self._count = header['count']
+        view = memoryview(mm)
+        for f, col in header['columns'].items():
+            offsets = view[col['offsets']:col['offsets'] + 8 * (self._count + 1)]
+            self._columns[f] = (offsets.cast('Q'), col['data'])
+
+    def close(self):
+        if self._mm is not None:
+            for offsets, _ in self._columns.values():
+                offsets.release()
+            self._columns = {}
+            self._mm.close()
+            self._mm = None
+
+    def __len__(self):
+        return self._count + len(self._new)
+
+    def _value(self, field, i):
+        offsets, data = self._columns[field]
+        return self._mm[data + offsets[i]:data + offsets[i + 1]].decode()
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('Addressbook index out of range')
+        if i >= self._count:
+            return self._new[i - self._count]
+        return Person(*(self._value(f, i) for f in FIELDS))
+
+    def column(self, field):
+        '''Iterate over the values of a single `field` (column)'''
+        if self._count:
+            offsets, data = self._columns[field]
+            mm = self._mm
+            start = data + offsets[0]
+            for end in offsets[1:]:
+                end += data
+                yield mm[start:end].decode()
+                start = end
+        for person in self._new:
+            yield getattr(person, field)
+
+    def __iter__(self):
+        for values in zip(*(self.column(f) for f in FIELDS)):
+            yield Person(*values)
+
+    def add(self, person):
+        self._new.append(person)
+
+    def find(self, **criteria):
+        '''Return the persons matching all `criteria`; only the columns in
+        `criteria` are scanned'''
+        fields = list(criteria)
+        wanted = tuple(criteria[f] for f in fields)
+        hits = (i for i, values in enumerate(zip(*map(self.column, fields)))
+                if values == wanted)
+        return [self[i] for i in hits]
+
+    def group_counts(self, field):
+        '''Return a Counter of the values of `field`'''
+        return Counter(self.column(field))
+
+    def dedupe(self, threshold=0.85, jobs=1, **kwargs):
+        '''Return the clusters of (probable) duplicate persons, see
+        dedupe.find_duplicates()'''
+        from dedupe import find_duplicates
+        return find_duplicates(self, threshold=threshold, jobs=jobs, **kwargs)
+
+    def save(self, path=None):
+        '''Write all persons (incl. the added ones) to `path` (default: the
+        file of this address book) and re-open it'''
+        path = path or self.path
+        tmp = f'{path}.tmp{os.getpid()}'
+        write(tmp, self, self.name)
+        self.close()
+        os.replace(tmp, path)
+        self.path, self._new = path, []
+        self._open()
+        return self
+
+    @classmethod
+    def create(cls, path, persons=(), name='My Addressbook'):
+        '''Write the Person objects in `persons` to `path`, return the new
+        ColumnarAddressbook'''
+        write(path, persons, name)
+        return cls(path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def write(path, persons, name='My Addressbook'):
+    '''Write the Person objects of iterable `persons` as a columnar file
+
+    The strings of every column are streamed to a temporary file, only the
+    offsets (8 bytes/person/column) are kept in memory. The offsets are
+    written in the native byte order of the machine.
+    '''
+    offsets = {f: array.array('Q', [0]) for f in FIELDS}
+    blobs = {f: tempfile.TemporaryFile() for f in FIELDS}
+    count = 0
+    for person in persons:
+        for f in FIELDS:
+            offsets[f].append(offsets[f][-1]
+                              + blobs[f].write(getattr(person, f).encode()))
+        count += 1
+
+    # layout: MAGIC, header length, header (JSON), per column: offsets, data
+    columns, pos = {}, 0
+    for f in FIELDS:
+        columns[f] = {'offsets': pos}
+        pos += 8 * len(offsets[f])
+        columns[f]['data'] = pos
+        pos += offsets[f][-1]
+        pos += -pos % 8                 # align the next offsets table
+    header = {'name': name, 'count': count, 'columns': columns}
+    # the positions are relative to the end of the header; make them absolute
+    header_len = len(json.dumps(header).encode())
+    while True:
+        base = 16 + header_len
+        base += -base % 8
+        header['columns'] = {f: {k: v + base for k, v in col.items()}
+                             for f, col in columns.items()}
+        encoded = json.dumps(header).encode()
+        if len(encoded) <= header_len:
+            break
+        header_len = len(encoded)
+
+    with open(path, 'wb') as fh:
+        fh.write(MAGIC + struct.pack('<Q', header_len))
+        fh.write(encoded.ljust(base - 16))
+        for f in FIELDS:
+            fh.write(offsets[f].tobytes())
+            blobs[f].seek(0)
+            shutil.copyfileobj(blobs[f], fh)
+            blobs[f].close()
+            fh.write(b'\0' * (-fh.tell() % 8))
@@ -0,0 +1,226 @@
+'''Find duplicate persons in an address book
+
+Comparing every person with every other person is O(n²). Instead, persons
+are grouped into "blocks" by cheap blocking keys, e.g.:
+
+- normalized surname prefix + initial of the first name
+- email domain + phonetic (Soundex) code of the surname
+- Soundex code of the surname + of the first name
+
+and only persons sharing a block are compared (scored) with a configurable
+similarity function. Very large blocks are not compared pair-wise, but with
+a sliding window over the block sorted by the compared fields, e.g.: name
+("sorted neighbourhood"). Pairs scoring above the threshold are joined into
+clusters of duplicates.
+
+    >>> clusters = find_duplicates(ab, threshold=0.85, jobs=4)
+'''
+
+import difflib
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from itertools import combinations, islice
+from types import SimpleNamespace
+
+
+def normalize(s):
+    '''Lower-case `s`, strip accents and everything but letters and digits'''
+    s = unicodedata.normalize('NFKD', s)
+    return ''.join(c for c in s.lower() if c.isalnum())
+
+
+def soundex(name):
+    '''Return the Soundex code of `name`, e.g.: Robert -> R163'''
+    name = normalize(name)
+    name = ''.join(c for c in name if c.isalpha())
+    if not name:
+        return ''
+    codes = {c: str(d) for d, letters in enumerate(
+        ('aeiouy', 'bfpv', 'cgjkqsxz', 'dt', 'l', 'mn', 'r')) for c in letters}
+    out, last = name[0].upper(), codes.get(name[0], '')
+    for c in name[1:]:
+        code = codes.get(c, '')         # h and w are ignored
+        if code and code != last and code != '0':
+            out += code
+        if c not in 'hw':
+            last = code
+    return (out + '000')[:4]
+
+
+def email_parts(email):
+    '''Return the normalized (local part, domain) of an email address,
+    e.g.: "Fred.Flintstone+news@Bedrock.place" -> ("fredflintstone",
+    "bedrock.place")'''
+    local, _, domain = email.lower().rpartition('@')
+    return normalize(local.split('+', 1)[0]), domain.strip()
+
+
+def blocking_keys(person):
+    '''Return the blocking keys of `person`'''
+    sname, fname = normalize(person.sname), normalize(person.fname)
+    local, domain = email_parts(person.email)
+    keys = []
+    if sname:
+        keys.append('s:' + sname[:4] + fname[:1])
+        keys.append('p:' + soundex(sname) + soundex(fname))
+    if domain:
+        keys.append('d:' + domain + soundex(sname))
+    if local:
+        keys.append('e:' + local)
+    return keys
+
+
+def prepare(person):
+    '''Return the normalized fields of `person` compared by similarity():
+    (name, gender, local part of the email, domain of the email)'''
+    local, domain = email_parts(person.email)
+    return (normalize(person.fname + person.sname), person.gender.lower(),
+            local, domain)
+
+
+def similarity(a, b, threshold=0.0):
+    '''Return the similarity (0..1) of the prepare()-d persons `a` and `b`
+
+    The cheap upper bounds of difflib are checked first: if `a` and `b`
+    cannot reach `threshold`, 0.0 is returned without the exact comparison.
+    '''
+    a_name, a_gender, a_local, a_domain = a
+    b_name, b_gender, b_local, b_domain = b
+    if a_gender and b_gender and a_gender != b_gender:
+        return 0.0
+    names = difflib.SequenceMatcher(None, a_name, b_name)
+    if not (a_local and b_local):
+        if names.real_quick_ratio() < threshold:
+            return 0.0
+        return names.ratio()
+    emails = difflib.SequenceMatcher(None, a_local, b_local)
+    weight = 1.0 if a_domain == b_domain else 0.9
+    score = lambda name, email: max(name, (2 * name + email * weight) / 3)
+    for bound in ('real_quick_ratio', 'quick_ratio'):
+        if score(getattr(names, bound)(),
+                 getattr(emails, bound)()) < threshold:
+            return 0.0
+    return score(names.ratio(), emails.ratio())
+
+
+def candidate_pairs(blocks, order, max_block=100, window=20):
+    '''Yield the (i, j) index pairs of the persons sharing a block of
+    `blocks` ({blocking key: [index, ...]}), each pair only once; `order(i)`
+    returns the sort key of person i in the blocks larger than `max_block`
+
+    Instead of remembering every yielded pair, a pair is skipped if an
+    earlier block yielded it: its persons are in that block, and (if it is
+    a large one) at most `window` positions apart.
+    '''
+    blocks = [members for members in blocks.values() if len(members) > 1]
+    where = {}                          # index: [(block nr., position), ...]
+    for b, members in enumerate(blocks):
+        if len(members) > max_block:    # sorted neighbourhood
+            members.sort(key=order)
+        for pos, i in enumerate(members):
+            where.setdefault(i, []).append((b, pos))
+
+    def seen(i, j, b):
+        'Did a block before block `b` yield the pair (i, j)?'
+        for c, pos in where[i]:
+            if c >= b:
+                return False
+            for d, other in where[j]:
+                if d == c:              # both in block c, within the window?
+                    if (len(blocks[c]) <= max_block
+                            or abs(pos - other) <= window):
+                        return True
+                    break
+        return False
+
+    for b, members in enumerate(blocks):
+        if len(members) <= max_block:
+            pairs = combinations(members, 2)
+        else:
+            pairs = ((a, c) for n, a in enumerate(members)
+                     for c in members[n + 1:n + 1 + window])
+        for i, j in pairs:
+            if not seen(i, j, b):
+                yield i, j
+
+
+def _column_records(ab):
+    '''Iterate over the persons of the ColumnarAddressbook `ab`: its columns
+    are read into a single, re-used record, instead of creating a Person
+    for each'''
+    from addressbook import Person
+    fields = tuple(Person.__dataclass_fields__)
+    record = SimpleNamespace()
+    for values in zip(*map(ab.column, fields)):
+        record.__dict__.update(zip(fields, values))
+        yield record
+
+
+def _score(args):
+    'Score a batch of pairs, return the ones above the threshold'
+    batch, sim, threshold = args
+    return [(i, j) for i, a, j, b in batch
+            if sim(a, b, threshold) >= threshold]
+
+
+def _batches(pairs, rows, size, sim, threshold):
+    'Group `pairs` into batches, with the data of the persons included'
+    pairs = iter(pairs)
+    while batch := list(islice(pairs, size)):
+        yield [(i, rows[i], j, rows[j]) for i, j in batch], sim, threshold
+
+
+def find_duplicates(persons, threshold=0.85, sim=similarity,
+                    prep=prepare, keys=blocking_keys, jobs=1,
+                    batch_size=10_000):
+    '''Return the clusters (lists of 2 or more Person objects) of duplicates
+    in `persons`
+
+    `sim(a, b, threshold)` gets 2 persons as returned by `prep(person)` and
+    returns their similarity (0..1); with `jobs` > 1 the scoring runs in a
+    process pool, then `sim` has to be a module-level function.
+
+    Of a ColumnarAddressbook only the columns are read, Person objects are
+    created only for the reported duplicates; `keys(person)` and
+    `prep(person)` must not keep a reference to `person`.
+    '''
+    if hasattr(persons, 'column'):      # e.g.: ColumnarAddressbook
+        records, person = _column_records(persons), persons.__getitem__
+    else:
+        records = list(persons)
+        person = records.__getitem__
+    rows, blocks = [], {}
+    for i, p in enumerate(records):
+        rows.append(prep(p))            # normalize every person only once
+        for key in keys(p):
+            blocks.setdefault(key, []).append(i)
+    # the large blocks are sorted by the normalized fields, e.g.: name
+    work = _batches(candidate_pairs(blocks, rows.__getitem__), rows,
+                    batch_size, sim, threshold)
+    if jobs > 1:
+        matches = []
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            pending = set()
+            for args in work:           # max. 2 batches/worker in flight
+                pending.add(pool.submit(_score, args))
+                if len(pending) >= 2 * jobs:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    matches.extend(m for f in done for m in f.result())
+            matches.extend(m for f in pending for m in f.result())
+    else:
+        matches = [m for ms in map(_score, work) for m in ms]
+
+    parent = list(range(len(rows)))     # union-find of the matched pairs
+    def root(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+    for i, j in matches:
+        parent[root(i)] = root(j)
+
+    clusters = {}
+    for i in {i for pair in matches for i in pair}:
+        clusters.setdefault(root(i), []).append(i)
+    return [[person(i) for i in sorted(members)]
+            for members in sorted(clusters.values(), key=min)]
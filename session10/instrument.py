@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+
+'''Shared instrumentation for command-line programs
+
+Adds the following CLI options to an ``argparse`` parser, so the hot spots of
+a program can be found without changing its code:
+
+  --profile [FILE]        profile with cProfile, log the top functions
+                          (sorted by cumulative time) and optionally save the
+                          raw stats to FILE (for ``pstats`` or snakeviz)
+  --profile-format collapsed
+                          sample the call stacks instead, and write them to
+                          FILE in "collapsed" format, e.g.: for flamegraph.pl
+  --trace-memory [N]      trace memory allocations with tracemalloc, log the
+                          top N allocating lines and the peak memory use
+  --timings               log the wall-clock time of the phases of the
+                          program, e.g.: "parse args", "load", "compute" and
+                          "output"
+
+All reports are emitted through the ``logging`` module, by the "instrument"
+logger. A program mounts it like this: ::
+
+    import instrument
+
+    def parseargs(cmdline=sys.argv[1:]):
+        p = argparse.ArgumentParser()
+        ...
+        instrument.add_arguments(p)
+        return instrument.check_arguments(p, p.parse_args(cmdline))
+
+    with instrument.phase('parse args'):
+        args = parseargs()
+    with instrument.instrumented(args):
+        with instrument.phase('load'):
+            data = load(args.file)
+        ...
+
+Scripts without a ``main()`` function can call ``instrument.start(args)`` and
+``instrument.stop()`` instead of using ``instrumented()``.
+'''
+
+import contextlib
+import io
+import logging
+import os
+import sys
+import threading
+import time
+
+# Program details
+__author__ = 'Gábor Nyers'
+__version__ = '0.1.0'
+__license__ = 'CC BY-NC 4.0'
+
+log = logging.getLogger('instrument')
+
+
+def add_arguments(parser):
+    '''Add the instrumentation options to the argparse `parser`'''
+    g = parser.add_argument_group('instrumentation')
+    g.add_argument('--profile', nargs='?', const='', default=None,
+                   metavar='FILE',
+                   help='profile the program, log the top functions; save '
+                   'the profile data to FILE, if provided')
+    g.add_argument('--profile-format', choices=['pstats', 'collapsed'],
+                   default='pstats',
+                   help='pstats: cProfile (default); collapsed: sampled call '
+                   'stacks for flame graphs, written to FILE')
+    g.add_argument('--profile-limit', type=int, default=25, metavar='N',
+                   help='log the top N functions of the profile (default: 25)')
+    g.add_argument('--trace-memory', nargs='?', type=int, const=10,
+                   default=None, metavar='N',
+                   help='trace memory allocations, log the top N (default: '
+                   '10) allocating lines and the peak')
+    g.add_argument('--timings', action='store_true',
+                   help='log the wall-clock time of the program\'s phases')
+    return parser
+
+
+def check_arguments(parser, args):
+    '''Report the invalid combinations of the instrumentation options in the
+    parsed `args` as usage errors of `parser`'''
+    if args.profile == '' and args.profile_format == 'collapsed':
+        parser.error('--profile-format collapsed needs a FILE: --profile FILE')
+    return args
+
+
+class StackSampler:
+    '''Sample the call stack of a thread every `interval` seconds, count the
+    samples per stack ("collapsed" format of flame graphs)'''
+
+    def __init__(self, thread_id=None, interval=0.001):
+        self.thread_id = thread_id or threading.main_thread().ident
+        self.interval = interval
+        self.stacks = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} '
+                             f'({os.path.basename(code.co_filename)}:'
+                             f'{code.co_firstlineno})')
+                frame = frame.f_back
+            if stack:
+                key = ';'.join(reversed(stack))
+                self.stacks[key] = self.stacks.get(key, 0) + 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name='StackSampler')
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def write(self, fh):
+        for stack, count in sorted(self.stacks.items()):
+            fh.write(f'{stack} {count}\n')
+
+
+class Instrumentation:
+    '''Phase timers, profiler and memory tracer of a program run'''
+
+    def __init__(self):
+        self.timings = {}               # phase name: seconds
+        self.peaks = {}                 # phase name: peak memory (bytes)
+        self.peak = 0                   # peak memory of the whole run
+        self._open = []                 # the peak so far of the open phases
+        self.args = None
+        self.profiler = None
+        self.sampler = None
+        self.tracing = False
+
+    def _fold_peak(self):
+        '''Add the traced peak since the last reset to the peaks of the run
+        and of the open phases'''
+        import tracemalloc
+        peak = tracemalloc.get_traced_memory()[1]
+        self.peak = max(self.peak, peak)
+        self._open = [max(p, peak) for p in self._open]
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        '''Measure the wall-clock time of the code in the `with` block'''
+        import tracemalloc
+        tracing = self.tracing
+        if tracing:                     # the peak of this phase only, but
+            self._fold_peak()           # keep the one of the run (so far)
+            self._open.append(0)
+            tracemalloc.reset_peak()
+        began = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - began
+            self.timings[name] = self.timings.get(name, 0) + elapsed
+            if tracing and self.tracing:
+                self._fold_peak()
+                peak = self._open.pop()
+                self.peaks[name] = max(self.peaks.get(name, 0), peak)
+                log.info('phase %s: %.3fs, peak memory: %.1f MB', name,
+                         elapsed, peak / 2**20)
+            else:
+                log.info('phase %s: %.3fs', name, elapsed)
+
+    def start(self, args):
+        '''Start the profiler and/or memory tracer requested in the parsed
+        CLI `args`'''
+        self.args = args
+        wanted = (getattr(args, 'profile', None) is not None
+                  or getattr(args, 'trace_memory', None) is not None
+                  or getattr(args, 'timings', False))
+        if not wanted:
+            return
+        if not logging.getLogger().handlers:
+            logging.basicConfig(stream=sys.stderr,
+                                format='%(asctime)s %(levelname)s '
+                                '(%(name)s) %(message)s')
+        log.setLevel(logging.INFO)
+        for name, seconds in self.timings.items():  # e.g.: "parse args"
+            log.info('phase %s: %.3fs', name, seconds)
+        if args.trace_memory is not None:
+            import tracemalloc
+            tracemalloc.start()
+            self.tracing = True
+        if args.profile is not None:
+            if args.profile_format == 'collapsed':
+                if not args.profile:
+                    raise ValueError('--profile-format collapsed needs a '
+                                     'FILE')
+                self.sampler = StackSampler()
+                self.sampler.start()
+            else:
+                import cProfile
+                self.profiler = cProfile.Profile()
+                self.profiler.enable()
+
+    def stop(self):
+        '''Stop the profiler and the memory tracer, log their reports'''
+        if self.profiler is not None:
+            self.profiler.disable()
+            import pstats
+            out = io.StringIO()
+            stats = pstats.Stats(self.profiler, stream=out)
+            stats.sort_stats('cumulative').print_stats(self.args.profile_limit)
+            log.info('profile (top %d by cumulative time):\n%s',
+                     self.args.profile_limit, out.getvalue().rstrip())
+            if self.args.profile:
+                self.profiler.dump_stats(self.args.profile)
+                log.info('profile data saved to %s', self.args.profile)
+            self.profiler = None
+        if self.sampler is not None:
+            self.sampler.stop()
+            with open(self.args.profile, 'w') as fh:
+                self.sampler.write(fh)
+            log.info('%d samples of call stacks saved to %s',
+                     sum(self.sampler.stacks.values()), self.args.profile)
+            self.sampler = None
+        if self.tracing:
+            import tracemalloc
+            snapshot = tracemalloc.take_snapshot()
+            self._fold_peak()
+            current = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            self.tracing = False
+            self._open = []
+            top = snapshot.filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, __file__),
+            )).statistics('lineno')[:self.args.trace_memory]
+            phases = ', '.join(f'{name} {peak / 2**20:.1f} MB'
+                               for name, peak in self.peaks.items())
+            log.info('memory: current %.1f MB, peak %.1f MB (per phase: %s); '
+                     'top %d allocations:\n%s', current / 2**20,
+                     self.peak / 2**20, phases or '-', len(top),
+                     '\n'.join(f'  {stat}' for stat in top))
+        if self.timings and log.isEnabledFor(logging.INFO):
+            log.info('phases: %s, total: %.3fs', ', '.join(
+                f'{name} {seconds:.3f}s'
+                for name, seconds in self.timings.items()),
+                sum(self.timings.values()))
+
+    @contextlib.contextmanager
+    def instrumented(self, args):
+        '''Instrument the code in the `with` block as requested in `args`'''
+        self.start(args)
+        try:
+            yield self
+        finally:
+            self.stop()
+
+
+# The instrumentation of the running program
+_default = Instrumentation()
+phase = _default.phase
+start = _default.start
+stop = _default.stop
+instrumented = _default.instrumented
@@ -4,6 +4,11 @@
 
 Render a Jinja2 template using data provided in a JSON, YAML or CSV file and
 in the CLI arguments.
+
+With --source-dir and --output-dir every template (*.j2) in a directory tree
+is rendered with the same data, in parallel, into the same relative path in
+the output directory (without the .j2 suffix); unchanged outputs are not
+rewritten.
 '''
 
 __author__ = 'Gábor Nyers'
@@ -11,15 +16,22 @@ __version__ = '0.1.0'
 __license__ = 'CC BY-NC 4.0'
 
 # imports of modules in Standard Library
+import contextlib
 import json
 import os
 import pathlib
+import shutil
 import sys
 from datetime import datetime
 from pprint import pprint
 # imports of 3rd-party modules
 import yaml
 import jinja2 as j2     # load Jinja2 module, refer to its content as "j2.*"
+# optional: --profile, --trace-memory and --timings
+try:
+    import instrument   # needs session10/instrument.py on the PYTHONPATH
+except ImportError:
+    instrument = None
 
 
 def parseargs(cmdline=sys.argv[1:].copy(),       # for safety use a copy of argv
@@ -52,6 +64,17 @@ def parseargs(cmdline=sys.argv[1:].copy(),       # for safety use a copy of argv
                    default=None,
                    help='file containing the data, '
                    'will be passed to template as variable "data"')
+    p.add_argument('--typed-csv',
+                   action='store_true',
+                   help='convert the values of a CSV data file to int, '
+                   'float, date, etc... (needs "csvengine.py" of session02 '
+                   'on the PYTHONPATH)')
+    p.add_argument('-j', '--jobs',
+                   type=int,
+                   default=None,
+                   help='nr. of processes to parse a large CSV data file '
+                   'with --typed-csv, or to render the templates of '
+                   '--source-dir (default: nr. of CPUs)')
     p.add_argument('-p', '--params',
                    metavar='name=value',
                    type=paramlist,
@@ -69,13 +92,44 @@ def parseargs(cmdline=sys.argv[1:].copy(),       # for safety use a copy of argv
                    type=pathlib.Path,
                    default=sys.stdout,
                    help='Write the output to this file (default: STDOUT)')
+    p.add_argument('-S', '--source-dir',
+                   type=pathlib.Path,
+                   default=None,
+                   help='render all templates in this directory tree, '
+                   'instead of a single template')
+    p.add_argument('-O', '--output-dir',
+                   type=pathlib.Path,
+                   default=None,
+                   help='write the rendered templates of --source-dir to '
+                   'this directory')
+    p.add_argument('--suffix',
+                   default='.j2',
+                   help='templates in --source-dir have this suffix, which '
+                   'is removed from the output file names (default: .j2)')
+    cache_dir_def = os.environ.get('J2PP_CACHE',
+                                   os.path.expanduser('~/.cache/j2pp'))
+    p.add_argument('--cache-dir',
+                   default=cache_dir_def,
+                   help='cache of the compiled templates of --source-dir, '
+                   '"" to disable (default: the value of env. variable '
+                   f'"J2PP_CACHE" or {cache_dir_def})')
     p.add_argument('template',
                    type=pathlib.Path,
                    nargs='?',
                    default=sys.stdin,
                    help='Template file (default: STDIN)')
 
+    if instrument:                               # --profile, --trace-memory,
+        instrument.add_arguments(p)              # --timings
     args = p.parse_args(cmdline)                 # parse all args!
+    if instrument:                               # e.g.: collapsed needs FILE
+        instrument.check_arguments(p, args)
+    if bool(args.source_dir) != bool(args.output_dir):
+        p.error('--source-dir and --output-dir go together')
+    if args.source_dir and isinstance(args.template, pathlib.Path):
+        p.error('either a template or --source-dir, not both')
+    if args.source_dir and not args.source_dir.is_dir():
+        p.error(f'{args.source_dir} is not a directory')
     if args.params:                              # if provided,
         args.params = dict(args.params)          # convert params to dict
     return args
@@ -94,8 +148,17 @@ def load_data_yaml(data_file):
     return data
 
 
-def load_data_csv(data_file, delimiter=','):
-    'Load CSV data'
+def load_data_csv(data_file, delimiter=',', typed=False, jobs=None):
+    '''Load CSV data
+
+    With `typed` the values are converted to int, float, date, etc... and
+    large files are parsed by `jobs` processes, see: session02/csvengine.py
+    '''
+    if typed:
+        from csvengine import CsvFile             # needs to be on PYTHONPATH
+        data = list(CsvFile(data_file, jobs=jobs,
+                            delimiter=delimiter).dicts())
+        return {'csv': data}
     import csv
     data_i = csv.DictReader(open(data_file),
                             delimiter=delimiter)
@@ -160,20 +223,152 @@ def render_template(*, template, template_dirs, **data):
     return out
 
 
-def main():
-    '''Immediate code if module is run directly, instead of being imported
+def find_templates(source_dir, suffix='.j2', skip=None):
+    '''Return the names of the templates (files ending with `suffix`) below
+    `source_dir`, relative to it, with "/" as separator; except those in the
+    directory `skip`, e.g.: the output directory
+    '''
+    names = []
+    skip = os.path.realpath(skip) if skip else None
+    for path, subdirs, files in os.walk(source_dir):
+        subdirs[:] = sorted(d for d in subdirs
+                            if os.path.realpath(os.path.join(path, d)) != skip)
+        rel = os.path.relpath(path, source_dir)
+        prefix = '' if rel == '.' else rel.replace(os.sep, '/') + '/'
+        names.extend(prefix + f for f in sorted(files) if f.endswith(suffix))
+    return names
+
+
+def make_environment(search_path, cache_dir=None):
+    '''Return a Jinja2 Environment loading templates from `search_path`;
+    compiled templates are cached in `cache_dir` (shared by processes)'''
+    cache = None
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        cache = j2.FileSystemBytecodeCache(cache_dir)
+    return j2.Environment(loader=j2.FileSystemLoader(search_path),
+                          undefined=j2.StrictUndefined,
+                          bytecode_cache=cache,
+                          auto_reload=False)   # templates won't change
+
+
+def write_if_changed(path, content, mode_from=None):
+    '''Write the bytes `content` to `path`, unless it has the same content
+    already (keeping its mtime); copy the permissions of file `mode_from`.
+    Return True if the file was written.'''
+    try:
+        if os.path.getsize(path) == len(content):
+            with open(path, 'rb') as fh:
+                if fh.read() == content:
+                    return False
+    except FileNotFoundError:
+        pass
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp = f'{path}.tmp{os.getpid()}'
+    with open(tmp, 'wb') as fh:
+        fh.write(content)
+    if mode_from:
+        shutil.copymode(mode_from, tmp)     # e.g.: keep scripts executable
+    os.replace(tmp, path)                   # never leave a half-written file
+    return True
+
+
+_worker = {}                                # Environment and data of a worker
+# the CLI args of --source-dir, passed to render_tree() as its options
+TREE_OPTIONS = ('template', 'output', 'source_dir', 'output_dir', 'suffix',
+                'jobs', 'cache_dir')
+
+
+def init_worker(search_path, cache_dir, data):
+    'Create the Environment of a worker process, once'
+    _worker['env'] = make_environment(search_path, cache_dir)
+    _worker['data'] = data
+
+
+def render_batch(jobs):
+    '''Render (template name, source path, output path) `jobs`, return
+    (name, status) tuples; status: "written", "unchanged" or an error'''
+    env, data = _worker['env'], _worker['data']
+    results = []
+    for name, source, output in jobs:
+        try:
+            out = env.get_template(name).render(dict(data, template=name))
+            changed = write_if_changed(output, out.encode(), source)
+            results.append((name, 'written' if changed else 'unchanged'))
+        except j2.exceptions.TemplateError as e:
+            results.append((name, f'*** Template ERROR: {e}'))
+        except Exception as e:
+            results.append((name, f'*** ERROR: {e}'))
+    return results
+
+
+def render_tree(*, source_dir, output_dir, suffix='.j2', template_dirs=(),
+                jobs=None, cache_dir=None, data=None):
+    '''Render every template in `source_dir` into `output_dir` with the
+    template variables in dict `data`, in `jobs` processes; return the
+    (template name, status) tuples
+
+    Every worker process creates its Environment once; the compiled
+    templates are shared through the bytecode cache in `cache_dir`.
     '''
-    args = parseargs()                      # parse CLI arguments
+    names = find_templates(source_dir, suffix, skip=output_dir)
+    work = [(name, os.path.join(source_dir, name),
+             os.path.join(output_dir, name[:-len(suffix)] if suffix
+                          else name))
+            for name in names]
+    search_path = [str(source_dir)] + [str(d) for d in template_dirs]
+    initargs = (search_path, cache_dir, data or {})
+    jobs = min(jobs or os.cpu_count() or 1, max(1, len(work) // 100))
+    if jobs == 1:                           # not worth starting processes
+        init_worker(*initargs)
+        return render_batch(work)
+    from concurrent.futures import ProcessPoolExecutor
+    size = max(1, min(200, len(work) // (jobs * 8)))
+    batches = [work[i:i + size] for i in range(0, len(work), size)]
+    results = []
+    with ProcessPoolExecutor(max_workers=jobs, initializer=init_worker,
+                             initargs=initargs) as pool:
+        for batch in pool.map(render_batch, batches):
+            results.extend(batch)
+    return results
+
+
+def phase(name):
+    'Time a phase of the program, see: session10/instrument.py'
+    return instrument.phase(name) if instrument else contextlib.nullcontext()
 
-    if args.data_file:                      # if provided, load data from file
-        data = load_data(data_file=args.data_file)
-    else:
-        data = {}                           # or set it to empty dict
 
+def main():
+    '''Immediate code if module is run directly, instead of being imported
+    '''
+    with phase('parse args'):
+        args = parseargs()                  # parse CLI arguments
+    if not instrument:
+        return run(args)
+    with instrument.instrumented(args):     # --profile, --trace-memory, ...
+        return run(args)
+
+
+def run(args):
+    'Render the template as requested by the CLI `args`'
+    csv_opts = {}                           # opt-in: typed, parallel CSV
+    if args.typed_csv and args.data_file and args.data_file.suffix == '.csv':
+        csv_opts = dict(typed=True, jobs=args.jobs)
+
+    with phase('load'):
+        if args.data_file:                  # if provided, load data from file
+            data = load_data(data_file=args.data_file, **csv_opts)
+        else:
+            data = {}                       # or set it to empty dict
+
+    cli_args = dict(args.__dict__)
+    if args.source_dir:                     # options of the tree rendering,
+        for key in TREE_OPTIONS:            # not needed (nor picklable)
+            del cli_args[key]
     all_data = dict(                        # data to pass to template:
         now=datetime.now(),                 # - current timestamp
         data=data,                          # - all data from data-file
-        **args.__dict__,                    # - all CLI args to template
+        **cli_args,                         # - all CLI args to template
     )
     if data:                                # if provided, add the unpacked
         all_data.update(**data)             # data from the --data file
@@ -185,17 +380,43 @@ def main():
         pprint(all_data)                    # dump all data as it would be
         sys.exit(0)                         # passed to template and exit.
 
-    out = render_template(**all_data)       # render the template
+    if args.source_dir:                     # render a tree of templates
+        return run_tree(args, all_data)
+
+    with phase('render'):
+        out = render_template(**all_data)   # render the template
 
-    if isinstance(args.output, pathlib.Path):
-        fh = open(args.output, 'w')         # open output file for writing
-    else:
-        fh = args.output                    # stdout, i.e.: a file handler
+    with phase('output'):
+        if isinstance(args.output, pathlib.Path):
+            fh = open(args.output, 'w')     # open output file for writing
+        else:
+            fh = args.output                # stdout, i.e.: a file handler
 
-    fh.write(out)                           # write generated content to file
+        fh.write(out)                       # write generated content to file
 
     return 0                                # main successfull exit code 0
 
 
+def run_tree(args, all_data):
+    'Render the templates of --source-dir, report the changes on STDERR'
+    with phase('render'):
+        results = render_tree(source_dir=args.source_dir,
+                              output_dir=args.output_dir,
+                              suffix=args.suffix,
+                              template_dirs=args.template_dirs,
+                              jobs=args.jobs,
+                              cache_dir=args.cache_dir or None,
+                              data=all_data)
+    errors = [(name, status) for name, status in results
+              if status not in ('written', 'unchanged')]
+    for name, msg in errors:
+        print(f'{name}: {msg}', file=sys.stderr)
+    written = sum(status == 'written' for name, status in results)
+    print(f'Rendered {len(results)} templates: {written} written, '
+          f'{len(results) - written - len(errors)} unchanged, '
+          f'{len(errors)} errors', file=sys.stderr)
+    return 10 if errors else 0
+
+
 if __name__ == '__main__':
     sys.exit(main())